@@ -24,7 +24,9 @@ sys.path.append('hooks/')
 import charmhelpers.core as ch_core
 import charmhelpers.contrib.openstack.utils as ch_openstack_utils
 import charmhelpers.contrib.network.ovs as ch_ovs
-import charmhelpers.contrib.network.ovs.ovsdb as ch_ovsdb
+
+import ovs_state
+import ovsdb_jsonrpc
 
 
 class BaseDocException(Exception):
@@ -56,9 +58,10 @@ def remove_patch_ports(bridge):
     :param bridge: Name of bridge to look for patch ports to remove.
     :type bridge: str
     """
-    # NOTE: We need to consume all output from the `patch_ports_on_bridge`
-    # generator prior to removing anything otherwise it will raise an error.
-    for patch in list(ch_ovs.patch_ports_on_bridge(bridge)):
+    # NOTE: The snapshot is taken before removing anything, so each end of
+    # every patch is looked up in the same consistent view of the database.
+    snapshot = ovs_state.OVSDBSnapshot.load()
+    for patch in snapshot.patch_ports_on_bridge(bridge):
         ch_ovs.del_bridge_port(
             patch.this_end.bridge,
             patch.this_end.port,
@@ -71,7 +74,7 @@ def remove_patch_ports(bridge):
 
 def remove_per_bridge_controllers():
     """Remove per bridge controllers."""
-    bridges = ch_ovsdb.SimpleOVSDB('ovs-vsctl').bridge
+    bridges = ovsdb_jsonrpc.SimpleOVSDB('ovs-vsctl').bridge
     for bridge in bridges:
         if bridge['controller']:
             bridges.clear(str(bridge['_uuid']), 'controller')
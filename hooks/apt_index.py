@@ -0,0 +1,122 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Package index updates skipped while the index is fresh.
+
+``apt-get update`` fetches the index of every package source, which takes
+a minute on hosts behind a slow mirror proxy.  Here it only runs when the
+index is older than a time to live or than the package sources, which
+``add_source`` changes.  The duration of each update is recorded in
+unitdata so skipped updates can report the time saved.
+"""
+
+import os
+import time
+
+from charmhelpers.core.hookenv import (
+    log,
+    DEBUG,
+    INFO,
+)
+from charmhelpers.core.unitdata import kv
+from charmhelpers.fetch import apt_update
+
+APT_INDEX_KEY = 'apt_index.update'
+
+APT_LISTS = '/var/lib/apt/lists'
+
+# Written by add_source, including the keys of the sources.
+SOURCES_PATHS = (
+    '/etc/apt/sources.list',
+    '/etc/apt/sources.list.d',
+    '/etc/apt/trusted.gpg',
+    '/etc/apt/trusted.gpg.d',
+)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def sources_mtime():
+    """Time of the last change of the package sources.
+
+    :rtype: Optional[float]
+    """
+    mtimes = []
+    for path in SOURCES_PATHS:
+        mtimes.append(_mtime(path))
+        if os.path.isdir(path):
+            mtimes.extend(_mtime(os.path.join(path, name))
+                          for name in os.listdir(path))
+    return max([mtime for mtime in mtimes if mtime is not None],
+               default=None)
+
+
+def updated():
+    """Time of the last update of the package index.
+
+    Updates by the charm are recorded, updates outside of the charm are
+    detected from the modification of the lists directory.
+
+    :rtype: Optional[float]
+    """
+    mtimes = [(kv().get(APT_INDEX_KEY) or {}).get('time'), _mtime(APT_LISTS)]
+    return max([mtime for mtime in mtimes if mtime is not None],
+               default=None)
+
+
+def fresh(ttl):
+    """Whether the package index is newer than ttl and the sources.
+
+    :param ttl: Age in seconds up to which the index is fresh
+    :type ttl: int
+    :rtype: bool
+    """
+    last_update = updated()
+    if not ttl or last_update is None:
+        return False
+    if time.time() - last_update > ttl:
+        return False
+    sources_changed = sources_mtime()
+    return sources_changed is None or sources_changed < last_update
+
+
+def update(ttl, fatal=False):
+    """Update the package index unless it is fresh.
+
+    :param ttl: Age in seconds up to which the index is fresh
+    :type ttl: int
+    :param fatal: Whether the command's output should be checked and
+                  retried
+    :type fatal: bool
+    :returns: Whether the index was updated
+    :rtype: bool
+    """
+    db = kv()
+    recorded = db.get(APT_INDEX_KEY) or {}
+    if fresh(ttl):
+        log('Package index is fresh, skipped apt-get update saving {:.1f}s'
+            .format(recorded.get('duration', 0)), level=DEBUG)
+        return False
+    start = time.time()
+    apt_update(fatal=fatal)
+    duration = time.time() - start
+    log('apt-get update took {:.1f}s'.format(duration), level=INFO)
+    db.set(APT_INDEX_KEY, {'time': time.time(), 'duration': duration})
+    db.flush()
+    return True
@@ -0,0 +1,356 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Track which rendered configuration files actually change.
+
+``charmhelpers.core.host.restart_on_change_helper`` hashes every file in the
+restart map before and after the decorated function runs, while the
+renderer writing those files already knows what it produced.  The renderer
+provided here records a digest of every file it renders, leaves files with
+byte-identical content untouched and reports the files it did change to the
+``restart_on_change`` decorator provided here.
+"""
+
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import time
+
+from collections import OrderedDict
+
+from charmhelpers.contrib.openstack import templating
+from charmhelpers.contrib.openstack.utils import is_unit_paused_set
+from charmhelpers.core.hookenv import (
+    log,
+    DEBUG,
+    ERROR,
+    INFO,
+)
+from charmhelpers.core.host import path_hash
+from charmhelpers.core.unitdata import kv
+
+from deferred_restarts import request_restart
+
+DIGESTS_KEY = 'change_tracking.digests'
+
+# Paths registered with a ChangeTrackingConfigRenderer, changes to these are
+# reported by the renderer rather than detected by hashing the file.
+_TRACKED_PATHS = set()
+# Change sets of the active ``track_changes`` blocks, innermost last.
+_CHANGE_SETS = []
+
+
+@contextlib.contextmanager
+def track_changes():
+    """Collect paths changed by renderers while the block executes.
+
+    Blocks may be nested, changes are reported to every active block.
+
+    :returns: Context manager yielding the set of changed paths
+    :rtype: Iterator[Set[str]]
+    """
+    changed = set()
+    _CHANGE_SETS.append(changed)
+    try:
+        yield changed
+    finally:
+        _CHANGE_SETS.remove(changed)
+
+
+def _file_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class ContextCache(object):
+    """Results of context generators for one render pass.
+
+    Generators of the same class constructed with the same arguments produce
+    the same context within a pass, so only the first one is called.  The
+    others take over its state, e.g. ``missing_data``, as if they had been
+    called themselves.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._keys = {}
+        self._results = {}
+
+    def _key(self, context):
+        # NOTE: keyed on the state prior to the first call, as generators
+        #       update attributes such as ``complete`` when called.
+        if id(context) not in self._keys:
+            self._keys[id(context)] = (
+                type(context),
+                json.dumps(vars(context), sort_keys=True, default=str))
+        return self._keys[id(context)]
+
+    def __call__(self, context):
+        """Evaluate context generator, once per class and arguments.
+
+        :param context: Context generator
+        :type context: Callable[[], Dict[str, any]]
+        :returns: Context
+        :rtype: Dict[str, any]
+        """
+        key = self._key(context)
+        if key in self._results:
+            source, result = self._results[key]
+            if source is not context:
+                context.__dict__.update(source.__dict__)
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = context()
+        self._results[key] = (context, result)
+        return result
+
+
+class ContextCachingConfigTemplate(templating.OSConfigTemplate):
+    """OSConfigTemplate evaluating contexts through the renderer cache."""
+
+    def __init__(self, renderer, config_file, contexts,
+                 config_template=None):
+        super(ContextCachingConfigTemplate, self).__init__(
+            config_file, contexts, config_template=config_template)
+        self._renderer = renderer
+
+    def context(self):
+        cache = self._renderer.context_cache
+        if cache is None:
+            return super(ContextCachingConfigTemplate, self).context()
+        ctxt = {}
+        for context in self.contexts:
+            _ctxt = cache(context)
+            if _ctxt:
+                ctxt.update(_ctxt)
+                # track interfaces for every complete context.
+                [self._complete_contexts.append(interface)
+                 for interface in context.interfaces
+                 if interface not in self._complete_contexts]
+        return ctxt
+
+
+class ChangeTrackingConfigRenderer(templating.OSConfigRenderer):
+    """OSConfigRenderer that only writes files whose content changed.
+
+    The digest, modification time and size of each written file are kept
+    in unitdata.  When a file still has the recorded modification time and
+    size, a render with the recorded digest is known to be identical without
+    reading the file back.  Otherwise the file is compared with the rendered
+    content.  Files that did change are replaced atomically.
+
+    Contexts are shared between all files written by one ``write_all``, see
+    ``ContextCache``.
+    """
+
+    def __init__(self, templates_dir, openstack_release):
+        super(ChangeTrackingConfigRenderer, self).__init__(
+            templates_dir, openstack_release)
+        self.context_cache = None
+
+    def register(self, config_file, contexts, config_template=None):
+        """
+        Register a config file with a list of context generators to be called
+        during rendering.
+        """
+        self.templates[config_file] = ContextCachingConfigTemplate(
+            self, config_file, contexts, config_template=config_template)
+        _TRACKED_PATHS.add(config_file)
+        log('Registered config file: {}'.format(config_file), level=INFO)
+
+    def _unchanged(self, config_file, data, digest, digests):
+        """Determine whether file already has the rendered content.
+
+        :param config_file: Path to file
+        :type config_file: str
+        :param data: Rendered content
+        :type data: bytes
+        :param digest: Digest of rendered content
+        :type digest: str
+        :param digests: Recorded digest, mtime and size keyed by path
+        :type digests: Dict[str, List[Union[str, int]]]
+        :returns: None if the file differs, otherwise whether it matches the
+                  recorded digest without having to read it back
+        :rtype: Optional[bool]
+        """
+        try:
+            st = os.stat(config_file)
+        except OSError:
+            return None
+        if digests.get(config_file) == [digest, st.st_mtime_ns, st.st_size]:
+            return True
+        if st.st_size != len(data):
+            return None
+        with open(config_file, 'rb') as f:
+            if f.read() != data:
+                return None
+        return False
+
+    def _record(self, config_file, digest, digests):
+        st = os.stat(config_file)
+        digests[config_file] = [digest, st.st_mtime_ns, st.st_size]
+        kv().set(DIGESTS_KEY, digests)
+        # NOTE: write_all flushes once at the end of the render pass.
+        if self.context_cache is None:
+            kv().flush()
+
+    def _replace(self, config_file, data):
+        """Atomically replace file content.
+
+        Mode and ownership of an existing file are preserved.
+
+        :param config_file: Path to file
+        :type config_file: str
+        :param data: New content
+        :type data: bytes
+        """
+        try:
+            st = os.stat(config_file)
+        except OSError:
+            st = None
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(config_file),
+            prefix='.{}.'.format(os.path.basename(config_file)))
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(data)
+                out.flush()
+                os.fsync(out.fileno())
+            if st is not None:
+                os.chmod(tmp_path, stat.S_IMODE(st.st_mode))
+                os.chown(tmp_path, st.st_uid, st.st_gid)
+            else:
+                # same mode as a file created by open()
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(tmp_path, 0o666 & ~umask)
+            os.replace(tmp_path, config_file)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def write(self, config_file):
+        """
+        Write a single config file if its content changed, raises if config
+        file is not registered.
+
+        :returns: Whether the file changed
+        :rtype: bool
+        """
+        if config_file not in self.templates:
+            log('Config not registered: {}'.format(config_file), level=ERROR)
+            raise templating.OSConfigException
+
+        start = time.time()
+        _out = self.render(config_file).encode('UTF-8')
+        log('Rendered template {} in {:.3f}s.'
+            .format(config_file, time.time() - start), level=DEBUG)
+        digest = _file_digest(_out)
+        digests = kv().get(DIGESTS_KEY, {})
+        unchanged = self._unchanged(config_file, _out, digest, digests)
+        if unchanged is not None:
+            if not unchanged:
+                # identical content but not as recorded, e.g. written before
+                # the charm started recording digests
+                self._record(config_file, digest, digests)
+            log('Template {} unchanged.'.format(config_file), level=DEBUG)
+            return False
+
+        self._replace(config_file, _out)
+        self._record(config_file, digest, digests)
+        for changed in _CHANGE_SETS:
+            changed.add(config_file)
+
+        log('Wrote template {}.'.format(config_file), level=INFO)
+        return True
+
+    def write_all(self):
+        """
+        Write out all registered config files whose content changed.
+
+        :returns: Paths of the files that changed
+        :rtype: Set[str]
+        """
+        self.context_cache = ContextCache()
+        try:
+            changed = {config_file for config_file in self.templates
+                       if self.write(config_file)}
+        finally:
+            kv().flush()
+            log('Context cache: {} hits, {} misses.'
+                .format(self.context_cache.hits, self.context_cache.misses),
+                level=DEBUG)
+            self.context_cache = None
+        return changed
+
+
+def restart_on_change(restart_map, stopstart=False, restart_functions=None):
+    """Pausable restart_on_change decorator using the renderer change set.
+
+    Drop-in replacement for
+    ``charmhelpers.contrib.openstack.utils.pausable_restart_on_change``.
+    Paths written by a ``ChangeTrackingConfigRenderer`` are known to have
+    changed from the renderer, any other path in the restart map is hashed
+    before and after the decorated function as before.
+
+    Restarts are requested through ``deferred_restarts.request_restart`` and
+    so coalesced with the other restarts of the hook within a
+    ``deferred_restarts`` block.
+
+    :param restart_map: Restart map ``{conf_file: [services]}`` or a
+                        callable returning it, evaluated at runtime
+    :type restart_map: Union[Dict[str, List[str]], Callable]
+    :param stopstart: Whether to stop and start services instead of restart
+    :type stopstart: bool
+    :param restart_functions: Nonstandard functions to use to restart
+                              services ``{svc: func}``
+    :type restart_functions: Optional[Dict[str, Callable]]
+    :returns: Decorator
+    :rtype: Callable
+    """
+    if restart_functions is None:
+        restart_functions = {}
+
+    def wrap(f):
+        @functools.wraps(f)
+        def wrapped_f(*args, **kwargs):
+            if is_unit_paused_set():
+                return f(*args, **kwargs)
+            _restart_map = (restart_map() if callable(restart_map)
+                            else restart_map)
+            checksums = {path: path_hash(path) for path in _restart_map
+                         if path not in _TRACKED_PATHS}
+            with track_changes() as changed:
+                r = f(*args, **kwargs)
+            changed.update(path for path in checksums
+                           if path_hash(path) != checksums[path])
+            # ordered services without duplicates -> changed paths
+            services = OrderedDict()
+            for path in _restart_map:
+                if path in changed:
+                    for service_name in _restart_map[path]:
+                        services.setdefault(service_name, []).append(path)
+            for service_name, paths in services.items():
+                request_restart(
+                    service_name, stopstart=stopstart,
+                    restart_function=restart_functions.get(service_name),
+                    paths=paths)
+            return r
+        return wrapped_f
+    return wrap
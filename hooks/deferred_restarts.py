@@ -0,0 +1,261 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Coalesce service restarts requested during a hook.
+
+Restarting ``openvswitch-switch`` interrupts the dataplane of every instance
+on the host, yet a single hook may request it from several places, e.g.
+``enable_ovs_dpdk``, ``enable_hw_offload`` and nested ``restart_on_change``
+decorators.  Within a ``deferred_restarts`` block restart requests are
+collected and run once per service, in dependency order, when the block
+exits or at an explicit ``barrier``.
+"""
+
+import contextlib
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from charmhelpers.core.hookenv import (
+    log,
+    DEBUG,
+)
+from charmhelpers.core.host import (
+    path_hash,
+    service,
+)
+
+# Services each service has to be restarted after.
+SERVICE_DEPENDENCIES = {
+    'openvswitch-switch': ('dpdk',),
+    'neutron-openvswitch-agent': ('openvswitch-switch',),
+    'neutron-plugin-openvswitch-agent': ('openvswitch-switch',),
+    'neutron-dhcp-agent': ('openvswitch-switch',
+                           'neutron-openvswitch-agent'),
+    'neutron-l3-agent': ('openvswitch-switch',
+                         'neutron-openvswitch-agent'),
+    'neutron-sriov-agent': ('openvswitch-switch',),
+}
+
+
+class _Coordinator(object):
+
+    def __init__(self):
+        self.depth = 0
+        self.max_workers = 1
+        # service name -> (stopstart, restart_function, paths)
+        self.pending = OrderedDict()
+        # service name -> {path: digest} of the paths at its restart
+        self.restarted = {}
+
+
+_COORDINATOR = _Coordinator()
+
+
+def _restart(service_name, stopstart, restart_function):
+    if restart_function is not None:
+        restart_function(service_name)
+        return
+    for action in (('stop', 'start') if stopstart else ('restart',)):
+        service(action, service_name)
+
+
+def _ordered(service_names):
+    """Order services so that dependencies come first.
+
+    :param service_names: Services in the order they were requested
+    :type service_names: List[str]
+    :returns: Services in restart order
+    :rtype: List[str]
+    """
+    ordered = []
+
+    def visit(service_name, visiting):
+        if service_name in ordered or service_name in visiting:
+            return
+        visiting = visiting | {service_name}
+        for dependency in SERVICE_DEPENDENCIES.get(service_name, ()):
+            if dependency in service_names:
+                visit(dependency, visiting)
+        ordered.append(service_name)
+
+    for service_name in service_names:
+        visit(service_name, frozenset())
+    return ordered
+
+
+def dependency_levels(service_names):
+    """Group services so that each only depends on earlier groups.
+
+    Services of the same group are independent of each other.
+
+    :param service_names: Services in the order they were requested
+    :type service_names: List[str]
+    :returns: Groups of services in restart order
+    :rtype: List[List[str]]
+    """
+    depths = {}
+
+    def depth(service_name, visiting):
+        if service_name not in depths:
+            visiting = visiting | {service_name}
+            depths[service_name] = 1 + max(
+                [depth(dependency, visiting)
+                 for dependency in SERVICE_DEPENDENCIES.get(service_name, ())
+                 if dependency in service_names and
+                 dependency not in visiting] or [-1])
+        return depths[service_name]
+
+    levels = []
+    for service_name in service_names:
+        level = depth(service_name, frozenset())
+        while len(levels) <= level:
+            levels.append([])
+        levels[level].append(service_name)
+    return levels
+
+
+def run_in_order(func, service_names, max_workers=1, reverse=False):
+    """Call func for each service, dependencies first.
+
+    With more than one worker the independent services of each group of
+    ``dependency_levels`` are handled concurrently by a thread pool.
+
+    :param func: Function called with the service name
+    :type func: Callable[[str], Any]
+    :param service_names: Services in the order they were requested
+    :type service_names: List[str]
+    :param max_workers: Maximum number of services handled concurrently
+    :type max_workers: int
+    :param reverse: Handle services before their dependencies instead, e.g.
+                    to stop them
+    :type reverse: bool
+    :returns: Results of func keyed by service name
+    :rtype: Dict[str, Any]
+    """
+    if max_workers <= 1:
+        ordered = _ordered(list(service_names))
+        if reverse:
+            ordered.reverse()
+        return OrderedDict((service_name, func(service_name))
+                           for service_name in ordered)
+    levels = dependency_levels(list(service_names))
+    if reverse:
+        levels.reverse()
+    results = OrderedDict()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for level in levels:
+            futures = [(service_name, executor.submit(func, service_name))
+                       for service_name in level]
+            for service_name, future in futures:
+                results[service_name] = future.result()
+    return results
+
+
+def _unchanged_since_restart(service_name, paths):
+    """Whether paths are unchanged since the service was restarted.
+
+    :param service_name: Name of service restarted in this hook
+    :type service_name: str
+    :param paths: Configuration files the restart is requested for
+    :type paths: Iterable[str]
+    :rtype: bool
+    """
+    digests = _COORDINATOR.restarted[service_name]
+    return all(path in digests and path_hash(path) == digests[path]
+               for path in paths)
+
+
+def request_restart(service_name, stopstart=False, restart_function=None,
+                    paths=()):
+    """Restart a service, deferred when in a ``deferred_restarts`` block.
+
+    A service already restarted in the block is only restarted again if
+    one of the paths changed since that restart.
+
+    :param service_name: Name of service
+    :type service_name: str
+    :param stopstart: Whether to stop and start instead of restart
+    :type stopstart: bool
+    :param restart_function: Nonstandard function restarting the service,
+                             called with the service name
+    :type restart_function: Optional[Callable[[str], None]]
+    :param paths: Configuration files whose change caused the request
+    :type paths: Iterable[str]
+    """
+    coordinator = _COORDINATOR
+    if not coordinator.depth:
+        _restart(service_name, stopstart, restart_function)
+        return
+    paths = set(paths)
+    if (service_name in coordinator.restarted and
+            _unchanged_since_restart(service_name, paths)):
+        log('{} already restarted in this hook'.format(service_name),
+            level=DEBUG)
+        return
+    if service_name in coordinator.pending:
+        _stopstart, _restart_function, _paths = (
+            coordinator.pending[service_name])
+        stopstart = stopstart or _stopstart
+        restart_function = _restart_function or restart_function
+        paths |= _paths
+    coordinator.pending[service_name] = (stopstart, restart_function, paths)
+
+
+def barrier():
+    """Run the restarts requested so far.
+
+    For runtime configuration that requires services to have been
+    restarted with the configuration written before.
+    """
+    coordinator = _COORDINATOR
+    pending = coordinator.pending
+    coordinator.pending = OrderedDict()
+
+    def restart(service_name):
+        log('Restarting {}'.format(service_name), level=DEBUG)
+        stopstart, restart_function, _ = pending[service_name]
+        _restart(service_name, stopstart, restart_function)
+
+    run_in_order(restart, list(pending),
+                 max_workers=coordinator.max_workers)
+    for service_name, (_, _, paths) in pending.items():
+        digests = coordinator.restarted.setdefault(service_name, {})
+        digests.update((path, path_hash(path)) for path in paths)
+
+
+@contextlib.contextmanager
+def deferred_restarts(max_workers=1):
+    """Defer restarts requested while the block executes to its exit.
+
+    Blocks may be nested, restarts run when the outermost block exits.
+    Pending restarts are dropped if the block raises.
+
+    :param max_workers: Maximum number of independent services restarted
+                        concurrently, taken from the outermost block
+    :type max_workers: int
+    """
+    coordinator = _COORDINATOR
+    if not coordinator.depth:
+        coordinator.max_workers = max_workers
+    coordinator.depth += 1
+    try:
+        yield
+        if coordinator.depth == 1:
+            barrier()
+    finally:
+        coordinator.depth -= 1
+        if not coordinator.depth:
+            coordinator.pending = OrderedDict()
+            coordinator.restarted = {}
@@ -0,0 +1,131 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Opt-in high throughput mode for ``charmhelpers.core.unitdata``.
+
+``Storage.set`` runs one SELECT and one INSERT or UPDATE per key, plus the
+revision history statements within a hook scope, and every ``flush`` is a
+commit with the default rollback journal.  ``FastStorage`` keeps the same
+database schema and interface but uses WAL journaling with
+``synchronous=NORMAL``, writes many keys with ``executemany`` and can skip
+the revision history for hot keys.
+"""
+
+import json
+
+from charmhelpers.core import unitdata
+from charmhelpers.core.hookenv import (
+    log,
+    DEBUG,
+)
+
+# SQLite limits the number of host parameters of a statement to 999 on
+# older releases.
+_MAX_PARAMS = 999
+
+
+class FastStorage(unitdata.Storage):
+    """Storage using WAL journaling and bulk statements.
+
+    The database is shared with ``unitdata.Storage``; the WAL journal mode
+    is persistent, which plain ``Storage`` connections handle transparently.
+
+    :param path: Path to the database, see ``unitdata.Storage``
+    :type path: Optional[str]
+    :param history_less_prefixes: Prefixes of keys for which no revision
+                                  history is recorded
+    :type history_less_prefixes: Iterable[str]
+    """
+
+    def __init__(self, path=None, history_less_prefixes=()):
+        super(FastStorage, self).__init__(path)
+        self.history_less_prefixes = tuple(history_less_prefixes)
+        if self.db_path != ':memory:':
+            self.cursor.execute('pragma journal_mode=WAL')
+        # durable at checkpoints rather than at every commit, a crash may
+        # lose the last transactions but does not corrupt the database.
+        self.cursor.execute('pragma synchronous=NORMAL')
+
+    def _current(self, keys):
+        current = {}
+        for i in range(0, len(keys), _MAX_PARAMS):
+            chunk = keys[i:i + _MAX_PARAMS]
+            self.cursor.execute(
+                'select key, data from kv where key in ({})'
+                .format(', '.join('?' * len(chunk))), chunk)
+            current.update(self.cursor.fetchall())
+        return current
+
+    def update(self, mapping, prefix=""):
+        """
+        Set the values of multiple keys at once.
+
+        Only keys whose value changed are written, with one statement for
+        all keys and one for their revision history.
+
+        :param dict mapping: Mapping of keys to values
+        :param str prefix: Optional prefix to apply to all keys in `mapping`
+            before setting
+        """
+        serialized = [('%s%s' % (prefix, k), json.dumps(v))
+                      for k, v in mapping.items()]
+        current = self._current([key for key, _ in serialized])
+        changed = [(key, data) for key, data in serialized
+                   if current.get(key) != data]
+        if not changed:
+            return
+        self.cursor.executemany(
+            'insert or replace into kv (key, data) values (?, ?)', changed)
+        if not self.revision:
+            return
+        self.cursor.executemany(
+            '''insert or replace into kv_revisions (
+            revision, key, data) values (?, ?, ?)''',
+            [(self.revision, key, data) for key, data in changed
+             if not key.startswith(self.history_less_prefixes)])
+
+    def set(self, key, value):
+        """
+        Set a value in the database.
+
+        :param str key: Key to set the value for
+        :param value: Any JSON-serializable value to be set
+        """
+        self.update({key: value})
+        return value
+
+
+def enable(history_less_prefixes=()):
+    """Use ``FastStorage`` for ``unitdata.kv()``.
+
+    Must be called before the first use of ``kv()`` in the hook to take
+    effect, an existing connection is kept as is.  Calling it again adds
+    history_less_prefixes to those of the ``FastStorage`` in use.
+
+    :param history_less_prefixes: Prefixes of keys for which no revision
+                                  history is recorded
+    :type history_less_prefixes: Iterable[str]
+    :returns: Storage returned by ``unitdata.kv()``
+    :rtype: unitdata.Storage
+    """
+    if unitdata._KV is None:
+        unitdata._KV = FastStorage(
+            history_less_prefixes=history_less_prefixes)
+    elif isinstance(unitdata._KV, FastStorage):
+        unitdata._KV.history_less_prefixes += tuple(
+            prefix for prefix in history_less_prefixes
+            if prefix not in unitdata._KV.history_less_prefixes)
+    else:
+        log('unitdata already opened, not enabling WAL mode', level=DEBUG)
+    return unitdata._KV
@@ -13,14 +13,25 @@
 # limitations under the License.
 
 import collections
-import glob
 import os
+import time
 import uuid
+import nic_inventory
+from numa import (
+    format_mask,
+    mask_to_cpu_list,
+    numa_topology,
+)
 from pci import PCINetDevices
+import relation_prefetch
+from relation_prefetch import relation_get
+from release_resolver import os_release
 from charmhelpers.core.hookenv import (
+    cached,
     config,
+    local_unit,
     log,
-    relation_get,
+    DEBUG,
     relation_ids,
     related_units,
     unit_get,
@@ -45,7 +56,6 @@ from charmhelpers.contrib.openstack.context import (
     parse_data_port_mappings
 )
 from charmhelpers.contrib.openstack.utils import (
-    os_release,
     CompareOpenStackReleases,
 )
 from charmhelpers.core.unitdata import kv
@@ -58,6 +68,30 @@ NFG_LOG_RATE_LIMIT_MIN = 100
 NFG_LOG_BURST_LIMIT_MIN = 25
 
 
+@cached
+def _neutron_api_settings(unit):
+    start = time.time()
+    settings = NeutronAPIContext()()
+    log('NeutronAPIContext evaluated in {:.3f}s'.format(time.time() - start),
+        level=DEBUG)
+    return settings
+
+
+def get_neutron_api_settings():
+    """Settings provided by neutron-api, evaluated once per hook.
+
+    ``NeutronAPIContext`` walks every unit of every neutron-plugin-api
+    relation and is consulted by many contexts and predicates while
+    rendering, so share the result for the lifetime of the hook.  The
+    cache entry is keyed on the local unit name, which makes
+    ``relation_set`` flush it.
+
+    :returns: Settings as returned by ``NeutronAPIContext``
+    :rtype: Dict[str, any]
+    """
+    return _neutron_api_settings(local_unit())
+
+
 def _get_firewall_driver(ovs_ctxt):
     '''
     Determine the firewall driver to use based on configuration,
@@ -155,7 +189,7 @@ class OVSPluginContext(context.NeutronContext):
     def neutron_security_groups(self):
         if config('disable-security-groups'):
             return False
-        neutron_api_settings = NeutronAPIContext()()
+        neutron_api_settings = get_neutron_api_settings()
         return neutron_api_settings['neutron_security_groups']
 
     def disable_mlockall(self):
@@ -200,7 +234,7 @@ class OVSPluginContext(context.NeutronContext):
             except NotImplementedError:
                 ovs_ctxt['local_ip'] = fallback
 
-        neutron_api_settings = NeutronAPIContext()()
+        neutron_api_settings = get_neutron_api_settings()
         ovs_ctxt['neutron_security_groups'] = self.neutron_security_groups
         ovs_ctxt['l2_population'] = neutron_api_settings['l2_population']
         ovs_ctxt['distributed_routing'] = neutron_api_settings['enable_dvr']
@@ -313,7 +347,7 @@ class ZoneContext(OSContextGenerator):
 class L3AgentContext(OSContextGenerator):
 
     def __call__(self):
-        neutron_api_settings = NeutronAPIContext()()
+        neutron_api_settings = get_neutron_api_settings()
         ctxt = {}
         if neutron_api_settings['enable_dvr']:
             use_dvr_snat = config('use-dvr-snat')
@@ -368,91 +402,73 @@ class L3AgentContext(OSContextGenerator):
         return ctxt
 
 
-def resolve_dpdk_bridges():
+@cached
+def resolve_dpdk_pci_addresses():
     '''
-    Resolve local PCI devices from configured mac addresses
-    using the data-port configuration option
+    Resolve local PCI devices from all mac addresses configured
+    using the data-port and dpdk-bond-mappings configuration options
 
-    @return: OrderDict indexed by PCI device address.
+    Once bound to dpdk a device disappears from PCINetDevices, so the
+    mac->pci allocation is recorded in unitdata.  Changed allocations are
+    written in a single transaction.
+
+    @return: OrderedDict of PCI device address indexed by mac address,
+             None for unresolved mac addresses.
     '''
-    ports = config('data-port')
+    macs = []
+    for option in ('data-port', 'dpdk-bond-mappings'):
+        mappings = config(option)
+        if mappings:
+            macs.extend(parse_data_port_mappings(mappings))
+    resolved = collections.OrderedDict()
+    if not macs:
+        return resolved
     devices = PCINetDevices()
-    resolved_devices = collections.OrderedDict()
     db = kv()
-    if ports:
-        # NOTE: ordered dict of format {[mac]: bridge}
-        portmap = parse_data_port_mappings(ports)
-        for mac, bridge in portmap.items():
-            pcidev = devices.get_device_from_mac(mac)
-            if pcidev:
-                # NOTE: store mac->pci allocation as post binding
-                #       to dpdk, it disappears from PCIDevices.
-                db.set(mac, pcidev.pci_address)
-                db.flush()
-
-            pci_address = db.get(mac)
+    changed = {}
+    for mac in macs:
+        pci_address = db.get(mac)
+        pcidev = devices.get_device_from_mac(mac)
+        if pcidev and pcidev.pci_address != pci_address:
+            pci_address = changed[mac] = pcidev.pci_address
+        resolved[mac] = pci_address
+    if changed:
+        db.update(changed)
+        db.flush()
+    return resolved
+
+
+def _resolve_dpdk_mappings(option):
+    resolved_devices = collections.OrderedDict()
+    mappings = config(option)
+    if mappings:
+        pci_addresses = resolve_dpdk_pci_addresses()
+        # NOTE: ordered dict of format {[mac]: bridge or bond}
+        for mac, name in parse_data_port_mappings(mappings).items():
+            pci_address = pci_addresses.get(mac)
             if pci_address:
-                resolved_devices[pci_address] = bridge
-
+                resolved_devices[pci_address] = name
     return resolved_devices
 
 
-def resolve_dpdk_bonds():
+def resolve_dpdk_bridges():
     '''
     Resolve local PCI devices from configured mac addresses
-    using the dpdk-bond-mappings configuration option
+    using the data-port configuration option
 
     @return: OrderDict indexed by PCI device address.
     '''
-    bonds = config('dpdk-bond-mappings')
-    devices = PCINetDevices()
-    resolved_devices = collections.OrderedDict()
-    db = kv()
-    if bonds:
-        # NOTE: ordered dict of format {[mac]: bond}
-        bondmap = parse_data_port_mappings(bonds)
-        for mac, bond in bondmap.items():
-            pcidev = devices.get_device_from_mac(mac)
-            if pcidev:
-                # NOTE: store mac->pci allocation as post binding
-                #       to dpdk, it disappears from PCIDevices.
-                db.set(mac, pcidev.pci_address)
-                db.flush()
-
-            pci_address = db.get(mac)
-            if pci_address:
-                resolved_devices[pci_address] = bond
-
-    return resolved_devices
+    return _resolve_dpdk_mappings('data-port')
 
 
-def parse_cpu_list(cpulist):
+def resolve_dpdk_bonds():
     '''
-    Parses a linux cpulist for a numa node
+    Resolve local PCI devices from configured mac addresses
+    using the dpdk-bond-mappings configuration option
 
-    @return list of cores
+    @return: OrderDict indexed by PCI device address.
     '''
-    cores = []
-    ranges = cpulist.split(',')
-    for cpu_range in ranges:
-        if "-" in cpu_range:
-            cpu_min_max = cpu_range.split('-')
-            cores += range(int(cpu_min_max[0]),
-                           int(cpu_min_max[1]) + 1)
-        else:
-            cores.append(int(cpu_range))
-    return cores
-
-
-def numa_node_cores():
-    '''Dict of numa node -> cpu core mapping'''
-    nodes = {}
-    node_regex = '/sys/devices/system/node/node*'
-    for node in glob.glob(node_regex):
-        index = node.lstrip('/sys/devices/system/node/node')
-        with open(os.path.join(node, 'cpulist')) as cpulist:
-            nodes[index] = parse_cpu_list(cpulist.read().strip())
-    return nodes
+    return _resolve_dpdk_mappings('dpdk-bond-mappings')
 
 
 class DPDKDeviceContext(OSContextGenerator):
@@ -471,31 +487,117 @@ class DPDKDeviceContext(OSContextGenerator):
 
 class OVSDPDKDeviceContext(OSContextGenerator):
 
+    def topology(self):
+        '''NUMA topology of the unit and the DPDK devices'''
+        return numa_topology(sorted(self.devices()))
+
     def cpu_mask(self):
         '''
         Hex formatted CPU mask based on using the first
         config:dpdk-socket-cores cores of each NUMA node
         in the unit.
         '''
-        num_cores = config('dpdk-socket-cores')
-        mask = 0
-        for cores in numa_node_cores().values():
-            for core in cores[:num_cores]:
-                mask = mask | 1 << core
-        return format(mask, '#04x')
+        return format_mask(
+            self.topology().lcore_mask(config('dpdk-socket-cores')))
+
+    def socket_memory_by_node(self):
+        '''
+        Hugepage memory in MB for dpdk per NUMA node: config:dpdk-socket-memory
+        on the nodes the DPDK devices are attached to, capped at the
+        hugepage memory of the node on other nodes.
+
+        @return OrderedDict indexed by NUMA node number.
+        '''
+        sm_size = config('dpdk-socket-memory')
+        topology = self.topology()
+        local_nodes = topology.local_nodes(self.devices())
+        return collections.OrderedDict(
+            (index, sm_size if index in local_nodes
+             else min(sm_size, node.hugepages_mb()))
+            for index, node in topology.nodes.items())
 
     def socket_memory(self):
         '''
         Formatted list of socket memory configuration for dpdk using
         config:dpdk-socket-memory per NUMA node.
         '''
-        sm_size = config('dpdk-socket-memory')
-        node_regex = '/sys/devices/system/node/node*'
-        mem_list = [str(sm_size) for _ in glob.glob(node_regex)]
+        mem_list = [str(size)
+                    for size in self.socket_memory_by_node().values()]
         if mem_list:
             return ','.join(mem_list)
         else:
-            return str(sm_size)
+            return str(config('dpdk-socket-memory'))
+
+    def socket_limit(self):
+        '''
+        Formatted list of the socket memory limit for dpdk, the same as
+        the socket memory so that dpdk does not allocate hugepages beyond
+        the ones checked by hugepage_shortfall.
+        '''
+        # NOTE: a limit of 0 means no limit to ovs-vswitchd, nodes without
+        #       socket memory are limited to 1 MB, less than any hugepage.
+        limits = [str(size or 1)
+                  for size in self.socket_memory_by_node().values()]
+        if limits:
+            return ','.join(limits)
+        return self.socket_memory()
+
+    def hugepage_shortfall(self):
+        '''
+        NUMA nodes without enough hugepages for their socket memory.
+
+        Hugepages in use are included as ovs-vswitchd holds on to the
+        hugepages it allocated.
+
+        @return OrderedDict of (available MB, required MB) indexed by NUMA
+                node number.
+        '''
+        nodes = self.topology().nodes
+        shortfall = collections.OrderedDict()
+        for index, size in self.socket_memory_by_node().items():
+            available = nodes[index].hugepages_mb()
+            if available < size:
+                shortfall[index] = (available, size)
+        return shortfall
+
+    def _pmd_mask(self, nodes):
+        return self.topology().pmd_mask(config('dpdk-pmd-cores'),
+                                        nodes=nodes,
+                                        skip=config('dpdk-socket-cores'))
+
+    def pmd_cpu_mask(self):
+        '''
+        Hex formatted CPU mask of config:dpdk-pmd-cores cores of each
+        NUMA node the DPDK devices are attached to, following the cores
+        used by cpu_mask, or None when not configured.
+        '''
+        if not config('dpdk-pmd-cores'):
+            return None
+        topology = self.topology()
+        mask = self._pmd_mask(topology.local_nodes(self.devices()))
+        return format_mask(mask) if mask else None
+
+    def rxq_affinity(self, pci_address):
+        '''
+        pmd-rxq-affinity of a DPDK device, assigning its
+        config:dpdk-rx-queues queues in turn to the PMD cores of
+        the NUMA node of the device, or None when not configured.
+        '''
+        n_rxq = config('dpdk-rx-queues')
+        if not (n_rxq and config('dpdk-pmd-rxq-affinity') and
+                config('dpdk-pmd-cores')):
+            return None
+        topology = self.topology()
+        node = topology.device_nodes.get(pci_address)
+        if node in topology.nodes:
+            nodes = [node]
+        else:
+            nodes = topology.local_nodes(self.devices())
+        cores = mask_to_cpu_list(self._pmd_mask(nodes))
+        if not cores:
+            return None
+        return ','.join('{}:{}'.format(queue, cores[queue % len(cores)])
+                        for queue in range(n_rxq))
 
     def devices(self):
         '''List of PCI devices for use by DPDK'''
@@ -563,7 +665,7 @@ def get_shared_secret():
 class SharedSecretContext(OSContextGenerator):
 
     def __call__(self):
-        if NeutronAPIContext()()['enable_dvr'] or \
+        if get_neutron_api_settings()['enable_dvr'] or \
                 config('enable-local-dhcp-and-metadata'):
             ctxt = {
                 'shared_secret': get_shared_secret(),
@@ -600,6 +702,62 @@ class RemoteRestartContext(OSContextGenerator):
         return ctxt
 
 
+class AMQPContext(context.AMQPContext):
+    """AMQPContext reading settings of the rabbitmq-server units from
+    data prefetched once per unit, rather than one relation-get for each
+    setting of each unit.
+    """
+
+    def __call__(self):
+        with relation_prefetch.serving(context):
+            return super(AMQPContext, self).__call__()
+
+
+class NeutronPortContext(context.NeutronPortContext):
+    """NeutronPortContext resolving ports from the network interface
+    inventory read once per hook, rather than querying every interface
+    for each context.
+    """
+
+    def resolve_ports(self, ports):
+        return nic_inventory.inventory().resolve_ports(ports)
+
+
+class ExternalPortContext(NeutronPortContext, context.ExternalPortContext):
+    pass
+
+
+class DataPortContext(NeutronPortContext, context.DataPortContext):
+
+    def __call__(self):
+        ports = config('data-port')
+        if ports:
+            # Map of {bridge:port/mac}
+            portmap = parse_data_port_mappings(ports)
+            ports = portmap.keys()
+            # Resolve provided ports or mac addresses and filter out those
+            # already attached to a bridge.
+            resolved = self.resolve_ports(ports)
+            # Rebuild port index using resolved and filtered ports, with the
+            # MAC addresses from the inventory.
+            inventory = nic_inventory.inventory()
+            normalized = {inventory.get_nic_hwaddr(port): port
+                          for port in resolved if port not in ports}
+            normalized.update({port: port for port in resolved
+                               if port in ports})
+            if resolved:
+                return {normalized[port]: bridge for port, bridge in
+                        portmap.items() if port in normalized.keys()}
+
+        return None
+
+
+# NOTE: context.PhyNICMTUContext comes first so that its call of the data
+#       port mappings resolves to DataPortContext above.
+class PhyNICMTUContext(context.PhyNICMTUContext, DataPortContext):
+    pass
+
+
 class APIIdentityServiceContext(context.IdentityServiceContext):
 
     def __init__(self):
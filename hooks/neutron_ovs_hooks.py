@@ -17,17 +17,13 @@
 import sys
 import uuid
 
-from copy import deepcopy
-
 from charmhelpers.contrib.openstack import context as os_context
 
 from charmhelpers.contrib.openstack.utils import (
-    pausable_restart_on_change as restart_on_change,
     series_upgrade_prepare,
     series_upgrade_complete,
     is_unit_paused_set,
     CompareOpenStackReleases,
-    os_release,
 )
 
 from charmhelpers.core.hookenv import (
@@ -47,24 +43,40 @@ from charmhelpers.core.host import (
 
 from charmhelpers.core.unitdata import kv
 
+from change_tracking import (
+    DIGESTS_KEY,
+    restart_on_change,
+)
+
+import fast_unitdata
+
+# NOTE: enabled before anything opens unitdata, registering the configs
+#       below resolves the release from it.  Rendered file digests are
+#       rewritten whenever a file changes and do not need a revision history.
+fast_unitdata.enable(history_less_prefixes=(DIGESTS_KEY,))
+
+from release_resolver import os_release
+import status_fingerprint
+
+from deferred_restarts import (
+    barrier,
+    deferred_restarts,
+)
+
 from neutron_ovs_utils import (
-    DHCP_PACKAGES,
-    DVR_PACKAGES,
-    L3HA_PACKAGES,
-    METADATA_PACKAGES,
     OVS_DEFAULT,
+    SERVICE_WORKERS,
     USE_FQDN_KEY,
     configure_ovs,
     get_shared_secret,
     register_configs,
     restart_map,
     use_dvr,
-    use_l3ha,
     enable_nova_metadata,
     enable_local_dhcp,
     install_packages,
-    install_l3ha_packages,
-    purge_packages,
+    dpdk_hugepages_ready,
+    apply_package_plan,
     assess_status,
     install_tmpfilesd,
     pause_unit_helper,
@@ -78,6 +90,22 @@ hooks = Hooks()
 CONFIGS = register_configs()
 
 
+def _restart_map_without_ovs_default():
+    return {cfg: services
+            for cfg, services in restart_map().items()
+            if cfg != OVS_DEFAULT}
+
+
+def _restart_map_ovs_default():
+    # NOTE: ovs-vswitchd fails to start while DPDK waits for hugepages,
+    #       leave openvswitch-switch untouched until they are available.
+    if not dpdk_hugepages_ready():
+        return {}
+    return {cfg: services
+            for cfg, services in restart_map().items()
+            if cfg == OVS_DEFAULT}
+
+
 @hooks.hook('install.real')
 def install():
     install_packages()
@@ -124,9 +152,7 @@ def upgrade_charm():
 @hooks.hook('config-changed')
 # NOTE(fnordahl): we need to act immediately to changes to OVS_DEFAULT in-line
 # so ignore it here to avoid restarting the services twice. LP: #1906280
-@restart_on_change({cfg: services
-                    for cfg, services in restart_map().items()
-                    if cfg != OVS_DEFAULT})
+@restart_on_change(_restart_map_without_ovs_default)
 def config_changed():
     # if we are paused, delay doing any config changed hooks.
     # It is forced on the resume.
@@ -137,13 +163,9 @@ def config_changed():
     install_packages()
     install_tmpfilesd()
 
-    # NOTE(jamespage): purge any packages as a result of py3 switch
-    #                  at rocky.
-    packages_to_purge = determine_purge_packages()
-    request_nova_compute_restart = False
-    if packages_to_purge:
-        purge_packages(packages_to_purge)
-        request_nova_compute_restart = True
+    # NOTE(jamespage): packages left from the py3 switch at rocky are
+    #                  purged by install_packages.
+    request_nova_compute_restart = bool(determine_purge_packages())
 
     sysctl_settings = config('sysctl')
     if not is_container() and sysctl_settings:
@@ -155,12 +177,13 @@ def config_changed():
     # configuration of OVS as we may have to pass options to `ovs-ctl` for
     # `ovs-vswitchd` to run at all. LP: #1906280
     # TODO: make restart_on_change use contextlib.contextmanager
-    @restart_on_change({cfg: services
-                        for cfg, services in restart_map().items()
-                        if cfg == OVS_DEFAULT})
+    @restart_on_change(_restart_map_ovs_default)
     def _restart_before_runtime_config_when_required():
         CONFIGS.write_all()
     _restart_before_runtime_config_when_required()
+    # NOTE: run the restarts requested so far, including openvswitch-switch
+    #       ones from enabling DPDK or hardware offload.
+    barrier()
     configure_ovs()
 
     for rid in relation_ids('neutron-plugin'):
@@ -172,39 +195,27 @@ def config_changed():
 @hooks.hook('neutron-plugin-api-relation-changed')
 # NOTE(fnordahl): we need to act immediately to changes to OVS_DEFAULT in-line
 # so ignore it here to avoid restarting the services twice. LP: #1906280
-@restart_on_change({cfg: services
-                    for cfg, services in restart_map().items()
-                    if cfg != OVS_DEFAULT})
+@restart_on_change(_restart_map_without_ovs_default)
 def neutron_plugin_api_changed():
-    packages_to_purge = []
+    # NOTE: the package plan installs the DVR and L3HA packages, or purges
+    #       them when DVR is not in use.
     if use_dvr():
         install_packages()
-        # per 17.08 release notes L3HA + DVR is a Newton+ feature
-        _os_release = os_release('neutron-common', base='icehouse')
-        if (use_l3ha() and
-                CompareOpenStackReleases(_os_release) >= 'newton'):
-            install_l3ha_packages()
-
-        # NOTE(hopem): don't uninstall keepalived if not using l3ha since that
-        # results in neutron-l3-agent also being uninstalled (see LP 1819499).
     else:
-        packages_to_purge = deepcopy(DVR_PACKAGES)
-        packages_to_purge.extend(L3HA_PACKAGES)
-
-    if packages_to_purge:
-        purge_packages(packages_to_purge)
+        apply_package_plan()
 
     # NOTE(fnordahl): It is important to write config to disk and perhaps
     # restart the openvswitch-swith service prior to attempting to do run-time
     # configuration of OVS as we may have to pass options to `ovs-ctl` for
     # `ovs-vswitchd` to run at all. LP: #1906280
     # TODO: make restart_on_change use contextlib.contextmanager
-    @restart_on_change({cfg: service
-                        for cfg, service in restart_map().items()
-                        if cfg == OVS_DEFAULT})
+    @restart_on_change(_restart_map_ovs_default)
     def _restart_before_runtime_config_when_required():
         CONFIGS.write_all()
     _restart_before_runtime_config_when_required()
+    # NOTE: run the restarts requested so far, including openvswitch-switch
+    #       ones from enabling DPDK or hardware offload.
+    barrier()
     configure_ovs()
     # If dvr setting has changed, need to pass that on
     for rid in relation_ids('neutron-plugin'):
@@ -218,15 +229,8 @@ def neutron_plugin_joined(relation_id=None, request_restart=False):
         if enable_local_dhcp():
             install_packages()
         else:
-            pkgs = deepcopy(DHCP_PACKAGES)
-            # NOTE: only purge metadata packages if dvr is not
-            #       in use as this will remove the l3 agent
-            #       see https://pad.lv/1515008
-            if not use_dvr():
-                # NOTE(fnordahl) do not remove ``haproxy``, the principal
-                # charm may have use for it. LP: #1832739
-                pkgs.extend(set(METADATA_PACKAGES)-set(['haproxy']))
-            purge_packages(pkgs)
+            # NOTE: the package plan purges the DHCP and metadata packages.
+            apply_package_plan()
         secret = get_shared_secret() if enable_nova_metadata() else None
     rel_data = {
         'metadata-shared-secret': secret,
@@ -248,7 +252,7 @@ def amqp_joined(relation_id=None):
 
 @hooks.hook('amqp-relation-changed')
 @hooks.hook('amqp-relation-departed')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map)
 def amqp_changed():
     if 'amqp' not in CONFIGS.complete_contexts():
         log('amqp relation incomplete. Peer not ready?')
@@ -283,8 +287,14 @@ def dummy_update_status():
 
 
 def main():
+    # NOTE: the status is recorded again once assessed, should the hook fail
+    #       update-status has to assess it in full.
+    status_fingerprint.invalidate()
     try:
-        hooks.execute(sys.argv)
+        # NOTE: restarts requested by the hook run once per service when it
+        #       completes, or at the barriers it declares.
+        with deferred_restarts(max_workers=SERVICE_WORKERS):
+            hooks.execute(sys.argv)
     except UnregisteredHookError as e:
         log('Unknown hook {} - skipping.'.format(e))
     assess_status(CONFIGS)
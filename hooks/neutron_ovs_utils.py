@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import hashlib
+import importlib.util
 import json
 import os
 from itertools import chain
@@ -22,7 +23,7 @@ import subprocess
 from charmhelpers.contrib.openstack.neutron import neutron_plugin_attribute
 from copy import deepcopy
 
-from charmhelpers.contrib.openstack import context, templating
+from charmhelpers.contrib.openstack import context
 from charmhelpers.contrib.openstack.utils import (
     pause_unit,
     resume_unit,
@@ -30,26 +31,29 @@ from charmhelpers.contrib.openstack.utils import (
     is_unit_paused_set,
     os_application_version_set,
     CompareOpenStackReleases,
-    os_release,
 )
 from charmhelpers.core.unitdata import kv
 from collections import OrderedDict
+import change_tracking
 import neutron_ovs_context
+from neutron_ovs_context import (
+    DataPortContext,
+    ExternalPortContext,
+)
+import ovs_state
 from charmhelpers.contrib.network.ovs import (
-    add_bridge,
-    add_bridge_port,
     is_linuxbridge_interface,
     add_ovsbridge_linuxbridge,
     full_restart,
-    enable_ipfix,
-    disable_ipfix,
 )
 from charmhelpers.core.hookenv import (
+    cached,
     config,
     DEBUG,
     log,
     status_set,
     ERROR,
+    WARNING,
 )
 from charmhelpers.contrib.openstack.neutron import (
     parse_bridge_mappings,
@@ -57,8 +61,6 @@ from charmhelpers.contrib.openstack.neutron import (
     headers_package,
 )
 from charmhelpers.contrib.openstack.context import (
-    ExternalPortContext,
-    DataPortContext,
     WorkerConfigContext,
     parse_data_port_mappings,
     DHCPAgentContext,
@@ -66,7 +68,6 @@ from charmhelpers.contrib.openstack.context import (
 )
 from charmhelpers.core.host import (
     lsb_release,
-    service_restart,
     service_running,
     CompareHostReleases,
     init_is_systemd,
@@ -80,14 +81,19 @@ from charmhelpers.core.kernel import (
 
 from charmhelpers.fetch import (
     apt_install,
-    apt_purge,
-    apt_update,
+    add_source,
+)
+
+import apt_index
+from deferred_restarts import request_restart
+from package_inventory import (
     filter_installed_packages,
-    filter_missing_packages,
-    apt_autoremove,
     get_upstream_version,
-    add_source,
 )
+from package_plan import PackagePlan
+from release_resolver import os_release
+import service_state
+import status_fingerprint
 
 
 # The interface is said to be satisfied if anyone of the interfaces in the
@@ -100,6 +106,9 @@ REQUIRED_INTERFACES = {
 }
 
 VERSION_PACKAGE = 'neutron-common'
+# Maximum number of independent services restarted, paused or resumed
+# concurrently.
+SERVICE_WORKERS = 4
 NOVA_CONF_DIR = "/etc/nova"
 NEUTRON_DHCP_AGENT_CONF = "/etc/neutron/dhcp_agent.ini"
 NEUTRON_DNSMASQ_CONF = "/etc/neutron/dnsmasq.conf"
@@ -159,7 +168,7 @@ BASE_RESOURCE_MAP = OrderedDict([
         'contexts': [neutron_ovs_context.OVSPluginContext(),
                      neutron_ovs_context.RemoteRestartContext(
                          ['neutron-plugin', 'neutron-control']),
-                     context.AMQPContext(ssl_dir=NEUTRON_CONF_DIR),
+                     neutron_ovs_context.AMQPContext(ssl_dir=NEUTRON_CONF_DIR),
                      context.ZeroMQContext(),
                      context.NotificationDriverContext(),
                      context.HostInfoContext(use_fqdn_hint_cb=use_fqdn_hint),
@@ -187,7 +196,7 @@ BASE_RESOURCE_MAP = OrderedDict([
     }),
     (PHY_NIC_MTU_CONF, {
         'services': ['os-charm-phy-nic-mtu'],
-        'contexts': [context.PhyNICMTUContext()],
+        'contexts': [neutron_ovs_context.PhyNICMTUContext()],
     }),
 ])
 METADATA_RESOURCE_MAP = OrderedDict([
@@ -219,7 +228,7 @@ DVR_RESOURCE_MAP = OrderedDict([
     }),
     (EXT_PORT_CONF, {
         'services': ['neutron-l3-agent'],
-        'contexts': [context.ExternalPortContext()],
+        'contexts': [neutron_ovs_context.ExternalPortContext()],
     }),
 ])
 SRIOV_RESOURCE_MAP = OrderedDict([
@@ -239,8 +248,9 @@ def install_packages():
     # NOTE(jamespage): install neutron-common package so we always
     #                  get a clear signal on which OS release is
     #                  being deployed
-    apt_install(filter_installed_packages(['neutron-common']),
-                fatal=True)
+    missing_packages = filter_installed_packages(['neutron-common'])
+    if missing_packages:
+        apt_install(missing_packages, fatal=True)
     # NOTE(jamespage):
     # networking-tools-source provides general tooling for configuration
     # of SR-IOV VF's and Mellanox ConnectX switchdev capable adapters
@@ -249,18 +259,17 @@ def install_packages():
     if config('networking-tools-source') and \
        (enable_sriov() or use_hw_offload()):
         add_source(config('networking-tools-source'))
-    apt_update()
     # NOTE(jamespage): ensure early install of dkms related
     #                  dependencies for kernels which need
     #                  openvswitch via dkms (12.04).
     dkms_packages = determine_dkms_package()
     if dkms_packages:
-        apt_install([headers_package()] + dkms_packages, fatal=True)
-    missing_packages = filter_installed_packages(determine_packages())
-    if missing_packages:
-        status_set('maintenance', 'Installing packages')
-        apt_install(missing_packages,
-                    fatal=True)
+        dkms_packages = filter_installed_packages(
+            [headers_package()] + dkms_packages)
+    if dkms_packages:
+        apt_index.update(config('apt-update-ttl'))
+        apt_install(dkms_packages, fatal=True)
+    apply_package_plan()
     if use_dpdk():
         enable_ovs_dpdk()
 
@@ -282,22 +291,49 @@ def install_packages():
             modprobe('nf_conntrack', True)
 
 
-def install_l3ha_packages():
-    apt_update()
-    apt_install(L3HA_PACKAGES, fatal=True)
-
+@cached
+def package_plan():
+    """Packages to install and to purge, determined once per hook.
 
-def purge_packages(pkg_list):
-    purge_pkgs = []
-    required_packages = determine_packages()
-    for pkg in pkg_list:
-        if pkg not in required_packages:
-            purge_pkgs.append(pkg)
-    purge_pkgs = filter_missing_packages(purge_pkgs)
-    if purge_pkgs:
+    :rtype: package_plan.PackagePlan
+    """
+    purge = list(determine_purge_packages())
+    if not use_dvr():
+        purge.extend(DVR_PACKAGES)
+        # NOTE(hopem): keepalived is only purged along with the DVR packages,
+        # not when using DVR without l3ha, since that results in
+        # neutron-l3-agent also being uninstalled (see LP 1819499).
+        purge.extend(L3HA_PACKAGES)
+    if not enable_local_dhcp() and not is_container():
+        purge.extend(DHCP_PACKAGES)
+        # NOTE: only purge metadata packages if dvr is not
+        #       in use as this will remove the l3 agent
+        #       see https://pad.lv/1515008
+        if not use_dvr():
+            # NOTE(fnordahl) do not remove ``haproxy``, the principal
+            # charm may have use for it. LP: #1832739
+            purge.extend(pkg for pkg in METADATA_PACKAGES
+                         if pkg != 'haproxy')
+    return PackagePlan(determine_packages(), purge)
+
+
+def apply_package_plan():
+    """Install and purge packages to match the package plan.
+
+    The package index is updated first unless all packages are installed
+    or it is fresh.
+
+    :returns: Packages installed, packages purged
+    :rtype: Tuple[List[str], List[str]]
+    """
+    plan = package_plan()
+    install, purge = plan.diff()
+    if install:
+        status_set('maintenance', 'Installing packages')
+        apt_index.update(config('apt-update-ttl'))
+    elif purge:
         status_set('maintenance', 'Purging unused packages')
-        apt_purge(purge_pkgs, fatal=True)
-        apt_autoremove(purge=True, fatal=True)
+    return plan.apply()
 
 
 def determine_packages():
@@ -359,8 +395,8 @@ def determine_purge_packages():
 
 def register_configs(release=None):
     release = release or os_release('neutron-common', base='icehouse')
-    configs = templating.OSConfigRenderer(templates_dir=TEMPLATES,
-                                          openstack_release=release)
+    configs = change_tracking.ChangeTrackingConfigRenderer(
+        templates_dir=TEMPLATES, openstack_release=release)
     for cfg, rscs in resource_map().items():
         configs.register(cfg, rscs['contexts'])
     return configs
@@ -370,21 +406,52 @@ def resource_map():
     '''
     Dynamically generate a map of resources that will be managed for a single
     hook execution.
+
+    The map is built once per hook for each combination of its inputs and
+    shared between callers, so it must not be modified.
+    '''
+    _os_release = os_release('neutron-common', base='icehouse')
+    series = lsb_release()['DISTRIB_CODENAME']
+    sriov = bool(enable_sriov())
+    # We do late initialization of the sriov-netplan-shim configuration as a
+    # call to ``context.SRIOVContext`` requires the ``sriov-netplan-shim``
+    # package to already be installed on the system.
+    sriov_netplan_shim = bool((sriov or use_hw_offload()) and
+                              sriov_netplan_shim_installed())
+    return _resource_map(_os_release, series,
+                         dvr=bool(use_dvr()),
+                         local_dhcp=bool(enable_local_dhcp()),
+                         sriov=sriov,
+                         sriov_netplan_shim=sriov_netplan_shim,
+                         dpdk=bool(use_dpdk()))
+
+
+def sriov_netplan_shim_installed():
+    '''Whether the Python module of ``sriov-netplan-shim`` is installed'''
+    return importlib.util.find_spec('sriov_netplan_shim') is not None
+
+
+@cached
+def _resource_map(_os_release, series, dvr, local_dhcp, sriov,
+                  sriov_netplan_shim, dpdk):
+    '''
+    Build resource map for the given release, series and enabled features.
+
+    Cached for the lifetime of the hook, keyed on the arguments.
     '''
     drop_config = []
     resource_map = deepcopy(BASE_RESOURCE_MAP)
-    if use_dvr():
+    if dvr:
         resource_map.update(DVR_RESOURCE_MAP)
         resource_map.update(METADATA_RESOURCE_MAP)
         dvr_services = ['neutron-metadata-agent', 'neutron-l3-agent']
         resource_map[NEUTRON_CONF]['services'] += dvr_services
-    if enable_local_dhcp():
+    if local_dhcp:
         resource_map.update(METADATA_RESOURCE_MAP)
         resource_map.update(DHCP_RESOURCE_MAP)
         metadata_services = ['neutron-metadata-agent', 'neutron-dhcp-agent']
         resource_map[NEUTRON_CONF]['services'] += metadata_services
     # Remap any service names as required
-    _os_release = os_release('neutron-common', base='icehouse')
     if CompareOpenStackReleases(_os_release) >= 'mitaka':
         # ml2_conf.ini -> openvswitch_agent.ini
         drop_config.append(ML2_CONF)
@@ -395,12 +462,12 @@ def resource_map():
         resource_map[NEUTRON_CONF]['services'].append(
             'neutron-openvswitch-agent'
         )
-        if not use_dpdk():
+        if not dpdk:
             drop_config.append(DPDK_INTERFACES)
     else:
         drop_config.extend([OVS_CONF, DPDK_INTERFACES])
 
-    if enable_sriov():
+    if sriov:
         sriov_agent_name = 'neutron-sriov-agent'
         sriov_resource_map = deepcopy(SRIOV_RESOURCE_MAP)
 
@@ -413,33 +480,27 @@ def resource_map():
         resource_map.update(sriov_resource_map)
         resource_map[NEUTRON_CONF]['services'].append(
             sriov_agent_name)
-    if enable_sriov() or use_hw_offload():
-        # We do late initialization of this as a call to
-        # ``context.SRIOVContext`` requires the ``sriov-netplan-shim`` package
-        # to already be installed on the system.
-        #
-        # Note that we also do not want the charm to manage the service, but
-        # only update the configuration for boot-time initialization.
+
+    if sriov_netplan_shim:
+        # Note that we do not want the charm to manage the service, but only
+        # update the configuration for boot-time initialization.
         # LP: #1908351
         try:
-            resource_map.update(OrderedDict([
-                (SRIOV_NETPLAN_SHIM_CONF, {
-                    # We deliberately omit service here as we only want changes
-                    # to be applied at boot time.
-                    'services': [],
-                    'contexts': [SRIOVContext_adapter()],
-                }),
-            ]))
+            resource_map[SRIOV_NETPLAN_SHIM_CONF] = {
+                # We deliberately omit service here as we only want changes
+                # to be applied at boot time.
+                'services': [],
+                'contexts': [SRIOVContext_adapter()],
+            }
         except NameError:
-            # The resource_map is built at module import time and as such this
-            # function is called multiple times prior to the charm actually
-            # being installed. As the SRIOVContext depends on a Python module
-            # provided by the ``sriov-netplan-shim`` package gracefully ignore
-            # this to allow the package to be installed.
+            # The SRIOVContext depends on the Python module provided by the
+            # ``sriov-netplan-shim`` package, which charmhelpers only imports
+            # when loaded.  Installed during this hook the entry is added by
+            # the next hook.
             pass
 
     # Use MAAS1.9 for MTU and external port config on xenial and above
-    if CompareHostReleases(lsb_release()['DISTRIB_CODENAME']) >= 'xenial':
+    if CompareHostReleases(series) >= 'xenial':
         drop_config.extend([EXT_PORT_CONF, PHY_NIC_MTU_CONF])
 
     for _conf in drop_config:
@@ -520,8 +581,57 @@ def set_Open_vSwitch_column_value(column, value):
     return False
 
 
+def check_dpdk_hugepages():
+    '''Check that NUMA nodes have the hugepages for the DPDK socket memory
+
+    :returns: Status state and message
+    :rtype: Union[(None, None), (string, string)]
+    '''
+    if not use_dpdk():
+        return None, None
+    shortfall = neutron_ovs_context.OVSDPDKDeviceContext().hugepage_shortfall()
+    if not shortfall:
+        return None, None
+    return ('blocked',
+            'Insufficient hugepages for dpdk-socket-memory: {}'.format(
+                ', '.join('node{} has {}MB of {}MB'.format(
+                    index, available, required)
+                    for index, (available, required) in shortfall.items())))
+
+
+def dpdk_hugepages_ready():
+    '''Whether DPDK is not used or has the hugepages for its socket memory
+
+    :rtype: bool
+    '''
+    return check_dpdk_hugepages()[0] is None
+
+
+def check_charm_status(configs):
+    '''Charm specific checks for the workload status
+
+    :returns: Status state and message
+    :rtype: Union[(None, None), (string, string)]
+    '''
+    state, message = validate_ovs_use_veth()
+    if state is not None:
+        return state, message
+    return check_dpdk_hugepages()
+
+
 def enable_ovs_dpdk():
-    '''Enables the DPDK variant of ovs-vswitchd and restarts it'''
+    '''Enables the DPDK variant of ovs-vswitchd and restarts it
+
+    :returns: False when DPDK is waiting for hugepages, True otherwise
+    :rtype: bool
+    '''
+    state, message = check_dpdk_hugepages()
+    if state is not None:
+        # NOTE: ovs-vswitchd fails to start without the hugepages, leave
+        #       openvswitch-switch untouched until they are available.
+        log(message, level=ERROR)
+        status_set(state, message)
+        return False
     subprocess.check_call(UPDATE_ALTERNATIVES + [OVS_DPDK_BIN])
     values_changed = []
     if ovs_has_late_dpdk_init():
@@ -529,6 +639,7 @@ def enable_ovs_dpdk():
         other_config = OrderedDict([
             ('dpdk-lcore-mask', dpdk_context.cpu_mask()),
             ('dpdk-socket-mem', dpdk_context.socket_memory()),
+            ('dpdk-socket-limit', dpdk_context.socket_limit()),
             ('dpdk-init', 'true'),
         ])
         if not ovs_vhostuser_client():
@@ -550,7 +661,8 @@ def enable_ovs_dpdk():
             )
     if ((values_changed and any(values_changed)) and
             not is_unit_paused_set()):
-        service_restart('openvswitch-switch')
+        request_restart('openvswitch-switch')
+    return True
 
 
 def enable_hw_offload():
@@ -563,7 +675,7 @@ def enable_hw_offload():
     ]
     if ((values_changed and any(values_changed)) and
             not is_unit_paused_set()):
-        service_restart('openvswitch-switch')
+        request_restart('openvswitch-switch')
 
 
 def install_tmpfilesd():
@@ -594,17 +706,21 @@ def configure_ovs():
     if not service_running('openvswitch-switch'):
         full_restart()
     datapath_type = determine_datapath_type()
-    add_bridge(INT_BRIDGE, datapath_type)
-    add_bridge(EXT_BRIDGE, datapath_type)
+    ipfix_target = config('ipfix-target') or None
+    desired = ovs_state.DesiredOVSState()
+    desired.add_bridge(INT_BRIDGE, datapath_type, ipfix_target)
+    desired.add_bridge(EXT_BRIDGE, datapath_type, ipfix_target)
     ext_port_ctx = None
     if use_dvr():
         ext_port_ctx = ExternalPortContext()()
     if ext_port_ctx and ext_port_ctx['ext_port']:
-        add_bridge_port(EXT_BRIDGE, ext_port_ctx['ext_port'])
+        desired.add_port(EXT_BRIDGE, ext_port_ctx['ext_port'], promisc=False)
 
     modern_ovs = ovs_has_late_dpdk_init()
 
-    bridgemaps = None
+    # NOTE: linuxbridge interfaces are plugged in after the transaction has
+    #       created the OVS bridges they attach to.
+    linuxbridge_ports = []
     if not use_dpdk():
         # NOTE(jamespage):
         # Its possible to support both hardware offloaded 'direct' ports
@@ -614,16 +730,16 @@ def configure_ovs():
         portmaps = DataPortContext()()
         bridgemaps = parse_bridge_mappings(config('bridge-mappings'))
         for br in bridgemaps.values():
-            add_bridge(br, datapath_type)
+            desired.add_bridge(br, datapath_type, ipfix_target)
             if not portmaps:
                 continue
 
             for port, _br in portmaps.items():
                 if _br == br:
                     if not is_linuxbridge_interface(port):
-                        add_bridge_port(br, port, promisc=True)
+                        desired.add_port(br, port, promisc=True)
                     else:
-                        add_ovsbridge_linuxbridge(br, port)
+                        linuxbridge_ports.append((br, port))
 
     # NOTE(jamespage):
     # hw-offload and dpdk are mutually exclusive so log and error
@@ -632,35 +748,48 @@ def configure_ovs():
         log('DPDK and Hardware offload are mutually exclusive, '
             'please disable enable-dpdk or enable-hardware-offload',
             level=ERROR)
+    elif use_dpdk() and not dpdk_hugepages_ready():
+        # NOTE: DPDK ports cannot be added to an ovs-vswitchd without
+        #       hugepages, see enable_ovs_dpdk.
+        log('Insufficient hugepages, skipping DPDK bridge configuration',
+            level=WARNING)
     elif use_dpdk():
         log('Configuring bridges with DPDK', level=DEBUG)
-        global_mtu = (
-            neutron_ovs_context.NeutronAPIContext()()['global_physnet_mtu'])
+        global_mtu = neutron_ovs_context.get_neutron_api_settings()[
+            'global_physnet_mtu']
         # NOTE: when in dpdk mode, add based on pci bus order
         #       with type 'dpdk'
         bridgemaps = neutron_ovs_context.resolve_dpdk_bridges()
         log('bridgemaps: {}'.format(bridgemaps), level=DEBUG)
+        port_names = dpdk_port_names()
+        pci_addresses = list(bridgemaps)
+        dpdk_context = neutron_ovs_context.OVSDPDKDeviceContext()
+        n_rxq = config('dpdk-rx-queues') or None
+        managed_keys = managed_ovs_keys()
+        desired.set_open_vswitch('other_config', managed_keys.declare(
+            'Open_vSwitch', {'pmd-cpu-mask': dpdk_context.pmd_cpu_mask()}))
         device_index = 0
         for pci_address, br in bridgemaps.items():
             log('Adding DPDK bridge: {}:{}'.format(br, datapath_type),
                 level=DEBUG)
-            add_bridge(br, datapath_type)
+            desired.add_bridge(br, datapath_type, ipfix_target)
             if modern_ovs:
-                portname = 'dpdk-{}'.format(
-                    hashlib.sha1(pci_address.encode('UTF-8')).hexdigest()[:7]
-                )
+                portname = port_names.get_port_name(pci_address, br)
             else:
                 portname = 'dpdk{}'.format(device_index)
 
             log('Adding DPDK port: {}:{}:{}'.format(br, portname,
                                                     pci_address),
                 level=DEBUG)
-            dpdk_add_bridge_port(br, portname,
-                                 pci_address)
             # TODO(sahid): We should also take into account the
             # "physical-network-mtus" in case different MTUs are
             # configured based on physical networks.
-            dpdk_set_mtu_request(portname, global_mtu)
+            desired.add_port(
+                br, portname,
+                ifdata=dpdk_interface_data(
+                    pci_address, global_mtu, n_rxq=n_rxq,
+                    rxq_affinity=dpdk_context.rxq_affinity(pci_address)),
+                linkup=False)
             device_index += 1
 
         if modern_ovs:
@@ -668,6 +797,7 @@ def configure_ovs():
                 level=DEBUG)
             bondmaps = neutron_ovs_context.resolve_dpdk_bonds()
             log('bondmaps: {}'.format(bondmaps), level=DEBUG)
+            pci_addresses.extend(bondmaps)
             bridge_bond_map = DPDKBridgeBondMap()
             portmap = parse_data_port_mappings(config('data-port'))
             log('portmap: {}'.format(portmap), level=DEBUG)
@@ -676,11 +806,10 @@ def configure_ovs():
                     log('Adding DPDK bridge: {}:{}'.format(portmap[bond],
                                                            datapath_type),
                         level=DEBUG)
-                    add_bridge(portmap[bond], datapath_type)
-                    portname = 'dpdk-{}'.format(
-                        hashlib.sha1(pci_address.encode('UTF-8'))
-                        .hexdigest()[:7]
-                    )
+                    desired.add_bridge(portmap[bond], datapath_type,
+                                       ipfix_target)
+                    portname = port_names.get_port_name(
+                        pci_address, portmap[bond], bond)
                     bridge_bond_map.add_port(portmap[bond], bond,
                                              portname, pci_address)
 
@@ -692,40 +821,78 @@ def configure_ovs():
                     log('Adding DPDK bond: {}:{}:{}'.format(br, bond,
                                                             port_map),
                         level=DEBUG)
-                    dpdk_add_bridge_bond(br, bond, port_map)
-                    dpdk_set_interfaces_mtu(
-                        global_mtu,
-                        port_map.keys())
+                    bond_config = bond_configs.get_bond_config(bond)
                     log('Configuring DPDK bond: {}:{}'.format(
-                        bond,
-                        bond_configs.get_bond_config(bond)),
+                        bond, bond_config),
                         level=DEBUG)
-                    dpdk_set_bond_config(
-                        bond,
-                        bond_configs.get_bond_config(bond)
-                    )
-
-    target = config('ipfix-target')
-    bridges = [INT_BRIDGE, EXT_BRIDGE]
-    if bridgemaps:
-        bridges.extend(bridgemaps.values())
-
-    if target:
-        for bridge in bridges:
-            disable_ipfix(bridge)
-            enable_ipfix(bridge, target)
-    else:
-        # NOTE: removing ipfix setting from a bridge is idempotent and
-        #       will pass regardless of the existence of the setting
-        for bridge in bridges:
-            disable_ipfix(bridge)
+                    desired.add_bond(
+                        br, bond,
+                        OrderedDict(
+                            (portname, dpdk_interface_data(
+                                pci_address, global_mtu, n_rxq=n_rxq,
+                                rxq_affinity=dpdk_context.rxq_affinity(
+                                    pci_address)))
+                            for portname, pci_address in port_map.items()),
+                        portdata=dpdk_bond_data(bond_config))
+        port_names.prune(pci_addresses)
+        port_names.save()
+
+    ovs_state.reconcile(desired, ovs_state.OVSDBSnapshot.load()).commit()
+    managed_ovs_keys().save()
+    for br, port in linuxbridge_ports:
+        add_ovsbridge_linuxbridge(br, port)
 
     # Ensure this runs so that mtu is applied to data-port interfaces if
     # provided.
     # NOTE(ajkavanagh) for pause/resume we don't gate this as it's not a
     # running service, but rather running a few commands.
     if not init_is_systemd():
-        service_restart('os-charm-phy-nic-mtu')
+        request_restart('os-charm-phy-nic-mtu')
+
+
+def dpdk_interface_data(pci_address, mtu, n_rxq=None, rxq_affinity=None):
+    """Interface column data for a DPDK port.
+
+    :param pci_address: PCI address of the device backing the interface
+    :type pci_address: str
+    :param mtu: MTU to request for the interface
+    :type mtu: int
+    :param n_rxq: Number of receive queues, None to leave as is
+    :type n_rxq: Optional[int]
+    :param rxq_affinity: pmd-rxq-affinity of the interface, None to leave
+                         as is
+    :type rxq_affinity: Optional[str]
+    :returns: Column data for ``ovs_state.DesiredOVSState``
+    :rtype: Dict[str,Union[str,Dict[str,Optional[str]]]]
+    """
+    managed_keys = managed_ovs_keys()
+    ifdata = OrderedDict([('type', 'dpdk')])
+    options = OrderedDict()
+    if ovs_has_late_dpdk_init():
+        options['dpdk-devargs'] = pci_address
+    options.update(managed_keys.declare(
+        'options:{}'.format(pci_address), {'n_rxq': n_rxq}))
+    ifdata['options'] = options
+    ifdata['mtu_request'] = mtu
+    ifdata['other_config'] = managed_keys.declare(
+        'other_config:{}'.format(pci_address),
+        {'pmd-rxq-affinity': rxq_affinity})
+    return ifdata
+
+
+def dpdk_bond_data(bond_config):
+    """Port column data for a DPDK bond.
+
+    :param bond_config: Bond configuration from ``DPDKBondsConfig``
+    :type bond_config: Dict[str, str]
+    :returns: Column data for ``ovs_state.DesiredOVSState``
+    :rtype: Dict[str,Union[str,Dict[str,str]]]
+    """
+    return OrderedDict([
+        ('bond_mode', bond_config['mode']),
+        ('lacp', bond_config['lacp']),
+        ('other_config', {'lacp-time': bond_config['lacp-time']}),
+    ])
 
 
 def _get_interfaces_from_mappings(sriov_mappings):
@@ -746,13 +913,17 @@ def get_shared_secret():
 
 
 def use_dvr():
-    return not is_container() and context.NeutronAPIContext()().get(
-        'enable_dvr', False)
+    if is_container():
+        return False
+    settings = neutron_ovs_context.get_neutron_api_settings()
+    return settings.get('enable_dvr', False)
 
 
 def use_l3ha():
-    return not is_container() and context.NeutronAPIContext()().get(
-        'enable_l3ha', False)
+    if is_container():
+        return False
+    settings = neutron_ovs_context.get_neutron_api_settings()
+    return settings.get('enable_l3ha', False)
 
 
 def determine_datapath_type():
@@ -825,72 +996,6 @@ class SRIOVContext_adapter(object):
         return {'sriov_device': self._sriov_device}
 
 
-# TODO: update into charm-helpers to add port_type parameter
-def dpdk_add_bridge_port(name, port, pci_address=None):
-    ''' Add a port to the named openvswitch bridge '''
-    # log('Adding port {} to bridge {}'.format(port, name))
-    if ovs_has_late_dpdk_init():
-        cmd = ["ovs-vsctl",
-               "add-port", name, port, "--",
-               "set", "Interface", port,
-               "type=dpdk",
-               "options:dpdk-devargs={}".format(pci_address)]
-    else:
-        cmd = ["ovs-vsctl", "--",
-               "--may-exist", "add-port", name, port,
-               "--", "set", "Interface", port, "type=dpdk"]
-    subprocess.check_call(cmd)
-
-
-def dpdk_add_bridge_bond(bridge_name, bond_name, port_map):
-    ''' Add ports to a bond attached to the named openvswitch bridge '''
-    if not ovs_has_late_dpdk_init():
-        raise Exception("Bonds are not supported for OVS pre-2.6.0")
-
-    cmd = ["ovs-vsctl", "--may-exist",
-           "add-bond", bridge_name, bond_name]
-    for portname in port_map.keys():
-        cmd.append(portname)
-    for portname, pci_address in port_map.items():
-        cmd.extend(["--", "set", "Interface", portname,
-                    "type=dpdk",
-                    "options:dpdk-devargs={}".format(pci_address)])
-    subprocess.check_call(cmd)
-
-
-def dpdk_set_bond_config(bond_name, config):
-    if not ovs_has_late_dpdk_init():
-        raise Exception("Bonds are not supported for OVS pre-2.6.0")
-
-    cmd = ["ovs-vsctl",
-           "--", "set", "port", bond_name,
-           "bond_mode={}".format(config['mode']),
-           "--", "set", "port", bond_name,
-           "lacp={}".format(config['lacp']),
-           "--", "set", "port", bond_name,
-           "other_config:lacp-time=={}".format(config['lacp-time']),
-           ]
-    subprocess.check_call(cmd)
-
-
-def dpdk_set_mtu_request(port, mtu):
-    cmd = ["ovs-vsctl", "set", "Interface", port,
-           "mtu_request={}".format(mtu)]
-    subprocess.check_call(cmd)
-
-
-def dpdk_set_interfaces_mtu(mtu, ports):
-    """Set MTU on dpdk ports.
-
-    :param mtu: Name of unit to match
-    :type mtu: str
-    :param ports: List of ports
-    :type ports: []
-    """
-    for port in ports:
-        dpdk_set_mtu_request(port, mtu)
-
-
 def enable_nova_metadata():
     return not is_container() and (use_dvr() or enable_local_dhcp())
 
@@ -906,6 +1011,7 @@ def assess_status(configs):
     SIDE EFFECT: calls set_os_workload_status(...) which sets the workload
     status of the unit.
     Also calls status_set(...) directly if paused state isn't complete.
+    Records the status inputs for the update-status fast path.
     @param configs: a templating.OSConfigRenderer() object
     @returns None - this function is executed for its side-effect
     """
@@ -914,6 +1020,7 @@ def assess_status(configs):
         exclude_services = ['openvswitch-switch']
     assess_status_func(configs, exclude_services)()
     os_application_version_set(VERSION_PACKAGE)
+    status_fingerprint.record(services(exclude_services))
 
 
 def assess_status_func(configs, exclude_services=None):
@@ -940,7 +1047,7 @@ def assess_status_func(configs, exclude_services=None):
         required_interfaces['neutron-plugin-api'] = ['neutron-plugin-api']
     return make_assess_status_func(
         configs, required_interfaces,
-        charm_func=validate_ovs_use_veth,
+        charm_func=check_charm_status,
         services=services(exclude_services), ports=None)
 
 
@@ -979,9 +1086,169 @@ def _pause_resume_helper(f, configs, exclude_services=None):
     # that exists due to service_start()
     if exclude_services is None:
         exclude_services = []
+    action = 'pause' if f is pause_unit else 'resume'
+
+    def _manage_services():
+        # NOTE: services are paused or resumed here rather than by f so that
+        #       independent services are handled concurrently.
+        messages = service_state.manage_services(
+            action, services(exclude_services), max_workers=SERVICE_WORKERS)
+        return '; '.join(messages) or None
+
     f(assess_status_func(configs, exclude_services),
-      services=services(exclude_services),
-      ports=None)
+      services=None,
+      ports=None,
+      charm_func=_manage_services)
+
+
+DPDK_PORTS_KEY = 'dpdk_ports'
+
+
+class DPDKPortNames():
+    '''
+    Persistent names of DPDK ports, keyed by PCI address.
+
+    Names are derived from the SHA1 of the PCI address truncated to seven
+    hex characters, as used before names were recorded.  Should that name
+    already belong to another device the digest is truncated to the first
+    length that is unique.  The bridge and bond of each port are recorded
+    along with the name; the table is read once per hook, pruned of devices
+    no longer mapped and written back in one transaction by ``save``.
+    '''
+
+    def __init__(self):
+        self.ports = kv().get(DPDK_PORTS_KEY, {})
+        self.changed = False
+
+    def _new_name(self, pci_address):
+        digest = hashlib.sha1(pci_address.encode('UTF-8')).hexdigest()
+        taken = set(port['name'] for port in self.ports.values())
+        for length in range(7, len(digest) + 1):
+            portname = 'dpdk-{}'.format(digest[:length])
+            if portname not in taken:
+                return portname
+            log('DPDK port name {} of {} is already in use'
+                .format(portname, pci_address), level=WARNING)
+        raise ValueError('No unique DPDK port name for {}'
+                         .format(pci_address))
+
+    def get_port_name(self, pci_address, bridge, bond=None):
+        '''
+        Name of the DPDK port for a PCI device, allocated on first use.
+
+        :param pci_address: PCI address of the device
+        :type pci_address: str
+        :param bridge: Bridge the port is added to
+        :type bridge: str
+        :param bond: Bond the port is a member of, if any
+        :type bond: Optional[str]
+        :returns: Port name
+        :rtype: str
+        '''
+        port = self.ports.get(pci_address)
+        if port is None:
+            port = {'name': self._new_name(pci_address)}
+        new_port = dict(port, bridge=bridge, bond=bond)
+        if new_port != port:
+            self.ports[pci_address] = new_port
+            self.changed = True
+        return new_port['name']
+
+    def prune(self, pci_addresses):
+        '''
+        Forget the ports of devices not in the current port mappings.
+
+        :param pci_addresses: PCI addresses of the mapped devices
+        :type pci_addresses: Iterable[str]
+        '''
+        pci_addresses = set(pci_addresses)
+        for pci_address in list(self.ports):
+            if pci_address not in pci_addresses:
+                log('Forgetting DPDK port {} of {}'.format(
+                    self.ports[pci_address]['name'], pci_address),
+                    level=DEBUG)
+                del self.ports[pci_address]
+                self.changed = True
+
+    def save(self):
+        '''Record allocated port names if any changed.'''
+        if self.changed:
+            db = kv()
+            db.set(DPDK_PORTS_KEY, self.ports)
+            db.flush()
+            self.changed = False
+
+
+OVS_MANAGED_KEYS = 'ovs_managed_keys'
+
+
+class ManagedOVSKeys():
+    '''
+    Optional Open vSwitch map keys set by the charm, recorded in unitdata.
+
+    Keys of options that are not configured are left out of the desired
+    state, keeping any value set by the operator, unless the charm set
+    them before; those are removed.
+    '''
+
+    def __init__(self):
+        self.keys = set(kv().get(OVS_MANAGED_KEYS, []))
+        self.changed = False
+
+    def declare(self, scope, mapping):
+        '''
+        Map column data for keys that are set or were set by the charm.
+
+        :param scope: Row and column of the map, e.g. 'Open_vSwitch'
+        :type scope: str
+        :param mapping: Desired values, None where not configured
+        :type mapping: Dict[str, Optional[str]]
+        :returns: Map column data for ``ovs_state.DesiredOVSState``
+        :rtype: Dict[str, Optional[str]]
+        '''
+        data = OrderedDict()
+        for key, value in mapping.items():
+            managed = '{}:{}'.format(scope, key)
+            if value is not None:
+                data[key] = value
+                if managed not in self.keys:
+                    self.keys.add(managed)
+                    self.changed = True
+            elif managed in self.keys:
+                # set by the charm before, remove it
+                data[key] = None
+                self.keys.discard(managed)
+                self.changed = True
+        return data
+
+    def save(self):
+        '''Record the managed keys if any changed.'''
+        if self.changed:
+            db = kv()
+            db.set(OVS_MANAGED_KEYS, sorted(self.keys))
+            db.flush()
+            self.changed = False
+
+
+@cached
+def managed_ovs_keys():
+    '''
+    Open vSwitch map keys set by the charm, read once per hook.
+
+    :rtype: ManagedOVSKeys
+    '''
+    return ManagedOVSKeys()
+
+
+@cached
+def dpdk_port_names():
+    '''
+    DPDK port names recorded in unitdata, read once per hook.
+
+    :returns: Port name allocator
+    :rtype: DPDKPortNames
+    '''
+    return DPDKPortNames()
 
 
 class DPDKBridgeBondMap():
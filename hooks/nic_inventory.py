@@ -0,0 +1,217 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Network interface inventory shared by the port resolution contexts.
+
+``charmhelpers.contrib.openstack.context.NeutronPortContext.resolve_ports``
+lists the interfaces with ``ip a``, then for each of them globs
+``/sys/class/net`` to tell whether it is physical and runs
+``ip -o -0 addr show`` for its MAC address.  Here all interfaces are read
+from sysfs once per hook, including their bond master and bridge, and the
+data port, external port and NIC MTU contexts resolve ports from that
+snapshot.
+"""
+
+import os
+import re
+
+from collections import OrderedDict
+
+from charmhelpers.contrib.network.ip import (
+    get_ipv4_addr,
+    get_ipv6_addr,
+)
+from charmhelpers.core.hookenv import (
+    cached,
+    log,
+    DEBUG,
+)
+
+SYS_CLASS_NET = '/sys/class/net'
+
+# /sys/class/net/<nic>/type of interfaces shown as link/ether by ip.
+ARPHRD_ETHER = '1'
+
+MAC_REGEX = re.compile(r'([0-9A-F]{2}[:-]){5}([0-9A-F]{2})', re.I)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+class NIC(object):
+    """Network interface.
+
+    :param name: Name of the interface
+    :type name: str
+    :param ifindex: Index of the interface
+    :type ifindex: int
+    :param hwaddr: MAC address, empty for non ethernet interfaces
+    :type hwaddr: str
+    :param physical: Whether the interface is not virtual
+    :type physical: bool
+    :param bond_master: Bond the interface is a slave of
+    :type bond_master: Optional[str]
+    :param bridge: Linux bridge the interface is a member of
+    :type bridge: Optional[str]
+    """
+
+    def __init__(self, name, ifindex=0, hwaddr='', physical=False,
+                 bond_master=None, bridge=None):
+        self.name = name
+        self.ifindex = ifindex
+        self.hwaddr = hwaddr
+        self.physical = physical
+        self.bond_master = bond_master
+        self.bridge = bridge
+
+    def __repr__(self):
+        return 'NIC({!r})'.format(self.name)
+
+    @classmethod
+    def from_sysfs(cls, name, sys_net=SYS_CLASS_NET):
+        """Read an interface from sysfs.
+
+        :param name: Name of the interface
+        :type name: str
+        :param sys_net: Path of the network class in sysfs
+        :type sys_net: str
+        :rtype: NIC
+        """
+        path = os.path.join(sys_net, name)
+        physical = '/virtual/' not in os.path.realpath(path)
+        hwaddr = ''
+        if _read(os.path.join(path, 'type')) == ARPHRD_ETHER:
+            hwaddr = _read(os.path.join(path, 'address')) or ''
+        bond_master = bridge = None
+        master = os.path.join(path, 'master')
+        if os.path.exists(master):
+            master = os.path.realpath(master)
+            if os.path.exists(os.path.join(master, 'bonding')):
+                # NOTE: only physical interfaces are replaced by their bond
+                #       master, like charmhelpers.core.host.get_bond_master.
+                if physical:
+                    bond_master = os.path.basename(master)
+            elif os.path.isdir(os.path.join(master, 'bridge')):
+                bridge = os.path.basename(master)
+        try:
+            ifindex = int(_read(os.path.join(path, 'ifindex')))
+        except (TypeError, ValueError):
+            ifindex = 0
+        return cls(name, ifindex=ifindex, hwaddr=hwaddr, physical=physical,
+                   bond_master=bond_master, bridge=bridge)
+
+    def addresses(self):
+        """IPv4 and global dynamic IPv6 addresses of the interface.
+
+        :rtype: List[str]
+        """
+        addresses = get_ipv4_addr(self.name, fatal=False)
+        addresses += get_ipv6_addr(iface=self.name, fatal=False)
+        return addresses
+
+
+class NICInventory(object):
+    """Network interfaces of the unit.
+
+    :param nics: Interfaces in order of their index
+    :type nics: Iterable[NIC]
+    """
+
+    def __init__(self, nics):
+        self.nics = OrderedDict((nic.name, nic) for nic in nics)
+
+    @classmethod
+    def load(cls, sys_net=SYS_CLASS_NET):
+        """Read all interfaces from sysfs.
+
+        :param sys_net: Path of the network class in sysfs
+        :type sys_net: str
+        :rtype: NICInventory
+        """
+        try:
+            names = os.listdir(sys_net)
+        except OSError:
+            names = []
+        # NOTE: skip files such as bonding_masters.
+        nics = [NIC.from_sysfs(name, sys_net) for name in names
+                if os.path.isdir(os.path.join(sys_net, name))]
+        return cls(sorted(nics, key=lambda nic: nic.ifindex))
+
+    def get_nic_hwaddr(self, nic):
+        """Return the MAC address of an interface, empty if unknown.
+
+        :param nic: Name of the interface
+        :type nic: str
+        :rtype: str
+        """
+        return self.nics[nic].hwaddr if nic in self.nics else ''
+
+    def resolve_ports(self, ports):
+        """Resolve NICs not yet bound to bridge(s).
+
+        Same resolution as
+        ``charmhelpers.contrib.openstack.context.NeutronPortContext``: a
+        MAC address resolves to the physical interface, or its bond master,
+        unless it has addresses or is a linux bridge member.  An interface
+        name resolves to itself if it exists.
+
+        :param ports: Interface names or MAC addresses
+        :type ports: Optional[List[str]]
+        :returns: Names of the interfaces
+        :rtype: Optional[List[str]]
+        """
+        if not ports:
+            return None
+
+        hwaddr_to_nic = {}
+        for nic in self.nics.values():
+            # Ignore virtual interfaces (bond masters will be identified from
+            # their slaves)
+            if not nic.physical:
+                continue
+            if nic.bond_master in self.nics:
+                log("Replacing iface '{}' with bond master '{}'"
+                    .format(nic.name, nic.bond_master), level=DEBUG)
+                nic = self.nics[nic.bond_master]
+            hwaddr_to_nic[nic.hwaddr] = nic
+
+        resolved = []
+        for entry in ports:
+            if re.match(MAC_REGEX, entry):
+                nic = hwaddr_to_nic.get(entry)
+                # Entry is a MAC address for a valid interface that doesn't
+                # have an IP address assigned yet and is not part of a bridge.
+                if nic and not nic.bridge and not nic.addresses():
+                    resolved.append(nic.name)
+            elif entry in self.nics:
+                # An existing interface given by name is trusted to be the
+                # one the user meant.
+                resolved.append(entry)
+
+        # Ensure no duplicates
+        return list(set(resolved))
+
+
+@cached
+def inventory():
+    """Network interfaces of the unit, read once per hook.
+
+    :rtype: NICInventory
+    """
+    return NICInventory.load()
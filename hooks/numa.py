@@ -0,0 +1,256 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+
+from collections import OrderedDict
+
+from charmhelpers.core.hookenv import cached
+
+import pci
+
+NODE_DIR = '/sys/devices/system/node'
+
+_NODE_RE = re.compile(r'^node(\d+)$')
+_HUGEPAGES_RE = re.compile(r'^hugepages-(\d+)kB$')
+
+
+def cpu_list_to_mask(cpulist):
+    '''
+    Parses a linux cpulist into a CPU mask, one bit per core
+
+    Ranges are converted as a whole, so the cost does not depend on the
+    number of cores.
+
+    @return int
+    '''
+    mask = 0
+    for cpu_range in cpulist.split(','):
+        if not cpu_range:
+            continue
+        first, _, last = cpu_range.partition('-')
+        first = int(first)
+        last = int(last) if last else first
+        mask |= ((1 << (last - first + 1)) - 1) << first
+    return mask
+
+
+def mask_to_cpu_list(mask):
+    '''List of cores set in a CPU mask, lowest first'''
+    cores = []
+    while mask:
+        low = mask & -mask
+        cores.append(low.bit_length() - 1)
+        mask ^= low
+    return cores
+
+
+def lowest_cpus(mask, count, skip=0):
+    '''
+    CPU mask of the count lowest cores set in mask, after skipping the
+    lowest skip cores
+    '''
+    result = 0
+    for i in range(skip + count):
+        if not mask:
+            break
+        low = mask & -mask
+        if i >= skip:
+            result |= low
+        mask ^= low
+    return result
+
+
+def format_mask(mask):
+    '''Hex formatted CPU mask as used by Open vSwitch'''
+    return format(mask, '#04x')
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+class NUMANode(object):
+    '''
+    CPUs, memory and hugepages of a NUMA node
+
+    :param index: NUMA node number
+    :type index: int
+    :param cpu_mask: CPU mask of the cores of the node
+    :type cpu_mask: int
+    :param mem_total_kb: Memory of the node in kB
+    :type mem_total_kb: int
+    :param hugepages: Total and free hugepages keyed by page size in kB
+    :type hugepages: Optional[Dict[int, Dict[str, int]]]
+    '''
+
+    def __init__(self, index, cpu_mask, mem_total_kb=0, hugepages=None):
+        self.index = index
+        self.cpu_mask = cpu_mask
+        self.mem_total_kb = mem_total_kb
+        self.hugepages = hugepages or {}
+
+    @property
+    def cpus(self):
+        return mask_to_cpu_list(self.cpu_mask)
+
+    def hugepages_mb(self, free=False):
+        '''Memory in hugepages of any size in MB'''
+        key = 'free' if free else 'total'
+        return sum(size_kb * pages[key]
+                   for size_kb, pages in self.hugepages.items()) // 1024
+
+    @classmethod
+    def load(cls, index, node_dir):
+        cpu_mask = cpu_list_to_mask(_read(os.path.join(node_dir, 'cpulist')))
+        mem_total_kb = 0
+        try:
+            with open(os.path.join(node_dir, 'meminfo')) as meminfo:
+                for line in meminfo:
+                    # e.g. 'Node 0 MemTotal:       32768000 kB'
+                    fields = line.split()
+                    if fields[2:3] == ['MemTotal:']:
+                        mem_total_kb = int(fields[3])
+                        break
+        except OSError:
+            pass
+        hugepages = {}
+        hugepages_dir = os.path.join(node_dir, 'hugepages')
+        try:
+            entries = os.listdir(hugepages_dir)
+        except OSError:
+            entries = []
+        for entry in entries:
+            match = _HUGEPAGES_RE.match(entry)
+            if match:
+                size_dir = os.path.join(hugepages_dir, entry)
+                hugepages[int(match.group(1))] = {
+                    'total': int(_read(os.path.join(size_dir,
+                                                    'nr_hugepages'))),
+                    'free': int(_read(os.path.join(size_dir,
+                                                   'free_hugepages'))),
+                }
+        return cls(index, cpu_mask, mem_total_kb, hugepages)
+
+
+class NUMATopology(object):
+    '''
+    NUMA nodes of the unit and the nodes PCI devices are attached to
+
+    :param nodes: NUMA nodes
+    :type nodes: Iterable[NUMANode]
+    :param device_nodes: NUMA node number keyed by PCI address, None where
+                         the platform does not report one
+    :type device_nodes: Optional[Dict[str, Optional[int]]]
+    '''
+
+    def __init__(self, nodes, device_nodes=None):
+        self.nodes = OrderedDict(
+            (node.index, node)
+            for node in sorted(nodes, key=lambda node: node.index))
+        self.device_nodes = device_nodes or {}
+
+    @classmethod
+    def load(cls, pci_addresses=(), node_dir=None, pci_dir=None):
+        '''
+        Read the topology from sysfs
+
+        :param pci_addresses: PCI devices to find the NUMA node of
+        :type pci_addresses: Iterable[str]
+        :param node_dir: NUMA nodes /sys directory, defaults to NODE_DIR
+        :type node_dir: Optional[str]
+        :param pci_dir: PCI devices /sys directory, defaults to
+                        pci.PCI_DEVICES_DIR
+        :type pci_dir: Optional[str]
+        :rtype: NUMATopology
+        '''
+        node_dir = node_dir or NODE_DIR
+        pci_dir = pci_dir or pci.PCI_DEVICES_DIR
+        nodes = []
+        try:
+            entries = os.listdir(node_dir)
+        except OSError:
+            entries = []
+        for entry in entries:
+            match = _NODE_RE.match(entry)
+            if match:
+                nodes.append(NUMANode.load(int(match.group(1)),
+                                           os.path.join(node_dir, entry)))
+        device_nodes = {}
+        for pci_address in pci_addresses:
+            try:
+                numa_node = int(_read(os.path.join(pci_dir, pci_address,
+                                                   'numa_node')))
+            except (OSError, ValueError):
+                numa_node = -1
+            # -1 if the platform does not provide locality information
+            device_nodes[pci_address] = numa_node if numa_node >= 0 else None
+        return cls(nodes, device_nodes)
+
+    def lcore_mask(self, cores_per_node):
+        '''CPU mask of the first cores_per_node cores of every node'''
+        return self.pmd_mask(cores_per_node)
+
+    def pmd_mask(self, cores_per_node, nodes=None, skip=0):
+        '''
+        CPU mask of cores_per_node cores of each of the given nodes
+
+        :param cores_per_node: Number of cores to use per node
+        :type cores_per_node: int
+        :param nodes: NUMA node numbers, all nodes if None
+        :type nodes: Optional[Iterable[int]]
+        :param skip: Number of lowest cores of each node not to use, e.g.
+                     the ones used for DPDK lcores
+        :type skip: int
+        :rtype: int
+        '''
+        if nodes is None:
+            nodes = self.nodes
+        mask = 0
+        for index in nodes:
+            mask |= lowest_cpus(self.nodes[index].cpu_mask, cores_per_node,
+                                skip=skip)
+        return mask
+
+    def socket_memory(self, size):
+        '''List of size, per NUMA node, as used for dpdk-socket-mem'''
+        return [size for _ in self.nodes]
+
+    def local_nodes(self, pci_addresses):
+        '''
+        NUMA nodes the PCI devices are attached to
+
+        All nodes if the locality of none of the devices is known.
+
+        :rtype: List[int]
+        '''
+        nodes = set(self.device_nodes.get(pci_address)
+                    for pci_address in pci_addresses)
+        nodes.discard(None)
+        nodes.intersection_update(self.nodes)
+        return sorted(nodes) if nodes else list(self.nodes)
+
+
+@cached
+def numa_topology(pci_addresses=()):
+    '''
+    NUMA topology of the unit, read once per hook
+
+    :param pci_addresses: PCI devices to find the NUMA node of
+    :type pci_addresses: Iterable[str]
+    :rtype: NUMATopology
+    '''
+    return NUMATopology.load(pci_addresses)
@@ -0,0 +1,488 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reconcile the Open vSwitch configuration managed by the charm.
+
+Rather than running one ``ovs-vsctl`` command per bridge, port and column
+the charm declares the state it wants in a ``DesiredOVSState`` object,
+compares it with a single ``OVSDBSnapshot`` of the database and applies the
+difference in one ``ovs-vsctl`` transaction.
+"""
+
+import collections
+import subprocess
+
+import charmhelpers.contrib.network.ovs as ch_ovs
+from charmhelpers.core.hookenv import (
+    log,
+    DEBUG,
+)
+
+import ovsdb_jsonrpc
+
+IPFIX_DEFAULTS = collections.OrderedDict([
+    ('sampling', 64),
+    ('cache_active_timeout', 60),
+    ('cache_max_flows', 128),
+])
+
+
+def _ovsdb_set(value):
+    """Normalize value of an OVSDB set column to a list.
+
+    ``ovs-vsctl`` presents sets with a single member as the member itself.
+
+    :param value: Value as presented by ``SimpleOVSDB``
+    :type value: any
+    :returns: List of set members
+    :rtype: List[any]
+    """
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _ovsdb_optional(value):
+    """Normalize value of an optional OVSDB column.
+
+    :param value: Value as presented by ``SimpleOVSDB``
+    :type value: any
+    :returns: The value or None when not set
+    :rtype: Optional[any]
+    """
+    if value == []:
+        return None
+    return value
+
+
+class OVSDBSnapshot(object):
+    """Point in time copy of the Open vSwitch tables managed by the charm."""
+
+    TABLES = ('open_vswitch', 'bridge', 'port', 'interface', 'ipfix')
+
+    def __init__(self, tables):
+        """OVSDBSnapshot constructor.
+
+        :param tables: Rows of each table in ``TABLES``
+        :type tables: Dict[str, List[Dict[str, any]]]
+        """
+        self._tables = {
+            table: {row['_uuid']: row for row in tables.get(table, [])}
+            for table in self.TABLES
+        }
+        # the Open_vSwitch table has a single row
+        self.open_vswitch = next(
+            iter(self._tables['open_vswitch'].values()), None)
+        self.bridges = {row['name']: row
+                        for row in self._tables['bridge'].values()}
+        self.ports = {row['name']: row
+                      for row in self._tables['port'].values()}
+        self.interfaces = {row['name']: row
+                           for row in self._tables['interface'].values()}
+        self._port_bridge = {}
+        for bridge in self.bridges.values():
+            for port_uuid in _ovsdb_set(bridge['ports']):
+                self._port_bridge[port_uuid] = bridge['name']
+        self._patch_peer = collections.OrderedDict(
+            (row['name'], row['options'].get('peer'))
+            for row in self._tables['interface'].values()
+            if row.get('type') == 'patch')
+
+    @classmethod
+    def load(cls, ovsdb=None):
+        """Read the managed tables from the local Open vSwitch database.
+
+        :param ovsdb: Database to read from, defaults to the local
+                      Open vSwitch database.
+        :type ovsdb: Optional[SimpleOVSDB]
+        :returns: Snapshot of the database
+        :rtype: OVSDBSnapshot
+        :raises: subprocess.CalledProcessError, ovsdb_jsonrpc.OVSDBError
+        """
+        ovsdb = ovsdb or ovsdb_jsonrpc.SimpleOVSDB('ovs-vsctl')
+        return cls({table: list(getattr(ovsdb, table))
+                    for table in cls.TABLES})
+
+    def row(self, table, uuid):
+        """Get row by UUID.
+
+        :param table: Name of table
+        :type table: str
+        :param uuid: UUID of row
+        :type uuid: uuid.UUID
+        :returns: Row or None
+        :rtype: Optional[Dict[str, any]]
+        """
+        return self._tables[table].get(uuid)
+
+    def uuid_for_port(self, port_name):
+        """Get UUID of named port.
+
+        :param port_name: Name of port
+        :type port_name: str
+        :returns: UUID of port or None if not found
+        :rtype: Optional[uuid.UUID]
+        """
+        port = self.ports.get(port_name)
+        if port is None:
+            return None
+        return port['_uuid']
+
+    def bridge_for_port(self, port_uuid):
+        """Find which bridge a port is on.
+
+        :param port_uuid: UUID of port
+        :type port_uuid: uuid.UUID
+        :returns: Name of bridge or None if not found
+        :rtype: Optional[str]
+        """
+        return self._port_bridge.get(port_uuid)
+
+    def port_to_br(self, port_name):
+        """Determine the bridge that contains a port.
+
+        :param port_name: Name of port
+        :type port_name: str
+        :returns: Name of bridge or None if not found
+        :rtype: Optional[str]
+        """
+        return self.bridge_for_port(self.uuid_for_port(port_name))
+
+    def patch_ports_on_bridge(self, bridge):
+        """Find patch ports on a bridge.
+
+        Same as ``charmhelpers.contrib.network.ovs.patch_ports_on_bridge``
+        but served from the snapshot.
+
+        :param bridge: Name of bridge
+        :type bridge: str
+        :returns: Bridge and port name for both ends of each patch
+        :rtype: List[Patch[PatchPort[str,str],PatchPort[str,str]]]
+        :raises: ValueError
+        """
+        patches = []
+        for name, peer in self._patch_peer.items():
+            port_uuid = self.uuid_for_port(name)
+            if port_uuid is None:
+                raise ValueError('Port for interface named "{}" does '
+                                 'unexpectedly not exist.'.format(name))
+            if self.bridge_for_port(port_uuid) != bridge:
+                continue
+            patches.append(ch_ovs.Patch(
+                ch_ovs.PatchPort(bridge, name),
+                ch_ovs.PatchPort(self.port_to_br(peer), peer)))
+        return patches
+
+    def port_interfaces(self, port_name):
+        """Get names of the interfaces that make up a port.
+
+        :param port_name: Name of port
+        :type port_name: str
+        :returns: Names of interfaces
+        :rtype: List[str]
+        """
+        port = self.ports.get(port_name)
+        if port is None:
+            return []
+        return [self.row('interface', uuid)['name']
+                for uuid in _ovsdb_set(port['interfaces'])
+                if self.row('interface', uuid)]
+
+
+class DesiredOVSState(object):
+    """Bridges and ports the charm wants present in Open vSwitch.
+
+    Column data for bridges, ports and interfaces follow the format of
+    ``charmhelpers.contrib.network.ovs._dict_to_vsctl_set``, i.e. keys are
+    column names and dictionary values are used for map columns.  Only the
+    keys given are managed, other keys present in a map column are left
+    untouched.  A key with a value of None is removed from the map column.
+    """
+
+    Port = collections.namedtuple(
+        'Port', ('bridge', 'interfaces', 'portdata', 'promisc', 'linkup'))
+
+    def __init__(self):
+        self.open_vswitch = {}
+        self.bridges = collections.OrderedDict()
+        self.ports = collections.OrderedDict()
+
+    def set_open_vswitch(self, column, value):
+        """Declare a column of the Open_vSwitch table.
+
+        Map columns are merged with data declared before.
+
+        :param column: Name of column
+        :type column: str
+        :param value: Column data
+        :type value: Union[str,Dict[str,Optional[str]]]
+        """
+        if isinstance(value, dict):
+            self.open_vswitch.setdefault(column, {}).update(value)
+        else:
+            self.open_vswitch[column] = value
+
+    def add_bridge(self, name, datapath_type=None, ipfix_target=None):
+        """Declare a bridge.
+
+        :param name: Name of bridge
+        :type name: str
+        :param datapath_type: Datapath type of bridge, None leaves untouched
+        :type datapath_type: Optional[str]
+        :param ipfix_target: IPFIX remote endpoint, None disables IPFIX
+        :type ipfix_target: Optional[str]
+        """
+        brdata = {}
+        if datapath_type is not None:
+            brdata['datapath_type'] = datapath_type
+        self.bridges[name] = {'brdata': brdata, 'ipfix': ipfix_target}
+
+    def add_port(self, bridge, port, ifdata=None, portdata=None,
+                 promisc=None, linkup=True):
+        """Declare a port with a single interface of the same name.
+
+        :param bridge: Name of bridge to attach port to
+        :type bridge: str
+        :param port: Name of port
+        :type port: str
+        :param ifdata: Column data for the interface
+        :type ifdata: Optional[Dict[str,Union[str,Dict[str,str]]]]
+        :param portdata: Column data for the port
+        :type portdata: Optional[Dict[str,Union[str,Dict[str,str]]]]
+        :param promisc: Whether to set promiscuous mode on the interface,
+                        True=on, False=off, None leave untouched
+        :type promisc: Optional[bool]
+        :param linkup: Bring link of the interface up
+        :type linkup: bool
+        """
+        self.ports[port] = self.Port(
+            bridge,
+            collections.OrderedDict([(port, ifdata or {})]),
+            portdata or {},
+            promisc,
+            linkup)
+
+    def add_bond(self, bridge, bond, ifdatamap, portdata=None):
+        """Declare a bonded port.
+
+        :param bridge: Name of bridge to attach bond to
+        :type bridge: str
+        :param bond: Name of bond port
+        :type bond: str
+        :param ifdatamap: Column data keyed by name of each bond interface
+        :type ifdatamap: Dict[str,Dict[str,Union[str,Dict[str,str]]]]
+        :param portdata: Column data for the bond port
+        :type portdata: Optional[Dict[str,Union[str,Dict[str,str]]]]
+        """
+        self.ports[bond] = self.Port(
+            bridge,
+            collections.OrderedDict(ifdatamap),
+            portdata or {},
+            None,
+            False)
+
+
+class OVSTransaction(object):
+    """Collection of ``ovs-vsctl`` commands to be run in one transaction."""
+
+    def __init__(self):
+        self.commands = []
+        self.post_commit = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def add(self, *args):
+        """Add command to transaction.
+
+        :param args: Command and arguments, without the ``--`` separator
+        :type args: Tuple[str, ...]
+        """
+        self.commands.append(args)
+
+    def cmdline(self):
+        """Command line for the transaction.
+
+        :returns: ``ovs-vsctl`` command line
+        :rtype: List[str]
+        """
+        cmd = ['ovs-vsctl']
+        for command in self.commands:
+            cmd.append('--')
+            cmd.extend(command)
+        return cmd
+
+    def commit(self):
+        """Run the transaction and any commands depending on it.
+
+        The commands depending on the transaction run even when the
+        database is up to date.
+
+        :returns: Whether any changes were made
+        :rtype: bool
+        :raises: subprocess.CalledProcessError
+        """
+        changed = bool(self.commands)
+        if changed:
+            log('Applying {} changes to Open vSwitch configuration'
+                .format(len(self.commands)), level=DEBUG)
+            subprocess.check_call(self.cmdline())
+        else:
+            log('Open vSwitch configuration is up to date', level=DEBUG)
+        for cmd in self.post_commit:
+            subprocess.check_call(cmd)
+        return changed
+
+
+def _column_args(current, data):
+    """Get ``column=value`` arguments for columns that need updating.
+
+    :param current: Current row or None if the row does not exist
+    :type current: Optional[Dict[str, any]]
+    :param data: Desired column data
+    :type data: Dict[str,Union[str,Dict[str,str]]]
+    :returns: ``column=value`` arguments for ``ovs-vsctl set``
+    :rtype: List[str]
+    """
+    current = current or {}
+    args = []
+    for column, value in data.items():
+        if isinstance(value, dict):
+            current_map = current.get(column)
+            if not isinstance(current_map, dict):
+                current_map = {}
+            for key, key_value in value.items():
+                if key_value is None:
+                    continue
+                if (key not in current_map or
+                        str(current_map[key]) != str(key_value)):
+                    args.append('{}:{}={}'.format(column, key, key_value))
+        elif str(_ovsdb_optional(current.get(column))) != str(value):
+            args.append('{}={}'.format(column, value))
+    return args
+
+
+def _update_row(txn, table, record, current, data):
+    """Add commands updating columns that need updating to transaction.
+
+    :param txn: Transaction to add commands to
+    :type txn: OVSTransaction
+    :param table: Name of table
+    :type table: str
+    :param record: Name of row
+    :type record: str
+    :param current: Current row or None if the row does not exist
+    :type current: Optional[Dict[str, any]]
+    :param data: Desired column data
+    :type data: Dict[str,Union[str,Dict[str,Optional[str]]]]
+    """
+    args = _column_args(current, data)
+    if args:
+        txn.add('set', table, record, *args)
+    for column, value in data.items():
+        if not isinstance(value, dict) or current is None:
+            continue
+        current_map = current.get(column)
+        if not isinstance(current_map, dict):
+            continue
+        for key, key_value in value.items():
+            if key_value is None and key in current_map:
+                txn.add('remove', table, record, column, key)
+
+
+def _ipfix_matches(snapshot, bridge_row, target):
+    """Check whether IPFIX configuration of a bridge is as desired.
+
+    :param snapshot: Current database content
+    :type snapshot: OVSDBSnapshot
+    :param bridge_row: Bridge row
+    :type bridge_row: Dict[str, any]
+    :param target: Desired IPFIX target or None
+    :type target: Optional[str]
+    :rtype: bool
+    """
+    ipfix_uuid = _ovsdb_optional(bridge_row.get('ipfix'))
+    if target is None or ipfix_uuid is None:
+        return target is None and ipfix_uuid is None
+    ipfix = snapshot.row('ipfix', ipfix_uuid)
+    if ipfix is None or _ovsdb_set(ipfix['targets']) != [target]:
+        return False
+    return not _column_args(ipfix, IPFIX_DEFAULTS)
+
+
+def reconcile(desired, snapshot):
+    """Build transaction that brings the database to the desired state.
+
+    Bridges and ports not declared in ``desired`` are left untouched.
+
+    :param desired: State the charm wants
+    :type desired: DesiredOVSState
+    :param snapshot: Current database content
+    :type snapshot: OVSDBSnapshot
+    :returns: Transaction applying the difference
+    :rtype: OVSTransaction
+    """
+    txn = OVSTransaction()
+    _update_row(txn, 'Open_vSwitch', '.', snapshot.open_vswitch,
+                desired.open_vswitch)
+    for index, (name, bridge) in enumerate(desired.bridges.items()):
+        current = snapshot.bridges.get(name)
+        if current is None:
+            txn.add('--may-exist', 'add-br', name)
+        _update_row(txn, 'Bridge', name, current, bridge['brdata'])
+        if current is not None and _ipfix_matches(snapshot, current,
+                                                  bridge['ipfix']):
+            continue
+        if bridge['ipfix']:
+            ipfix_id = '@ipfix{}'.format(index)
+            txn.add('set', 'Bridge', name, 'ipfix={}'.format(ipfix_id))
+            txn.add('--id={}'.format(ipfix_id), 'create', 'IPFIX',
+                    'targets="{}"'.format(bridge['ipfix']),
+                    *['{}={}'.format(k, v)
+                      for k, v in IPFIX_DEFAULTS.items()])
+        elif current is not None:
+            txn.add('clear', 'Bridge', name, 'ipfix')
+
+    for name, port in desired.ports.items():
+        current = snapshot.ports.get(name)
+        is_bond = list(port.interfaces.keys()) != [name]
+        if current is not None and (
+                snapshot.port_to_br(name) != port.bridge or
+                (sorted(snapshot.port_interfaces(name)) !=
+                 sorted(port.interfaces.keys()))):
+            log('Recreating port {} on bridge {}'.format(name, port.bridge),
+                level=DEBUG)
+            txn.add('--if-exists', 'del-port', name)
+            current = None
+        if current is None:
+            if is_bond:
+                txn.add('--may-exist', 'add-bond', port.bridge, name,
+                        *port.interfaces.keys())
+            else:
+                txn.add('--may-exist', 'add-port', port.bridge, name)
+        if not is_bond:
+            # NOTE: link and promiscuous mode do not persist across reboots
+            #       like the port in the database, so they are set each run.
+            if port.linkup:
+                txn.post_commit.append(['ip', 'link', 'set', name, 'up'])
+            if port.promisc is not None:
+                txn.post_commit.append(
+                    ['ip', 'link', 'set', name, 'promisc',
+                     'on' if port.promisc else 'off'])
+        for ifname, ifdata in port.interfaces.items():
+            _update_row(txn, 'Interface', ifname,
+                        snapshot.interfaces.get(ifname) if current else None,
+                        ifdata)
+        _update_row(txn, 'Port', name, current, port.portdata)
+    return txn
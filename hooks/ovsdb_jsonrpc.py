@@ -0,0 +1,363 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Talk RFC 7047 JSON-RPC directly to the local ovsdb-server.
+
+``charmhelpers.contrib.network.ovs.ovsdb.SimpleOVSDB`` forks ``ovs-vsctl``
+for every read.  The ``SimpleOVSDB`` provided here is a drop-in replacement
+that serves reads over one persistent unix socket connection per hook and
+falls back to the command line tool when the socket is not available.
+"""
+
+import collections
+import json
+import socket
+
+from charmhelpers.contrib.network.ovs import ovsdb as ch_ovsdb
+from charmhelpers.core.hookenv import (
+    cached,
+    log,
+    DEBUG,
+)
+
+OVSDB_SOCKET = '/var/run/openvswitch/db.sock'
+OVS_DATABASE = 'Open_vSwitch'
+
+
+class OVSDBError(Exception):
+    """Error returned by ovsdb-server."""
+    pass
+
+
+class OVSDBClient(object):
+    """Minimal RFC 7047 JSON-RPC client.
+
+    Supports the ``get_schema``, ``transact``, ``monitor`` and
+    ``monitor_cancel`` methods, which is what the charm needs for reading
+    and tracking the local Open vSwitch database.
+    """
+
+    def __init__(self, path=OVSDB_SOCKET, database=OVS_DATABASE,
+                 timeout=30):
+        """OVSDBClient constructor.
+
+        :param path: Path to ovsdb-server unix socket
+        :type path: str
+        :param database: Name of database to operate on
+        :type database: str
+        :param timeout: Timeout in seconds for socket operations
+        :type timeout: int
+        """
+        self.path = path
+        self.database = database
+        self.timeout = timeout
+        self._sock = None
+        self._buf = ''
+        self._decoder = json.JSONDecoder()
+        self._next_id = 0
+        self._schema = None
+        self.notifications = collections.deque()
+
+    def connect(self):
+        """Connect to ovsdb-server.
+
+        :raises: OSError
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+
+    def close(self):
+        """Close connection to ovsdb-server."""
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+            self._buf = ''
+
+    def _send(self, message):
+        self._sock.sendall(json.dumps(message).encode('UTF-8'))
+
+    def _receive(self):
+        """Read one complete JSON-RPC message from the socket.
+
+        :returns: Message
+        :rtype: Dict[str, any]
+        :raises: OVSDBError if the connection is closed by the server
+        """
+        while True:
+            buf = self._buf.lstrip()
+            if buf:
+                try:
+                    message, end = self._decoder.raw_decode(buf)
+                except ValueError:
+                    pass
+                else:
+                    self._buf = buf[end:]
+                    return message
+            data = self._sock.recv(65536)
+            if not data:
+                self.close()
+                raise OVSDBError('Connection closed by ovsdb-server')
+            self._buf = buf + data.decode('UTF-8')
+
+    def call(self, method, *params):
+        """Send request and wait for the response to it.
+
+        Echo requests from the server are answered and notifications are
+        queued in ``notifications`` while waiting.
+
+        :param method: JSON-RPC method
+        :type method: str
+        :param params: Method parameters
+        :type params: Tuple[any, ...]
+        :returns: Result of the request
+        :rtype: any
+        :raises: OVSDBError
+        """
+        if self._sock is None:
+            self.connect()
+        request_id = self._next_id
+        self._next_id += 1
+        self._send({'method': method, 'params': list(params),
+                    'id': request_id})
+        while True:
+            message = self._receive()
+            if message.get('method') == 'echo':
+                self._send({'result': message['params'], 'error': None,
+                            'id': message['id']})
+            elif message.get('method') is not None:
+                self.notifications.append(message)
+            elif message.get('id') == request_id:
+                if message.get('error') is not None:
+                    raise OVSDBError('{} failed: {}'
+                                     .format(method, message['error']))
+                return message['result']
+
+    @property
+    def schema(self):
+        """Database schema, retrieved once per connection.
+
+        :rtype: Dict[str, any]
+        """
+        if self._schema is None:
+            self._schema = self.call('get_schema', self.database)
+        return self._schema
+
+    def table_name(self, name):
+        """Resolve case insensitive table name to the one in the schema.
+
+        :param name: Table name as used by ``SimpleOVSDB``, e.g. ``bridge``
+        :type name: str
+        :returns: Table name as used by ovsdb-server, e.g. ``Bridge``
+        :rtype: str
+        :raises: KeyError
+        """
+        for table in self.schema['tables']:
+            if table.lower() == name.lower():
+                return table
+        raise KeyError(name)
+
+    def transact(self, *operations):
+        """Run operations in one transaction.
+
+        :param operations: RFC 7047 section 5.2 operations
+        :type operations: Tuple[Dict[str, any], ...]
+        :returns: Result of each operation
+        :rtype: List[Dict[str, any]]
+        :raises: OVSDBError if the transaction or any operation failed
+        """
+        results = self.call('transact', self.database, *operations)
+        for operation, result in zip(operations, results):
+            if result and result.get('error') is not None:
+                raise OVSDBError('{} failed: {}: {}'.format(
+                    operation['op'], result['error'],
+                    result.get('details', '')))
+        return results
+
+    def select(self, table, where=None, columns=None):
+        """Select rows from table.
+
+        :param table: Name of table
+        :type table: str
+        :param where: RFC 7047 section 5.1 conditions
+        :type where: Optional[List[List[any]]]
+        :param columns: Columns to return, defaults to all
+        :type columns: Optional[List[str]]
+        :returns: Rows in RFC 7047 notation
+        :rtype: List[Dict[str, any]]
+        """
+        operation = {'op': 'select', 'table': table, 'where': where or []}
+        if columns is not None:
+            operation['columns'] = columns
+        return self.transact(operation)[0]['rows']
+
+    def monitor(self, tables, monitor_id=None):
+        """Start monitoring tables.
+
+        Subsequent changes are delivered as ``update`` notifications, see
+        ``updates``.
+
+        :param tables: Columns to monitor keyed by table name, None for all
+        :type tables: Dict[str, Optional[List[str]]]
+        :param monitor_id: Identifier for the monitor
+        :type monitor_id: Optional[any]
+        :returns: Initial content as RFC 7047 ``table-updates``
+        :rtype: Dict[str, Dict[str, Dict[str, any]]]
+        """
+        requests = {}
+        for table, columns in tables.items():
+            requests[table] = {}
+            if columns is not None:
+                requests[table]['columns'] = columns
+        return self.call('monitor', self.database, monitor_id, requests)
+
+    def monitor_cancel(self, monitor_id):
+        """Stop monitor.
+
+        :param monitor_id: Identifier used when starting the monitor
+        :type monitor_id: any
+        """
+        self.call('monitor_cancel', monitor_id)
+
+    def updates(self, monitor_id=None):
+        """Drain queued ``update`` notifications for a monitor.
+
+        Only notifications already received are returned, this does not
+        wait for new ones.
+
+        :param monitor_id: Identifier used when starting the monitor
+        :type monitor_id: Optional[any]
+        :returns: RFC 7047 ``table-updates`` in order of arrival
+        :rtype: List[Dict[str, Dict[str, Dict[str, any]]]]
+        """
+        updates = []
+        remaining = collections.deque()
+        while self.notifications:
+            message = self.notifications.popleft()
+            if (message['method'] == 'update' and
+                    message['params'][0] == monitor_id):
+                updates.append(message['params'][1])
+            else:
+                remaining.append(message)
+        self.notifications = remaining
+        return updates
+
+
+@cached
+def ovsdb_client():
+    """Connection to the local ovsdb-server shared for the hook.
+
+    :returns: Connected client or None if ovsdb-server is not reachable
+    :rtype: Optional[OVSDBClient]
+    """
+    client = OVSDBClient()
+    try:
+        client.connect()
+    except OSError as e:
+        log('Unable to connect to {}, using ovs-vsctl: {}'
+            .format(OVSDB_SOCKET, e), level=DEBUG)
+        return None
+    return client
+
+
+class SimpleOVSDB(ch_ovsdb.SimpleOVSDB):
+    """SimpleOVSDB reading over JSON-RPC with fallback to the CLI tool.
+
+    Only the local Open vSwitch database is served over JSON-RPC, other
+    tools and all write operations use the command line tool.
+    """
+
+    def __init__(self, tool, client=None):
+        """SimpleOVSDB constructor.
+
+        :param tool: Which tool with database commands to operate on.
+        :type tool: str
+        :param client: Client to use, defaults to the shared connection
+        :type client: Optional[OVSDBClient]
+        """
+        super(SimpleOVSDB, self).__init__(tool)
+        self._client = client
+
+    def __getattr__(self, table):
+        if table not in self._tool_table_map[self._tool]:
+            raise AttributeError(
+                'table "{}" not known for use with "{}"'
+                .format(table, self._tool))
+        client = None
+        if self._tool == 'ovs-vsctl':
+            client = self._client or ovsdb_client()
+        if client is None:
+            return ch_ovsdb.SimpleOVSDB.Table(self._tool, table)
+        return self.Table(self._tool, table, client)
+
+    class Table(ch_ovsdb.SimpleOVSDB.Table):
+        """Table with reads served by ``select`` over JSON-RPC.
+
+        Rows are presented in the same way as by the command line tool.
+        """
+
+        def __init__(self, tool, table, client):
+            super(SimpleOVSDB.Table, self).__init__(tool, table)
+            self._client = client
+
+        def _condition_to_where(self, table, condition):
+            """Translate ``column=value`` condition to RFC 7047 notation.
+
+            :returns: Conditions or None if the condition is not supported
+            :rtype: Optional[List[List[any]]]
+            """
+            column, sep, value = condition.partition('=')
+            if not sep or ':' in column:
+                return None
+            try:
+                column_type = self._client.schema['tables'][table][
+                    'columns'][column]['type']
+            except KeyError:
+                return None
+            if isinstance(column_type, dict):
+                if column_type.get('max', 1) != 1 or 'value' in column_type:
+                    return None
+                column_type = column_type['key']
+            if isinstance(column_type, dict):
+                column_type = column_type['type']
+            if column_type == 'integer':
+                try:
+                    value = int(value)
+                except ValueError:
+                    return None
+            elif column_type != 'string':
+                return None
+            return [[column, '==', value]]
+
+        def _find_tbl(self, condition=None):
+            table = self._client.table_name(self._table)
+            where = None
+            if condition:
+                where = self._condition_to_where(table, condition)
+                if where is None:
+                    for row in super(SimpleOVSDB.Table, self)._find_tbl(
+                            condition=condition):
+                        yield row
+                    return
+            for row in self._client.select(table, where=where):
+                row.pop('_version', None)
+                for col, value in row.items():
+                    if isinstance(value, list) and len(value) > 1:
+                        row[col] = self._deserialize_ovsdb(value)
+                yield row
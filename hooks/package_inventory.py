@@ -0,0 +1,180 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Package inventory shared by the package lookups of the charm in a hook.
+
+Each lookup in ``charmhelpers.fetch.ubuntu_apt_pkg.Cache`` runs
+``apt-cache show`` and ``dpkg-query --list`` for a single package.  The
+``PackageInventory`` here queries all packages of a list with one call of
+each and keeps the results until the dpkg or apt databases change.
+"""
+
+import os
+
+from charmhelpers.core.hookenv import (
+    cached,
+    log,
+    WARNING,
+)
+from charmhelpers.fetch import ubuntu_apt_pkg
+
+# Rewritten by dpkg on every package installation or removal, and by apt
+# when the package lists are updated.
+DATABASE_PATHS = (
+    '/var/lib/dpkg/status',
+    '/var/cache/apt/pkgcache.bin',
+)
+
+
+def _database_mtimes():
+    mtimes = []
+    for path in DATABASE_PATHS:
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+class PackageInventory(ubuntu_apt_pkg.Cache):
+    """Simulation of the ``apt_pkg`` Cache answering from batched queries.
+
+    Packages are looked up on demand like with ``ubuntu_apt_pkg.Cache``,
+    ``load`` queries many packages at once.  Results are dropped when the
+    dpkg status or apt package cache change, e.g. after ``apt_install``.
+    """
+
+    def __init__(self, progress=None):
+        super(PackageInventory, self).__init__(progress)
+        # package name -> Package, None for packages unknown to apt
+        self.packages = {}
+        self.mtimes = _database_mtimes()
+
+    def _validate(self):
+        mtimes = _database_mtimes()
+        if mtimes != self.mtimes:
+            self.packages = {}
+            self.mtimes = mtimes
+
+    def load(self, packages):
+        """Query the packages not queried yet.
+
+        :param packages: Names of packages
+        :type packages: Iterable[str]
+        :raises: subprocess.CalledProcessError
+        """
+        self._validate()
+        missing = [package for package in packages
+                   if package not in self.packages]
+        if not missing:
+            return
+        apt_results = self._apt_cache_show(missing)
+        dpkg_results = self._dpkg_list(missing)
+        for package in missing:
+            apt_result = apt_results.get(package)
+            if apt_result is None and len(missing) > 1:
+                # NOTE: the output of apt-cache is discarded when it fails
+                #       for an unknown package, query the package on its own.
+                apt_result = self._apt_cache_show([package]).get(package)
+            if apt_result is None:
+                self.packages[package] = None
+                continue
+            apt_result = dict(apt_result)
+            apt_result['name'] = apt_result.pop('package')
+            pkg = ubuntu_apt_pkg.Package(apt_result)
+            dpkg_result = dpkg_results.get(package, {})
+            installed_version = dpkg_result.get('version')
+            pkg.current_ver = (
+                ubuntu_apt_pkg.Version({'ver_str': installed_version})
+                if installed_version else None)
+            pkg.architecture = dpkg_result.get('architecture')
+            self.packages[package] = pkg
+
+    def __getitem__(self, package):
+        """Get information about a package from apt and dpkg databases.
+
+        :param package: Name of package
+        :type package: str
+        :returns: Package object
+        :rtype: object
+        :raises: KeyError, subprocess.CalledProcessError
+        """
+        self.load([package])
+        pkg = self.packages[package]
+        if pkg is None:
+            raise KeyError(package)
+        return pkg
+
+
+@cached
+def inventory():
+    """Package inventory of the hook.
+
+    :rtype: PackageInventory
+    """
+    return PackageInventory()
+
+
+def filter_installed_packages(packages):
+    """Return a list of packages that require installation.
+
+    Drop-in replacement for ``charmhelpers.fetch.filter_installed_packages``
+    querying all packages at once.
+    """
+    packages = list(packages)
+    cache = inventory()
+    cache.load(packages)
+    _pkgs = []
+    for package in packages:
+        try:
+            cache[package].current_ver or _pkgs.append(package)
+        except KeyError:
+            log('Package {} has no installation candidate.'.format(package),
+                level=WARNING)
+            _pkgs.append(package)
+    return _pkgs
+
+
+def filter_missing_packages(packages):
+    """Return a list of packages that are installed.
+
+    Drop-in replacement for ``charmhelpers.fetch.filter_missing_packages``
+    querying all packages at once.
+    """
+    return list(
+        set(packages) -
+        set(filter_installed_packages(packages))
+    )
+
+
+def get_upstream_version(package):
+    """Determine upstream version based on installed package.
+
+    Drop-in replacement for ``charmhelpers.fetch.get_upstream_version``
+    answered from the inventory.
+
+    :param package: Name of package
+    :type package: str
+    :returns: None (if not installed) or the upstream version
+    :rtype: Optional[str]
+    """
+    try:
+        pkg = inventory()[package]
+    except KeyError:
+        # the package is unknown to the current apt cache.
+        return None
+    if not pkg.current_ver:
+        # package is known, but no version is currently installed.
+        return None
+    return ubuntu_apt_pkg.upstream_version(pkg.current_ver.ver_str)
@@ -0,0 +1,86 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Desired package set applied in a single apt transaction.
+
+Installing and purging in separate ``apt-get`` runs takes the dpkg lock and
+resolves dependencies for each.  A ``PackagePlan`` diffs the packages that
+should and should not be installed against the installed ones and applies
+the difference with one ``apt-get install pkgA pkgB- pkgC-``, or not at all
+when nothing differs.
+"""
+
+from collections import OrderedDict
+
+from charmhelpers.core.hookenv import (
+    log,
+    DEBUG,
+)
+from charmhelpers.fetch import apt_install
+
+from package_inventory import (
+    filter_installed_packages,
+    filter_missing_packages,
+)
+
+APT_OPTIONS = ['--option=Dpkg::Options::=--force-confold']
+
+
+class PackagePlan(object):
+    """Packages to install and to purge.
+
+    Packages in both lists are kept installed.
+
+    :param install: Packages that should be installed
+    :type install: Iterable[str]
+    :param purge: Packages that should not be installed
+    :type purge: Iterable[str]
+    """
+
+    def __init__(self, install=(), purge=()):
+        self.install = list(OrderedDict.fromkeys(install))
+        self.purge = [package for package in OrderedDict.fromkeys(purge)
+                      if package not in self.install]
+
+    def diff(self):
+        """Packages to install and installed packages to purge.
+
+        :returns: Packages to install, packages to purge
+        :rtype: Tuple[List[str], List[str]]
+        """
+        installed = set(filter_missing_packages(self.purge))
+        return (filter_installed_packages(self.install),
+                [package for package in self.purge if package in installed])
+
+    def apply(self, fatal=True):
+        """Install and purge packages in one transaction, if any differ.
+
+        Packages no longer needed after purging are removed as well.
+
+        :param fatal: Whether the command's output should be checked and
+                      retried
+        :type fatal: bool
+        :returns: Packages installed, packages purged
+        :rtype: Tuple[List[str], List[str]]
+        """
+        install, purge = self.diff()
+        if not install and not purge:
+            log('Installed packages match the package plan', level=DEBUG)
+            return install, purge
+        options = list(APT_OPTIONS)
+        if purge:
+            options.extend(['--purge', '--autoremove'])
+        apt_install(install + ['{}-'.format(package) for package in purge],
+                    options=options, fatal=fatal)
+        return install, purge
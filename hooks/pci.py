@@ -20,6 +20,12 @@ import subprocess
 import shlex
 
 
+PCI_DEVICES_DIR = '/sys/bus/pci/devices'
+# PCI class code of Ethernet controllers, see the PCI Code and ID
+# Assignment Specification.
+PCI_CLASS_ETHERNET = 0x0200
+
+
 def format_pci_addr(pci_addr):
     domain, bus, slot_func = pci_addr.split(':')
     slot, func = slot_func.split('.')
@@ -70,6 +76,44 @@ def get_sysnet_interfaces_and_macs():
     return net_devs
 
 
+def get_sysbus_pci_ethernet_addresses(sysdir=None):
+    '''Find Ethernet controllers on the PCI bus from sysfs
+
+    :sysdir: string: path to the PCI devices /sys directory, defaults
+                     to PCI_DEVICES_DIR
+
+    :returns: array: of formatted PCI addresses of Ethernet controllers
+                     in address order
+    :raises: OSError if the PCI devices directory cannot be read
+    '''
+    sysdir = sysdir or PCI_DEVICES_DIR
+    pci_addresses = []
+    for pci_address in sorted(os.listdir(sysdir)):
+        with open(os.path.join(sysdir, pci_address, 'class'), 'r') as f:
+            read_data = f.read()
+        # class is a 24 bit value of class, subclass and programming
+        # interface, e.g. 0x020000
+        if int(read_data.strip(), 16) >> 8 == PCI_CLASS_ETHERNET:
+            pci_addresses.append(format_pci_addr(pci_address))
+    return pci_addresses
+
+
+def get_lspci_ethernet_addresses():
+    '''Find Ethernet controllers on the PCI bus using lspci
+
+    :returns: array: of formatted PCI addresses of Ethernet controllers
+    '''
+    cmd = ['lspci', '-m', '-D']
+    lspci_output = subprocess.check_output(cmd).decode('UTF-8')
+    pci_addresses = []
+    for line in lspci_output.split('\n'):
+        columns = shlex.split(line)
+        if len(columns) > 1 and columns[1] == 'Ethernet controller':
+            pci_address = columns[0]
+            pci_addresses.append(format_pci_addr(pci_address))
+    return pci_addresses
+
+
 def get_sysnet_mac(sysdir):
     '''Read MAC address for a device
 
@@ -147,9 +191,20 @@ def get_sysnet_interface(sysdir):
     return sysdir.split('/')[-1]
 
 
+def index_by_pci_address(net_devices):
+    '''Index interface information by PCI address
+
+    :net_devices: array: of dict objects as returned by
+                  get_sysnet_interfaces_and_macs()
+
+    :returns: dict: interface details keyed by PCI address
+    '''
+    return {device['pci_address']: device for device in net_devices}
+
+
 class PCINetDevice(object):
 
-    def __init__(self, pci_address):
+    def __init__(self, pci_address, net_devices=None):
         self.pci_address = pci_address
         self.interface_name = None
         self.mac_address = None
@@ -157,44 +212,65 @@ class PCINetDevice(object):
         self.sriov = False
         self.sriov_totalvfs = None
         self.sriov_numvfs = None
-        self.update_attributes()
-
-    def update_attributes(self):
-        self.update_interface_info()
-
-    def update_interface_info(self):
-        net_devices = get_sysnet_interfaces_and_macs()
-        for interface in net_devices:
-            if self.pci_address == interface['pci_address']:
-                self.interface_name = interface['interface']
-                self.mac_address = interface['mac_address']
-                self.state = interface['state']
-                self.sriov = interface['sriov']
-                if self.sriov:
-                    self.sriov_totalvfs = interface['sriov_totalvfs']
-                    self.sriov_numvfs = interface['sriov_numvfs']
+        self.update_attributes(net_devices)
+
+    def update_attributes(self, net_devices=None):
+        self.update_interface_info(net_devices)
+
+    def update_interface_info(self, net_devices=None):
+        '''Update attributes from interface information
+
+        :net_devices: dict: interface details keyed by PCI address as
+                      returned by index_by_pci_address(), read from
+                      the local system when not provided.
+        '''
+        if net_devices is None:
+            net_devices = index_by_pci_address(
+                get_sysnet_interfaces_and_macs())
+        interface = net_devices.get(self.pci_address)
+        if interface:
+            self.interface_name = interface['interface']
+            self.mac_address = interface['mac_address']
+            self.state = interface['state']
+            self.sriov = interface['sriov']
+            if self.sriov:
+                self.sriov_totalvfs = interface['sriov_totalvfs']
+                self.sriov_numvfs = interface['sriov_numvfs']
 
 
 class PCINetDevices(object):
 
     def __init__(self):
         pci_addresses = self.get_pci_ethernet_addresses()
-        self.pci_devices = [PCINetDevice(dev) for dev in pci_addresses]
+        net_devices = index_by_pci_address(get_sysnet_interfaces_and_macs())
+        self.pci_devices = [PCINetDevice(dev, net_devices)
+                            for dev in pci_addresses]
+        self._build_indexes()
+
+    def _build_indexes(self):
+        # NOTE: first device wins on duplicates, matching a linear search
+        self._by_mac = {}
+        self._by_pci_address = {}
+        self._by_interface_name = {}
+        for pcidev in self.pci_devices:
+            self._by_mac.setdefault(pcidev.mac_address, pcidev)
+            self._by_pci_address.setdefault(pcidev.pci_address, pcidev)
+            self._by_interface_name.setdefault(pcidev.interface_name, pcidev)
 
     def get_pci_ethernet_addresses(self):
-        cmd = ['lspci', '-m', '-D']
-        lspci_output = subprocess.check_output(cmd).decode('UTF-8')
-        pci_addresses = []
-        for line in lspci_output.split('\n'):
-            columns = shlex.split(line)
-            if len(columns) > 1 and columns[1] == 'Ethernet controller':
-                pci_address = columns[0]
-                pci_addresses.append(format_pci_addr(pci_address))
-        return pci_addresses
+        # NOTE: fall back to lspci where sysfs is not available or does
+        #       not expose the PCI bus, e.g. in some containers.
+        try:
+            pci_addresses = get_sysbus_pci_ethernet_addresses()
+        except (OSError, ValueError):
+            pci_addresses = []
+        return pci_addresses or get_lspci_ethernet_addresses()
 
     def update_devices(self):
+        net_devices = index_by_pci_address(get_sysnet_interfaces_and_macs())
         for pcidev in self.pci_devices:
-            pcidev.update_attributes()
+            pcidev.update_attributes(net_devices)
+        self._build_indexes()
 
     def get_macs(self):
         macs = []
@@ -204,19 +280,10 @@ class PCINetDevices(object):
         return macs
 
     def get_device_from_mac(self, mac):
-        for pcidev in self.pci_devices:
-            if pcidev.mac_address == mac:
-                return pcidev
-        return None
+        return self._by_mac.get(mac)
 
     def get_device_from_pci_address(self, pci_addr):
-        for pcidev in self.pci_devices:
-            if pcidev.pci_address == pci_addr:
-                return pcidev
-        return None
+        return self._by_pci_address.get(pci_addr)
 
     def get_device_from_interface_name(self, interface_name):
-        for pcidev in self.pci_devices:
-            if pcidev.interface_name == interface_name:
-                return pcidev
-        return None
+        return self._by_interface_name.get(interface_name)
@@ -0,0 +1,109 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Serve remote relation data from one relation-get per related unit.
+
+``hookenv.relation_get`` is cached per attribute, so a context reading
+several attributes from every related unit runs ``relation-get`` once per
+attribute per unit.  ``prefetch`` retrieves all settings of each unit
+related over an endpoint once per hook and ``relation_get`` serves single
+attributes from that data.
+"""
+
+import contextlib
+import time
+
+from collections import OrderedDict
+
+from charmhelpers.core import hookenv
+from charmhelpers.core.hookenv import (
+    cached,
+    log,
+    DEBUG,
+    related_units,
+    relation_ids,
+)
+
+
+@cached
+def prefetch(endpoint):
+    """Retrieve the settings of every unit related over endpoint.
+
+    Settings are retrieved with ``hookenv.relation_get(rid=rid, unit=unit)``
+    which shares its cache entry with contexts reading all settings of a
+    unit the same way, e.g. ``NeutronAPIContext``.
+
+    :param endpoint: Name of the relation endpoint, e.g. 'amqp'
+    :type endpoint: str
+    :returns: Settings keyed by relation id and unit name
+    :rtype: Dict[str, Dict[str, Dict[str, str]]]
+    """
+    start = time.time()
+    data = OrderedDict()
+    for rid in relation_ids(endpoint):
+        data[rid] = OrderedDict(
+            (unit, hookenv.relation_get(rid=rid, unit=unit) or {})
+            for unit in related_units(rid))
+    log('Prefetched {} relation data for {} units in {:.3f}s.'
+        .format(endpoint, sum(len(units) for units in data.values()),
+                time.time() - start),
+        level=DEBUG)
+    return data
+
+
+def relation_get(attribute=None, unit=None, rid=None):
+    """Drop-in replacement for ``hookenv.relation_get``.
+
+    Settings of a remote unit on a given relation are served from
+    ``prefetch``, anything else is passed on to ``hookenv.relation_get``.
+
+    :param attribute: Name of setting, all settings if None
+    :type attribute: Optional[str]
+    :param unit: Name of unit, the remote unit of the hook if None
+    :type unit: Optional[str]
+    :param rid: Relation id, the relation of the hook if None
+    :type rid: Optional[str]
+    :returns: Value of setting or dictionary of all settings
+    :rtype: Union[None, str, Dict[str, str]]
+    """
+    settings = None
+    if unit and rid:
+        settings = prefetch(rid.split(':')[0]).get(rid, {}).get(unit)
+    if settings is None:
+        # e.g. a departing unit no longer listed by related-units
+        return hookenv.relation_get(attribute=attribute, unit=unit, rid=rid)
+    if attribute is None:
+        # callers such as hookenv.relation_for_unit modify the result
+        return dict(settings)
+    return settings.get(attribute)
+
+
+@contextlib.contextmanager
+def serving(module):
+    """Serve ``relation_get`` of module from prefetched data.
+
+    For context generators provided by charm-helpers, which look up
+    ``relation_get`` in the namespace of their module.
+
+    :param module: Module importing ``relation_get`` from hookenv
+    :type module: types.ModuleType
+    :returns: Context manager
+    :rtype: Iterator[None]
+    """
+    original = module.relation_get
+    module.relation_get = relation_get
+    try:
+        yield
+    finally:
+        module.relation_get = original
@@ -0,0 +1,102 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""OpenStack release resolution persisted across hooks.
+
+``charmhelpers.contrib.openstack.utils.os_release`` keeps the codename in a
+process global, which ``reset_cache=True`` discards, and every resolution
+probes the ``openstack-release`` package, installing it if missing.  Here
+the codename is recorded in unitdata along with the modification time of
+the dpkg status file, and only probed again once packages changed.
+
+The charm has no installation source option, so the codename is derived
+from the installed packages alone.
+"""
+
+import os
+
+from charmhelpers.contrib.openstack import utils as os_utils
+from charmhelpers.core.hookenv import (
+    config,
+    log,
+    DEBUG,
+)
+from charmhelpers.core.unitdata import kv
+
+OS_RELEASE_KEY = 'release_resolver.os_release'
+PROBES_KEY = 'release_resolver.probes'
+
+# Rewritten by dpkg on every package installation or removal.
+DPKG_STATUS = '/var/lib/dpkg/status'
+
+
+def _dpkg_status_mtime():
+    try:
+        return os.stat(DPKG_STATUS).st_mtime_ns
+    except OSError:
+        return None
+
+
+def probes():
+    """Number of times the release has been probed on this unit.
+
+    :rtype: int
+    """
+    return kv().get(PROBES_KEY, 0)
+
+
+def os_release(package, base=None, reset_cache=False, source_key=None):
+    """Returns OpenStack release codename, probed when packages changed.
+
+    Drop-in replacement for
+    ``charmhelpers.contrib.openstack.utils.os_release``.  reset_cache is
+    accepted for compatibility, a change of the installed packages is
+    detected from the dpkg status file instead.  The fallback to base is
+    not recorded.
+
+    :param package: Name of package to determine release from
+    :type package: str
+    :param base: Fallback codename if endavours to determine from package fail
+    :type base: Optional[str]
+    :param reset_cache: Ignored
+    :type reset_cache: bool
+    :param source_key: Name of source configuration option
+                       (default: 'openstack-origin')
+    :type source_key: Optional[str]
+    :returns: OpenStack release codename
+    :rtype: str
+    """
+    source_key = source_key or 'openstack-origin'
+    db = kv()
+    key = '{}.{}'.format(OS_RELEASE_KEY, package)
+    recorded = db.get(key) or {}
+    if recorded.get('dpkg_status_mtime') == _dpkg_status_mtime():
+        codename = recorded['codename']
+    else:
+        codename = (
+            os_utils.get_os_codename_package(package, fatal=False) or
+            os_utils.get_os_codename_install_source(config(source_key)))
+        probe_count = db.get(PROBES_KEY, 0) + 1
+        log('OpenStack release probe {} for {}: {}'
+            .format(probe_count, package, codename), level=DEBUG)
+        # NOTE: the mtime is read after probing, which may have installed
+        #       openstack-release.
+        db.set(key, {'dpkg_status_mtime': _dpkg_status_mtime(),
+                     'codename': codename})
+        db.set(PROBES_KEY, probe_count)
+        db.flush()
+    if not codename:
+        codename = base or os_utils.UBUNTU_OPENSTACK_RELEASE[
+            os_utils.lsb_release()['DISTRIB_CODENAME']]
+    return codename
@@ -0,0 +1,125 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Batched service state queries and concurrent pause and resume.
+
+``charmhelpers.contrib.openstack.utils`` checks and pauses services one at a
+time, each check forking ``systemctl is-active``.  The state of all services
+is read here with a single ``systemctl show``, e.g. for the status
+fingerprint of ``update-status``, and services are paused and resumed
+concurrently where independent.
+"""
+
+import subprocess
+
+from collections import OrderedDict
+
+from charmhelpers.core.hookenv import (
+    log,
+    WARNING,
+)
+from charmhelpers.core.host import (
+    init_is_systemd,
+    service_pause,
+    service_resume,
+    service_running,
+)
+
+from deferred_restarts import run_in_order
+
+# ActiveState values reported as running by ``systemctl is-active``.
+RUNNING_STATES = ('active', 'reloading')
+
+_PROPERTIES = ('Id', 'LoadState', 'ActiveState', 'SubState')
+
+
+def _unit(service_name):
+    return service_name if '.' in service_name else service_name + '.service'
+
+
+def systemctl_show(service_names):
+    """Read the state of services with one ``systemctl show`` call.
+
+    :param service_names: Names of the services
+    :type service_names: List[str]
+    :returns: Unit properties keyed by service name
+    :rtype: Dict[str, Dict[str, str]]
+    :raises: subprocess.CalledProcessError, ValueError
+    """
+    if not service_names:
+        return {}
+    output = subprocess.check_output(
+        ['systemctl', 'show', '--property={}'.format(','.join(_PROPERTIES))] +
+        [_unit(service_name) for service_name in service_names],
+        universal_newlines=True)
+    # one block of properties per unit, in the order requested, separated
+    # by an empty line.
+    blocks = [block for block in output.strip().split('\n\n') if block]
+    if len(blocks) != len(service_names):
+        raise ValueError('systemctl show returned {} units, expected {}'
+                         .format(len(blocks), len(service_names)))
+    states = {}
+    for service_name, block in zip(service_names, blocks):
+        states[service_name] = dict(line.partition('=')[::2]
+                                    for line in block.splitlines())
+    return states
+
+
+def services_running(service_names):
+    """Whether each service is running.
+
+    :param service_names: Names of the services
+    :type service_names: Iterable[str]
+    :rtype: OrderedDict[str, bool]
+    """
+    service_names = list(service_names)
+    if init_is_systemd():
+        try:
+            states = systemctl_show(service_names)
+        except (OSError, subprocess.CalledProcessError, ValueError) as e:
+            log('Unable to query services with systemctl show: {}'
+                .format(e), level=WARNING)
+        else:
+            return OrderedDict(
+                (service_name,
+                 states[service_name].get('ActiveState') in RUNNING_STATES)
+                for service_name in service_names)
+    return OrderedDict((service_name, service_running(service_name))
+                       for service_name in service_names)
+
+
+def manage_services(action, service_names, max_workers=1):
+    """Pause or resume services, independent ones concurrently.
+
+    Services are paused before the services they depend on and resumed
+    after them.
+
+    :param action: 'pause' or 'resume'
+    :type action: str
+    :param service_names: Names of the services
+    :type service_names: Iterable[str]
+    :param max_workers: Maximum number of services handled concurrently
+    :type max_workers: int
+    :returns: Messages for the services that did not pause or resume
+    :rtype: List[str]
+    """
+    actions = {
+        'pause': service_pause,
+        'resume': service_resume,
+    }
+    results = run_in_order(actions[action], list(service_names),
+                           max_workers=max_workers,
+                           reverse=(action == 'pause'))
+    return ["{} didn't {} cleanly.".format(service_name, action)
+            for service_name, ok in results.items() if not ok]
@@ -0,0 +1,98 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fingerprint of the workload status inputs that change outside of hooks.
+
+Configuration and relation changes run hooks, each of which ends with a full
+``assess_status``.  Between hooks the status can only change with the state
+of the services, the hugepages reserved or the paused flags set by actions.
+``update-status`` compares a fingerprint of these with the one recorded by
+the last full assessment and skips loading the charm when they match.
+
+Only lightweight modules are imported here.
+"""
+
+import hashlib
+import json
+import time
+
+from charmhelpers.core.unitdata import kv
+
+import numa
+import service_state
+
+STATUS_FINGERPRINT_KEY = 'status_fingerprint'
+
+# Age in seconds after which the status is assessed in full regardless,
+# e.g. for package upgrades outside of the charm.
+MAX_AGE = 3600
+
+
+def fingerprint(service_names):
+    """Fingerprint of the status inputs that change outside of hooks.
+
+    :param service_names: Services the status depends on
+    :type service_names: List[str]
+    :rtype: str
+    """
+    db = kv()
+    hugepages = {
+        node.index: {size_kb: pages['total']
+                     for size_kb, pages in node.hugepages.items()}
+        for node in numa.NUMATopology.load().nodes.values()}
+    inputs = {
+        'services': service_state.services_running(service_names),
+        'hugepages': hugepages,
+        'paused': bool(db.get('unit-paused')),
+        'upgrading': bool(db.get('unit-upgrading')),
+    }
+    return hashlib.sha1(
+        json.dumps(inputs, sort_keys=True).encode('UTF-8')).hexdigest()
+
+
+def record(service_names):
+    """Record the status inputs after a full assessment.
+
+    :param service_names: Services the status depends on
+    :type service_names: List[str]
+    """
+    db = kv()
+    db.set(STATUS_FINGERPRINT_KEY, {
+        'services': list(service_names),
+        'fingerprint': fingerprint(service_names),
+        'time': time.time(),
+    })
+    db.flush()
+
+
+def invalidate():
+    """Force the next ``update-status`` to assess the status in full.
+
+    For hooks that may fail before their status is assessed.
+    """
+    db = kv()
+    if db.get(STATUS_FINGERPRINT_KEY) is not None:
+        db.unset(STATUS_FINGERPRINT_KEY)
+        db.flush()
+
+
+def unchanged():
+    """Whether the inputs match those of the last full assessment.
+
+    :rtype: bool
+    """
+    recorded = kv().get(STATUS_FINGERPRINT_KEY)
+    if not recorded or time.time() - recorded['time'] > MAX_AGE:
+        return False
+    return fingerprint(recorded['services']) == recorded['fingerprint']
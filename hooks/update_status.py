@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""update-status hook.
+
+Importing ``neutron_ovs_hooks`` registers the configs and evaluates the
+release, packages and relations they depend on.  The status is only assessed
+in full, through ``neutron_ovs_hooks``, when the inputs recorded by
+``status_fingerprint`` changed since the last assessment.
+"""
+
+from charmhelpers.core.hookenv import (
+    log,
+    DEBUG,
+)
+
+import fast_unitdata
+
+# NOTE: the status fingerprint is read from unitdata, open it in WAL mode
+#       before neutron_ovs_hooks would.
+fast_unitdata.enable()
+
+import status_fingerprint
+
+
+def main():
+    if status_fingerprint.unchanged():
+        log('Status inputs unchanged since last assessed, skipping',
+            level=DEBUG)
+        return
+    import neutron_ovs_hooks
+    neutron_ovs_hooks.main()
+
+
+if __name__ == '__main__':
+    main()
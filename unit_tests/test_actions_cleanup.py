@@ -61,13 +61,13 @@ class HelperTestCase(test_utils.CharmTestCase):
     def setUp(self):
         super(HelperTestCase, self).setUp(
             actions, [
-                'ch_ovsdb',
+                'ovsdb_jsonrpc',
             ])
 
     @mock.patch.object(actions.ch_ovs, 'del_bridge_port')
-    @mock.patch.object(actions.ch_ovs, 'patch_ports_on_bridge')
-    def test_remove_patch_ports(
-            self, _patch_ports_on_bridge, _del_bridge_port):
+    @mock.patch.object(actions.ovs_state.OVSDBSnapshot, 'load')
+    def test_remove_patch_ports(self, _load, _del_bridge_port):
+        _patch_ports_on_bridge = _load.return_value.patch_ports_on_bridge
         _patch_ports_on_bridge.return_value = [actions.ch_ovs.Patch(
             this_end=actions.ch_ovs.PatchPort(
                 bridge='this-end-bridge',
@@ -89,7 +89,7 @@ class HelperTestCase(test_utils.CharmTestCase):
         bridge.__getitem__.return_value = 'fake-uuid'
         ovsdb = mock.MagicMock()
         ovsdb.bridge.__iter__.return_value = [bridge]
-        self.ch_ovsdb.SimpleOVSDB.return_value = ovsdb
+        self.ovsdb_jsonrpc.SimpleOVSDB.return_value = ovsdb
         actions.remove_per_bridge_controllers()
         ovsdb.bridge.clear.assert_called_once_with('fake-uuid', 'controller')
 
@@ -0,0 +1,101 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+import apt_index
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    '_mtime',
+    'apt_update',
+    'log',
+    'sources_mtime',
+    'time',
+]
+
+
+class TestAptIndex(CharmTestCase):
+
+    def setUp(self):
+        super(TestAptIndex, self).setUp(apt_index, TO_PATCH)
+        self.mtimes = {apt_index.APT_LISTS: 1000.0}
+        self._mtime.side_effect = self.mtimes.get
+        self.sources_mtime.return_value = 500.0
+        self.time.time.return_value = 2000.0
+
+    def test_fresh(self):
+        self.assertTrue(apt_index.fresh(3600))
+
+    def test_fresh_ttl_expired(self):
+        self.assertFalse(apt_index.fresh(600))
+
+    def test_fresh_ttl_disabled(self):
+        self.assertFalse(apt_index.fresh(0))
+
+    def test_fresh_sources_changed(self):
+        self.sources_mtime.return_value = 1500.0
+        self.assertFalse(apt_index.fresh(3600))
+
+    def test_fresh_never_updated(self):
+        self.mtimes.clear()
+        self.assertFalse(apt_index.fresh(3600))
+
+    def test_update(self):
+        self.sources_mtime.return_value = 1500.0
+        self.time.time.side_effect = [2000.0, 2000.0, 2042.0, 2042.0]
+        self.assertTrue(apt_index.update(3600))
+        self.apt_update.assert_called_once_with(fatal=False)
+        self.assertEqual(apt_index.updated(), 2042.0)
+        # the recorded update makes the index fresh
+        self.time.time.side_effect = None
+        self.time.time.return_value = 2100.0
+        self.assertFalse(apt_index.update(3600))
+        self.apt_update.assert_called_once_with(fatal=False)
+        self.log.assert_called_with(
+            'Package index is fresh, skipped apt-get update saving 42.0s',
+            level=apt_index.DEBUG)
+
+
+class TestSourcesMtime(CharmTestCase):
+
+    def setUp(self):
+        super(TestSourcesMtime, self).setUp(apt_index, [])
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_sources_mtime(self):
+        sources_list = os.path.join(self.tmpdir, 'sources.list')
+        sources_list_d = os.path.join(self.tmpdir, 'sources.list.d')
+        os.mkdir(sources_list_d)
+        ppa = os.path.join(sources_list_d, 'ppa.list')
+        for path, mtime in ((sources_list, 100), (ppa, 300),
+                            (sources_list_d, 200)):
+            if not os.path.isdir(path):
+                open(path, 'w').close()
+            os.utime(path, (mtime, mtime))
+        with patch.object(apt_index, 'SOURCES_PATHS',
+                          (sources_list, sources_list_d,
+                           os.path.join(self.tmpdir, 'missing'))):
+            self.assertEqual(apt_index.sources_mtime(), 300)
+
+    def test_sources_mtime_missing(self):
+        with patch.object(apt_index, 'SOURCES_PATHS',
+                          (os.path.join(self.tmpdir, 'missing'),)):
+            self.assertIsNone(apt_index.sources_mtime())
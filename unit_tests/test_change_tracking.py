@@ -0,0 +1,293 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from mock import MagicMock, call, patch
+
+import change_tracking
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'is_unit_paused_set',
+    'kv',
+    'log',
+    'path_hash',
+    'request_restart',
+]
+
+
+class FakeKV(dict):
+
+    flushes = 0
+
+    def set(self, key, value):
+        self[key] = value
+
+    def flush(self):
+        self.flushes += 1
+
+
+class FakeContext(dict):
+    interfaces = []
+
+    def __call__(self):
+        return self
+
+
+class ChangeTrackingTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(ChangeTrackingTestCase, self).setUp(change_tracking, TO_PATCH)
+        self.db = FakeKV()
+        self.kv.return_value = self.db
+        self.is_unit_paused_set.return_value = False
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'neutron.conf')
+        self.configs = change_tracking.ChangeTrackingConfigRenderer(
+            templates_dir=self.tmpdir, openstack_release='ussuri')
+        self.ctxt = FakeContext(debug=False)
+        self.configs.register(self.path, [self.ctxt],
+                              config_template='debug = {{ debug }}')
+        self.addCleanup(change_tracking._TRACKED_PATHS.discard, self.path)
+
+
+class TestChangeTrackingConfigRenderer(ChangeTrackingTestCase):
+
+    def test_write(self):
+        with change_tracking.track_changes() as changed:
+            self.assertTrue(self.configs.write(self.path))
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'debug = False')
+        self.assertEqual(changed, {self.path})
+        st = os.stat(self.path)
+        self.assertEqual(
+            self.db[change_tracking.DIGESTS_KEY][self.path][1:],
+            [st.st_mtime_ns, st.st_size])
+        self.assertEqual(self.db.flushes, 1)
+
+    def test_write_unchanged(self):
+        self.configs.write(self.path)
+        mtime = os.stat(self.path).st_mtime_ns
+        with change_tracking.track_changes() as changed, \
+                patch('builtins.open') as _open:
+            self.assertFalse(self.configs.write(self.path))
+        # the recorded digest is trusted without reading the file back
+        _open.assert_not_called()
+        self.assertEqual(changed, set())
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+
+    def test_write_changed(self):
+        self.configs.write(self.path)
+        self.ctxt['debug'] = True
+        with change_tracking.track_changes() as outer:
+            with change_tracking.track_changes() as inner:
+                self.configs.write(self.path)
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'debug = True')
+        self.assertEqual(inner, {self.path})
+        self.assertEqual(outer, {self.path})
+
+    def test_write_modified_on_disk(self):
+        self.configs.write(self.path)
+        with open(self.path, 'w') as f:
+            f.write('debug = Maybe\n')
+        with change_tracking.track_changes() as changed:
+            self.configs.write(self.path)
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'debug = False')
+        self.assertEqual(changed, {self.path})
+
+    def test_write_identical_not_recorded(self):
+        with open(self.path, 'w') as f:
+            f.write('debug = False')
+        mtime = os.stat(self.path).st_mtime_ns
+        with change_tracking.track_changes() as changed:
+            self.configs.write(self.path)
+        self.assertEqual(changed, set())
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+        self.assertIn(self.path, self.db[change_tracking.DIGESTS_KEY])
+
+    def test_write_preserves_mode(self):
+        with open(self.path, 'w') as f:
+            f.write('debug = Maybe')
+        os.chmod(self.path, 0o640)
+        self.assertTrue(self.configs.write(self.path))
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+        self.assertEqual(os.listdir(self.tmpdir), ['neutron.conf'])
+
+    @patch.object(change_tracking.os, 'replace')
+    def test_write_failure(self, _replace):
+        _replace.side_effect = OSError
+        with self.assertRaises(OSError):
+            self.configs.write(self.path)
+        # temporary file is removed and the target left untouched
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_write_all(self):
+        other = os.path.join(self.tmpdir, 'other.conf')
+        self.configs.register(other, [self.ctxt],
+                              config_template='verbose = {{ verbose }}')
+        self.addCleanup(change_tracking._TRACKED_PATHS.discard, other)
+        self.ctxt['verbose'] = True
+        self.assertEqual(self.configs.write_all(), {self.path, other})
+        # digests of all files are committed at once
+        self.assertEqual(self.db.flushes, 1)
+        self.assertEqual(len(self.db[change_tracking.DIGESTS_KEY]), 2)
+        self.assertEqual(self.configs.write_all(), set())
+        self.ctxt['debug'] = True
+        self.assertEqual(self.configs.write_all(), {self.path})
+
+    def test_write_not_registered(self):
+        with self.assertRaises(change_tracking.templating.OSConfigException):
+            self.configs.write(os.path.join(self.tmpdir, 'other.conf'))
+
+
+class CountingContext(object):
+    interfaces = ['amqp']
+    missing_data = []
+    calls = 0
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self):
+        CountingContext.calls += 1
+        self.missing_data = ['password']
+        return {self.name: True}
+
+
+class NameContext(object):
+    interfaces = []
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self):
+        return {'name': self.name}
+
+
+class TestContextCache(ChangeTrackingTestCase):
+
+    def setUp(self):
+        super(TestContextCache, self).setUp()
+        CountingContext.calls = 0
+        self.paths = []
+        for name in ('a.conf', 'b.conf', 'c.conf'):
+            path = os.path.join(self.tmpdir, name)
+            self.configs.register(
+                path, [CountingContext('debug'), CountingContext('verbose'),
+                       NameContext(name)],
+                config_template='{{ name }} {{ debug }} {{ verbose }}')
+            self.addCleanup(change_tracking._TRACKED_PATHS.discard, path)
+            self.paths.append(path)
+
+    def test_write_all(self):
+        self.configs.write_all()
+        self.assertEqual(CountingContext.calls, 2)
+        # one miss each for neutron.conf, debug, verbose and three names
+        self.log.assert_any_call('Context cache: 4 hits, 6 misses.',
+                                 level=change_tracking.DEBUG)
+        for path in self.paths:
+            with open(path) as f:
+                self.assertEqual(f.read(), '{} True True'.format(
+                    os.path.basename(path)))
+        # generators not called take over the state of the one that was
+        for path in self.paths:
+            for context in self.configs.templates[path].contexts[:2]:
+                self.assertEqual(context.missing_data, ['password'])
+        self.assertEqual(self.configs.complete_contexts(), ['amqp'] * 3)
+        # the cache only lives for one pass
+        self.assertIsNone(self.configs.context_cache)
+        self.configs.write_all()
+        self.assertEqual(CountingContext.calls, 4)
+
+    def test_write_uncached(self):
+        for path in self.paths:
+            self.configs.write(path)
+        self.assertEqual(CountingContext.calls, 6)
+
+
+class TestRestartOnChange(ChangeTrackingTestCase):
+
+    def test_restart_on_change(self):
+        untracked = os.path.join(self.tmpdir, 'untracked.conf')
+        self.path_hash.side_effect = ['a', 'b']
+
+        @change_tracking.restart_on_change({
+            self.path: ['neutron-openvswitch-agent'],
+            untracked: ['openvswitch-switch', 'neutron-openvswitch-agent'],
+        })
+        def hook():
+            self.configs.write(self.path)
+            return 'result'
+
+        self.assertEqual(hook(), 'result')
+        # only the path not managed by the renderer is hashed
+        self.path_hash.assert_has_calls([call(untracked), call(untracked)])
+        self.request_restart.assert_has_calls([
+            call('neutron-openvswitch-agent', stopstart=False,
+                 restart_function=None, paths=[self.path, untracked]),
+            call('openvswitch-switch', stopstart=False,
+                 restart_function=None, paths=[untracked]),
+        ])
+        self.assertEqual(self.request_restart.call_count, 2)
+
+    def test_restart_on_change_unchanged(self):
+        self.configs.write(self.path)
+        restart_map = MagicMock()
+        restart_map.return_value = {self.path: ['neutron-openvswitch-agent']}
+
+        @change_tracking.restart_on_change(restart_map, stopstart=True)
+        def hook():
+            self.configs.write(self.path)
+
+        hook()
+        restart_map.assert_called_once_with()
+        self.request_restart.assert_not_called()
+        self.path_hash.assert_not_called()
+
+    def test_restart_on_change_stopstart(self):
+        restart_function = MagicMock()
+
+        @change_tracking.restart_on_change(
+            {self.path: ['openvswitch-switch', 'neutron-openvswitch-agent']},
+            stopstart=True,
+            restart_functions={'openvswitch-switch': restart_function})
+        def hook():
+            self.configs.write(self.path)
+
+        hook()
+        self.request_restart.assert_has_calls([
+            call('openvswitch-switch', stopstart=True,
+                 restart_function=restart_function, paths=[self.path]),
+            call('neutron-openvswitch-agent', stopstart=True,
+                 restart_function=None, paths=[self.path]),
+        ])
+
+    def test_restart_on_change_paused(self):
+        self.is_unit_paused_set.return_value = True
+
+        @change_tracking.restart_on_change(
+            {self.path: ['neutron-openvswitch-agent']})
+        def hook():
+            self.configs.write(self.path)
+
+        hook()
+        self.assertTrue(os.path.exists(self.path))
+        self.request_restart.assert_not_called()
@@ -0,0 +1,159 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import MagicMock, call
+
+import deferred_restarts
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'log',
+    'path_hash',
+    'service',
+]
+
+
+class TestDeferredRestarts(CharmTestCase):
+
+    def setUp(self):
+        super(TestDeferredRestarts, self).setUp(deferred_restarts, TO_PATCH)
+
+    def test_not_deferred(self):
+        deferred_restarts.request_restart('openvswitch-switch')
+        deferred_restarts.request_restart('openvswitch-switch',
+                                          stopstart=True)
+        self.service.assert_has_calls([
+            call('restart', 'openvswitch-switch'),
+            call('stop', 'openvswitch-switch'),
+            call('start', 'openvswitch-switch'),
+        ])
+
+    def test_deferred(self):
+        with deferred_restarts.deferred_restarts():
+            deferred_restarts.request_restart('neutron-l3-agent')
+            deferred_restarts.request_restart('neutron-openvswitch-agent')
+            deferred_restarts.request_restart('neutron-metadata-agent')
+            with deferred_restarts.deferred_restarts():
+                deferred_restarts.request_restart('openvswitch-switch')
+                deferred_restarts.request_restart('neutron-l3-agent')
+            deferred_restarts.request_restart('openvswitch-switch')
+            self.service.assert_not_called()
+        # dependencies first, otherwise in the order requested
+        self.assertEqual(self.service.mock_calls, [
+            call('restart', 'openvswitch-switch'),
+            call('restart', 'neutron-openvswitch-agent'),
+            call('restart', 'neutron-l3-agent'),
+            call('restart', 'neutron-metadata-agent'),
+        ])
+
+    def test_merge_requests(self):
+        restart_function = MagicMock()
+        with deferred_restarts.deferred_restarts():
+            deferred_restarts.request_restart('neutron-openvswitch-agent')
+            deferred_restarts.request_restart('neutron-openvswitch-agent',
+                                              stopstart=True)
+            deferred_restarts.request_restart(
+                'openvswitch-switch', restart_function=restart_function)
+            deferred_restarts.request_restart('openvswitch-switch')
+        restart_function.assert_called_once_with('openvswitch-switch')
+        self.assertEqual(self.service.mock_calls, [
+            call('stop', 'neutron-openvswitch-agent'),
+            call('start', 'neutron-openvswitch-agent'),
+        ])
+
+    def test_barrier(self):
+        with deferred_restarts.deferred_restarts():
+            deferred_restarts.request_restart('openvswitch-switch')
+            deferred_restarts.barrier()
+            self.service.assert_called_once_with('restart',
+                                                 'openvswitch-switch')
+            deferred_restarts.request_restart('openvswitch-switch')
+            deferred_restarts.request_restart('neutron-openvswitch-agent')
+        # at most one restart per service and hook
+        self.assertEqual(self.service.mock_calls, [
+            call('restart', 'openvswitch-switch'),
+            call('restart', 'neutron-openvswitch-agent'),
+        ])
+        # the next hook starts afresh
+        with deferred_restarts.deferred_restarts():
+            deferred_restarts.request_restart('openvswitch-switch')
+        self.assertEqual(self.service.call_count, 3)
+
+    def test_barrier_changed_paths(self):
+        digests = {'/etc/default/openvswitch-switch': 'a'}
+        self.path_hash.side_effect = digests.get
+        with deferred_restarts.deferred_restarts():
+            deferred_restarts.request_restart(
+                'openvswitch-switch',
+                paths=['/etc/default/openvswitch-switch'])
+            deferred_restarts.barrier()
+            # unchanged since the restart
+            deferred_restarts.request_restart(
+                'openvswitch-switch',
+                paths=['/etc/default/openvswitch-switch'])
+            deferred_restarts.barrier()
+            self.service.assert_called_once_with('restart',
+                                                 'openvswitch-switch')
+            # changed since the restart
+            digests['/etc/default/openvswitch-switch'] = 'b'
+            deferred_restarts.request_restart(
+                'openvswitch-switch',
+                paths=['/etc/default/openvswitch-switch'])
+        self.assertEqual(self.service.mock_calls, [
+            call('restart', 'openvswitch-switch'),
+            call('restart', 'openvswitch-switch'),
+        ])
+
+    def test_dependency_levels(self):
+        self.assertEqual(deferred_restarts.dependency_levels([
+            'neutron-l3-agent',
+            'neutron-metadata-agent',
+            'neutron-openvswitch-agent',
+            'openvswitch-switch',
+            'neutron-sriov-agent',
+        ]), [
+            ['neutron-metadata-agent', 'openvswitch-switch'],
+            ['neutron-openvswitch-agent', 'neutron-sriov-agent'],
+            ['neutron-l3-agent'],
+        ])
+        self.assertEqual(
+            deferred_restarts.dependency_levels(['neutron-l3-agent']),
+            [['neutron-l3-agent']])
+
+    def test_run_in_order_parallel(self):
+        with deferred_restarts.deferred_restarts(max_workers=4):
+            deferred_restarts.request_restart('neutron-l3-agent')
+            deferred_restarts.request_restart('neutron-metadata-agent')
+            deferred_restarts.request_restart('openvswitch-switch')
+        self.assertEqual(self.service.call_count, 3)
+        # openvswitch-switch is restarted before neutron-l3-agent
+        self.assertEqual(self.service.call_args, call('restart',
+                                                      'neutron-l3-agent'))
+        self.assertEqual(
+            deferred_restarts.run_in_order(
+                str.upper, ['neutron-l3-agent', 'openvswitch-switch'],
+                max_workers=2, reverse=True),
+            {'neutron-l3-agent': 'NEUTRON-L3-AGENT',
+             'openvswitch-switch': 'OPENVSWITCH-SWITCH'})
+
+    def test_exception(self):
+        with self.assertRaises(ValueError):
+            with deferred_restarts.deferred_restarts():
+                deferred_restarts.request_restart('openvswitch-switch')
+                raise ValueError()
+        self.service.assert_not_called()
+        with deferred_restarts.deferred_restarts():
+            pass
+        self.service.assert_not_called()
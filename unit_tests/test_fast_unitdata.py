@@ -0,0 +1,148 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import time
+
+from mock import patch
+
+import fast_unitdata
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'log',
+]
+
+
+class FastStorageTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(FastStorageTestCase, self).setUp(fast_unitdata, TO_PATCH)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _storage(self, cls, name, **kwargs):
+        db = cls(path=os.path.join(self.tmpdir, name), **kwargs)
+        self.addCleanup(db.close)
+        return db
+
+
+class TestFastStorage(FastStorageTestCase):
+
+    def setUp(self):
+        super(TestFastStorage, self).setUp()
+        self.path = os.path.join(self.tmpdir, 'state.db')
+        self.db = self._storage(fast_unitdata.FastStorage, 'state.db',
+                                history_less_prefixes=('hot.',))
+
+    def test_journal_mode(self):
+        self.db.cursor.execute('pragma journal_mode')
+        self.assertEqual(self.db.cursor.fetchone()[0], 'wal')
+        self.db.cursor.execute('pragma synchronous')
+        # NORMAL
+        self.assertEqual(self.db.cursor.fetchone()[0], 1)
+
+    def test_set_get(self):
+        self.assertEqual(self.db.set('key', {'a': [1, 2]}), {'a': [1, 2]})
+        self.db.update({'b': True, 'c': None}, prefix='p.')
+        self.db.flush()
+        plain = fast_unitdata.unitdata.Storage(self.path)
+        self.addCleanup(plain.close)
+        self.assertEqual(plain.get('key'), {'a': [1, 2]})
+        self.assertEqual(plain.getrange('p.', strip=True),
+                         {'b': True, 'c': None})
+
+    def test_update_many(self):
+        mapping = {'key{}'.format(i): i for i in range(2500)}
+        self.db.update(mapping)
+        self.assertEqual(self.db.getrange('key'), mapping)
+
+    def test_update_unchanged(self):
+        self.db.update({'a': 1, 'b': 2})
+        with patch.object(self.db, 'cursor', wraps=self.db.cursor) as cursor:
+            self.db.update({'a': 1, 'b': 2})
+        cursor.executemany.assert_not_called()
+
+    def test_history(self):
+        with self.db.hook_scope('config-changed'):
+            self.db.update({'key': 1, 'hot.digest': 'abc'})
+        with self.db.hook_scope('update-status'):
+            self.db.set('key', 2)
+            self.db.set('hot.digest', 'def')
+        self.assertEqual(
+            [(rev[2], rev[3]) for rev in self.db.gethistory('key')],
+            [('1', 'config-changed'), ('2', 'update-status')])
+        self.assertEqual(self.db.gethistory('hot.digest'), [])
+
+    def test_enable(self):
+        with patch.object(fast_unitdata.unitdata, '_KV', None), \
+                patch.dict(os.environ, {'UNIT_STATE_DB': self.path}):
+            db = fast_unitdata.enable(history_less_prefixes=('hot.',))
+            self.addCleanup(db.close)
+            self.assertIsInstance(db, fast_unitdata.FastStorage)
+            self.assertIs(fast_unitdata.unitdata.kv(), db)
+            self.assertEqual(db.history_less_prefixes, ('hot.',))
+            self.assertIs(fast_unitdata.enable(), db)
+            # prefixes of later calls are added
+            fast_unitdata.enable(history_less_prefixes=('hot.', 'cold.'))
+            self.assertEqual(db.history_less_prefixes, ('hot.', 'cold.'))
+
+    def test_enable_already_opened(self):
+        plain = self._storage(fast_unitdata.unitdata.Storage, 'plain.db')
+        with patch.object(fast_unitdata.unitdata, '_KV', plain):
+            self.assertIs(fast_unitdata.enable(), plain)
+        self.assertTrue(self.log.called)
+
+
+class TestFastStorageBenchmark(FastStorageTestCase):
+    """Micro-benchmark of Storage against FastStorage.
+
+    Run with ``pytest -s`` to see the results.
+    """
+
+    KEYS = 300
+
+    def _ops(self, func, ops):
+        start = time.time()
+        func()
+        return ops / max(time.time() - start, 1e-9)
+
+    def _run(self, cls, name):
+        db = self._storage(cls, name)
+        mapping = {'key{}'.format(i): {'value': i} for i in range(self.KEYS)}
+
+        def set_flush():
+            for key, value in mapping.items():
+                db.set(key, value)
+                db.flush()
+
+        def update():
+            with db.hook_scope('bench'):
+                db.update({k: {'value': -v['value']}
+                           for k, v in mapping.items()})
+
+        results = (self._ops(set_flush, self.KEYS),
+                   self._ops(update, self.KEYS))
+        self.assertEqual(db.get('key1'), {'value': -1})
+        return results
+
+    def test_benchmark(self):
+        before = self._run(fast_unitdata.unitdata.Storage, 'before.db')
+        after = self._run(fast_unitdata.FastStorage, 'after.db')
+        for op, b, a in zip(('set+flush', 'update'), before, after):
+            print('{:10} Storage {:10.0f} ops/s  FastStorage {:10.0f} ops/s'
+                  .format(op, b, a))
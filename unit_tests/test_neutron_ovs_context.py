@@ -16,6 +16,7 @@ from test_utils import CharmTestCase
 from test_utils import patch_open
 from mock import patch, Mock
 import neutron_ovs_context as context
+import numa
 import charmhelpers
 import copy
 
@@ -32,7 +33,6 @@ TO_PATCH = [
     'unit_get',
     'get_host_ip',
     'network_get_primary_address',
-    'glob',
     'PCINetDevices',
     'relation_ids',
     'relation_get',
@@ -50,6 +50,29 @@ def fake_context(settings):
     return outer
 
 
+class NeutronAPISettingsTest(CharmTestCase):
+
+    def setUp(self):
+        super(NeutronAPISettingsTest, self).setUp(context, TO_PATCH)
+
+    @patch.object(context, 'log')
+    @patch.object(context, 'NeutronAPIContext')
+    def test_get_neutron_api_settings(self, _NeutronAPIContext, _log):
+        _NeutronAPIContext.return_value.return_value = {'enable_dvr': True}
+        self.assertEqual(context.get_neutron_api_settings(),
+                         {'enable_dvr': True})
+        self.assertEqual(context.get_neutron_api_settings(),
+                         {'enable_dvr': True})
+        _NeutronAPIContext.assert_called_once_with()
+        self.assertEqual(_log.call_count, 1)
+        # relation_set flushes cached data keyed on the local unit
+        charmhelpers.core.hookenv.flush('neutron-openvswitch/0')
+        _NeutronAPIContext.return_value.return_value = {'enable_dvr': False}
+        self.assertEqual(context.get_neutron_api_settings(),
+                         {'enable_dvr': False})
+        self.assertEqual(_NeutronAPIContext.call_count, 2)
+
+
 class OVSPluginContextTest(CharmTestCase):
 
     def setUp(self):
@@ -98,6 +121,38 @@ class OVSPluginContextTest(CharmTestCase):
             {'em1': 'br-d2'}
         )
 
+    @patch.object(context.nic_inventory, 'inventory')
+    def test_data_port_mac_inventory(self, inventory):
+        inventory.return_value = context.nic_inventory.NICInventory([
+            context.nic_inventory.NIC('em1', hwaddr='aa:aa:aa:aa:aa:aa',
+                                      physical=True),
+            context.nic_inventory.NIC('eth0', hwaddr='bb:bb:bb:bb:bb:bb',
+                                      physical=True,
+                                      bridge='br-juju'),
+        ])
+        self.test_config.set('data-port',
+                             'br-d1:cc:cc:cc:cc:cc:cc '
+                             'br-d2:aa:aa:aa:aa:aa:aa '
+                             'br-d3:bb:bb:bb:bb:bb:bb')
+        with patch.object(context.nic_inventory.NIC, 'addresses',
+                          return_value=[]):
+            self.assertEqual(context.DataPortContext()(), {'em1': 'br-d2'})
+
+    @patch.object(context.context, 'NeutronAPIContext')
+    @patch.object(context.nic_inventory, 'inventory')
+    def test_phy_nic_mtu_inventory(self, inventory, _NeutronAPIContext):
+        inventory.return_value = context.nic_inventory.NICInventory([
+            context.nic_inventory.NIC('em1', hwaddr='aa:aa:aa:aa:aa:aa',
+                                      physical=True),
+        ])
+        _NeutronAPIContext.return_value.return_value = {
+            'network_device_mtu': 9000}
+        self.test_config.set('data-port', 'br-d1:aa:aa:aa:aa:aa:aa')
+        with patch.object(context.nic_inventory.NIC, 'addresses',
+                          return_value=[]):
+            self.assertEqual(context.PhyNICMTUContext()(),
+                             {'devs': 'em1', 'mtu': 9000})
+
     @patch.object(charmhelpers.contrib.openstack.utils,
                   'get_os_codename_package')
     @patch.object(charmhelpers.contrib.openstack.context, 'config',
@@ -633,9 +688,6 @@ class MockPCIDevice(object):
         self.pci_address = address
 
 
-TEST_CPULIST_1 = "0-3"
-TEST_CPULIST_2 = "0-7,16-23"
-TEST_CPULIST_3 = "0,4,8,12,16,20,24"
 DPDK_DATA_PORTS = (
     "br-phynet3:fe:16:41:df:23:fe "
     "br-phynet1:fe:16:41:df:23:fd "
@@ -658,27 +710,6 @@ class TestDPDKUtils(CharmTestCase):
         super(TestDPDKUtils, self).setUp(context, TO_PATCH)
         self.config.side_effect = self.test_config.get
 
-    def test_parse_cpu_list(self):
-        self.assertEqual(context.parse_cpu_list(TEST_CPULIST_1),
-                         [0, 1, 2, 3])
-        self.assertEqual(context.parse_cpu_list(TEST_CPULIST_2),
-                         [0, 1, 2, 3, 4, 5, 6, 7,
-                          16, 17, 18, 19, 20, 21, 22, 23])
-        self.assertEqual(context.parse_cpu_list(TEST_CPULIST_3),
-                         [0, 4, 8, 12, 16, 20, 24])
-
-    @patch.object(context, 'parse_cpu_list', wraps=context.parse_cpu_list)
-    def test_numa_node_cores(self, _parse_cpu_list):
-        self.glob.glob.return_value = [
-            '/sys/devices/system/node/node0'
-        ]
-        with patch_open() as (_, mock_file):
-            mock_file.read.return_value = TEST_CPULIST_1
-            self.assertEqual(context.numa_node_cores(),
-                             {'0': [0, 1, 2, 3]})
-        self.glob.glob.assert_called_with('/sys/devices/system/node/node*')
-        _parse_cpu_list.assert_called_with(TEST_CPULIST_1)
-
     def test_resolve_dpdk_bridges(self):
         self.test_config.set('data-port', DPDK_DATA_PORTS)
         _pci_devices = Mock()
@@ -697,23 +728,67 @@ class TestDPDKUtils(CharmTestCase):
                          {'0000:00:1c.0': 'bond0',
                           '0000:00:1d.0': 'bond0'})
 
+    @patch.object(context, 'kv')
+    def test_resolve_dpdk_pci_addresses(self, _kv):
+        self.test_config.set('data-port', DPDK_DATA_PORTS)
+        self.test_config.set('dpdk-bond-mappings', BOND_MAPPINGS)
+        _pci_devices = Mock()
+        _pci_devices.get_device_from_mac.side_effect = PCI_DEVICE_MAP.get
+        self.PCINetDevices.return_value = _pci_devices
+        db = _kv.return_value
+        # fe:f2:d0:45:dc:66 is bound to dpdk and no longer listed
+        db.get.side_effect = {
+            'fe:16:41:df:23:fd': '0000:00:1c.0',
+            'fe:f2:d0:45:dc:66': '0000:00:1e.0',
+        }.get
+        self.assertEqual(context.resolve_dpdk_bridges(),
+                         {'0000:00:1c.0': 'br-phynet1',
+                          '0000:00:1d.0': 'br-phynet3',
+                          '0000:00:1e.0': 'br-phynet2'})
+        self.assertEqual(context.resolve_dpdk_bonds(),
+                         {'0000:00:1c.0': 'bond0',
+                          '0000:00:1d.0': 'bond0',
+                          '0000:00:1e.0': 'bond1'})
+        # only the changed allocation is written, in one transaction
+        db.update.assert_called_once_with(
+            {'fe:16:41:df:23:fe': '0000:00:1d.0'})
+        db.flush.assert_called_once_with()
+        db.set.assert_not_called()
+        self.PCINetDevices.assert_called_once_with()
+
+    @patch.object(context, 'kv')
+    def test_resolve_dpdk_pci_addresses_unchanged(self, _kv):
+        self.test_config.set('data-port', DPDK_DATA_PORTS)
+        _pci_devices = Mock()
+        _pci_devices.get_device_from_mac.side_effect = PCI_DEVICE_MAP.get
+        self.PCINetDevices.return_value = _pci_devices
+        db = _kv.return_value
+        db.get.side_effect = {
+            'fe:16:41:df:23:fd': '0000:00:1c.0',
+            'fe:16:41:df:23:fe': '0000:00:1d.0',
+        }.get
+        self.assertEqual(context.resolve_dpdk_pci_addresses(), {
+            'fe:16:41:df:23:fe': '0000:00:1d.0',
+            'fe:16:41:df:23:fd': '0000:00:1c.0',
+            'fe:f2:d0:45:dc:66': None})
+        db.update.assert_not_called()
+        db.flush.assert_not_called()
+
 
 DPDK_PATCH = [
-    'parse_cpu_list',
-    'numa_node_cores',
+    'numa_topology',
     'resolve_dpdk_bridges',
     'resolve_dpdk_bonds',
-    'glob',
 ]
 
-NUMA_CORES_SINGLE = {
-    '0': [0, 1, 2, 3]
-}
+NUMA_CORES_SINGLE = numa.NUMATopology([
+    numa.NUMANode(0, 0x0f),
+])
 
-NUMA_CORES_MULTI = {
-    '0': [0, 1, 2, 3],
-    '1': [4, 5, 6, 7]
-}
+NUMA_CORES_MULTI = numa.NUMATopology([
+    numa.NUMANode(0, 0x0f),
+    numa.NUMANode(1, 0xf0),
+])
 
 
 class TestOVSDPDKDeviceContext(CharmTestCase):
@@ -736,11 +811,15 @@ class TestOVSDPDKDeviceContext(CharmTestCase):
 
     def test_socket_memory(self):
         '''Test socket memory configuration'''
-        self.glob.glob.return_value = ['a']
+        self.numa_topology.return_value = numa.NUMATopology([])
+        self.assertEqual(self.test_context.socket_memory(),
+                         '1024')
+
+        self.numa_topology.return_value = NUMA_CORES_SINGLE
         self.assertEqual(self.test_context.socket_memory(),
                          '1024')
 
-        self.glob.glob.return_value = ['a', 'b']
+        self.numa_topology.return_value = NUMA_CORES_MULTI
         self.assertEqual(self.test_context.socket_memory(),
                          '1024,1024')
 
@@ -748,17 +827,99 @@ class TestOVSDPDKDeviceContext(CharmTestCase):
         self.assertEqual(self.test_context.socket_memory(),
                          '2048,2048')
 
+    def test_socket_memory_hugepages(self):
+        self.resolve_dpdk_bridges.return_value = {'0000:00:1c.0': 'br-data'}
+        self.resolve_dpdk_bonds.return_value = {}
+        self.numa_topology.return_value = numa.NUMATopology(
+            [numa.NUMANode(0, 0x0f,
+                           hugepages={2048: {'total': 256, 'free': 0}}),
+             numa.NUMANode(1, 0xf0,
+                           hugepages={1048576: {'total': 2, 'free': 2}}),
+             numa.NUMANode(2, 0xf00)],
+            {'0000:00:1c.0': 1})
+        self.test_config.set('dpdk-socket-memory', 4096)
+        # full socket memory local to the device, what is there elsewhere
+        self.assertEqual(self.test_context.socket_memory(), '512,4096,0')
+        # no limit would be 0, node 2 must not allocate any
+        self.assertEqual(self.test_context.socket_limit(), '512,4096,1')
+        self.assertEqual(self.test_context.hugepage_shortfall(),
+                         {1: (2048, 4096)})
+        self.test_config.set('dpdk-socket-memory', 1024)
+        self.assertEqual(self.test_context.socket_memory(), '512,1024,0')
+        self.assertEqual(self.test_context.hugepage_shortfall(), {})
+
+    def test_socket_limit_mixed_nodes(self):
+        self.resolve_dpdk_bridges.return_value = {'0000:00:1c.0': 'br-data'}
+        self.resolve_dpdk_bonds.return_value = {}
+        self.numa_topology.return_value = numa.NUMATopology(
+            [numa.NUMANode(0, 0x0f),
+             numa.NUMANode(1, 0xf0,
+                           hugepages={1048576: {'total': 1, 'free': 1}}),
+             numa.NUMANode(2, 0xf00,
+                           hugepages={2048: {'total': 512, 'free': 512}})],
+            {'0000:00:1c.0': 1})
+        self.assertEqual(self.test_context.socket_memory(), '0,1024,1024')
+        self.assertEqual(self.test_context.socket_limit(), '1,1024,1024')
+        self.numa_topology.return_value = numa.NUMATopology([])
+        self.assertEqual(self.test_context.socket_limit(), '1024')
+
     def test_cpu_mask(self):
         '''Test generation of hex CPU masks'''
-        self.numa_node_cores.return_value = NUMA_CORES_SINGLE
+        self.numa_topology.return_value = NUMA_CORES_SINGLE
         self.assertEqual(self.test_context.cpu_mask(), '0x01')
 
-        self.numa_node_cores.return_value = NUMA_CORES_MULTI
+        self.numa_topology.return_value = NUMA_CORES_MULTI
         self.assertEqual(self.test_context.cpu_mask(), '0x11')
 
         self.test_config.set('dpdk-socket-cores', 2)
         self.assertEqual(self.test_context.cpu_mask(), '0x33')
 
+    def _pmd_topology(self):
+        self.resolve_dpdk_bridges.return_value = {
+            '0000:00:1c.0': 'br-data',
+            '0000:00:1d.0': 'br-data',
+        }
+        self.resolve_dpdk_bonds.return_value = {}
+        self.numa_topology.return_value = numa.NUMATopology(
+            [numa.NUMANode(0, 0x0f0f), numa.NUMANode(1, 0xf0f0)],
+            {'0000:00:1c.0': 1, '0000:00:1d.0': None})
+
+    def test_pmd_cpu_mask(self):
+        self._pmd_topology()
+        self.assertEqual(self.test_context.pmd_cpu_mask(), None)
+        self.test_config.set('dpdk-pmd-cores', 2)
+        # cores following the lcore on the node of the device
+        self.assertEqual(self.test_context.pmd_cpu_mask(), '0x60')
+        self.test_config.set('dpdk-socket-cores', 3)
+        self.assertEqual(self.test_context.pmd_cpu_mask(), '0x1080')
+
+    def test_rxq_affinity(self):
+        self._pmd_topology()
+        self.test_config.set('dpdk-pmd-cores', 2)
+        self.test_config.set('dpdk-rx-queues', 3)
+        self.assertEqual(self.test_context.rxq_affinity('0000:00:1c.0'),
+                         None)
+        self.test_config.set('dpdk-pmd-rxq-affinity', True)
+        self.assertEqual(self.test_context.rxq_affinity('0000:00:1c.0'),
+                         '0:5,1:6,2:5')
+        # locality unknown, use the nodes of the other devices
+        self.assertEqual(self.test_context.rxq_affinity('0000:00:1d.0'),
+                         '0:5,1:6,2:5')
+        self.numa_topology.return_value.device_nodes = {}
+        self.assertEqual(self.test_context.rxq_affinity('0000:00:1d.0'),
+                         '0:1,1:2,2:5')
+
+    def test_topology(self):
+        self.resolve_dpdk_bridges.return_value = {
+            '0000:00:1d.0': 'br-data',
+            '0000:00:1c.0': 'br-data',
+        }
+        self.resolve_dpdk_bonds.return_value = {}
+        self.assertEqual(self.test_context.topology(),
+                         self.numa_topology.return_value)
+        self.numa_topology.assert_called_once_with(
+            ['0000:00:1c.0', '0000:00:1d.0'])
+
     def test_context_no_devices(self):
         '''Ensure that DPDK is disable when no devices detected'''
         self.resolve_dpdk_bridges.return_value = {}
@@ -771,8 +932,7 @@ class TestOVSDPDKDeviceContext(CharmTestCase):
             '0000:00:1d.0': 'br-data',
         }
         self.resolve_dpdk_bonds.return_value = {}
-        self.numa_node_cores.return_value = NUMA_CORES_SINGLE
-        self.glob.glob.return_value = ['a']
+        self.numa_topology.return_value = NUMA_CORES_SINGLE
         self.assertEqual(self.test_context(), {
             'cpu_mask': '0x01',
             'device_whitelist': '-w 0000:00:1c.0 -w 0000:00:1d.0',
@@ -878,6 +1038,29 @@ class TestRemoteRestartContext(CharmTestCase):
         )
 
 
+class TestAMQPContext(CharmTestCase):
+
+    def setUp(self):
+        super(TestAMQPContext, self).setUp(context, TO_PATCH)
+
+    @patch.object(charmhelpers.contrib.openstack.context.AMQPContext,
+                  '__call__')
+    def test_amqp_context(self, _call):
+        ch_context = charmhelpers.contrib.openstack.context
+        original = ch_context.relation_get
+
+        def _amqp_context():
+            self.assertIs(ch_context.relation_get,
+                          context.relation_prefetch.relation_get)
+            return {'rabbitmq_host': '10.0.0.1'}
+
+        _call.side_effect = _amqp_context
+        self.assertEqual(context.AMQPContext(ssl_dir='/etc/neutron')(),
+                         {'rabbitmq_host': '10.0.0.1'})
+        _call.assert_called_once_with()
+        self.assertIs(ch_context.relation_get, original)
+
+
 class TestFirewallDriver(CharmTestCase):
 
     TO_PATCH = [
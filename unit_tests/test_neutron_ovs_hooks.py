@@ -12,10 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from mock import MagicMock, patch, mock_open
+import os
+import shutil
+import sys
+import tempfile
+
+from mock import MagicMock, call, patch, mock_open
+
+from charmhelpers.core import unitdata
 
 from test_utils import CharmTestCase
 
+import fast_unitdata
+
 with patch('charmhelpers.core.hookenv.config') as config:
     config.return_value = 'neutron'
     with patch('charmhelpers.contrib.openstack.context.HostInfoContext'):
@@ -27,12 +36,14 @@ _map = utils.restart_map
 utils.register_configs = MagicMock()
 utils.restart_map = MagicMock()
 
-import neutron_ovs_hooks as hooks
+with patch.dict(os.environ, {'UNIT_STATE_DB': ':memory:'}):
+    import neutron_ovs_hooks as hooks
 
 utils.register_configs = _reg
 utils.restart_map = _map
 
 TO_PATCH = [
+    'barrier',
     'create_sysctl',
     'config',
     'CONFIGS',
@@ -42,14 +53,12 @@ TO_PATCH = [
     'relation_set',
     'configure_ovs',
     'use_dvr',
-    'use_l3ha',
     'install_packages',
-    'install_l3ha_packages',
-    'purge_packages',
+    'dpdk_hugepages_ready',
+    'apply_package_plan',
     'enable_nova_metadata',
     'enable_local_dhcp',
     'install_tmpfilesd',
-    'purge_packages',
     'determine_purge_packages',
     'is_container',
 ]
@@ -65,6 +74,7 @@ class NeutronOVSHooksTests(CharmTestCase):
 
         self.config.side_effect = self.test_config.get
         self.is_container.return_value = False
+        self.dpdk_hugepages_ready.return_value = True
         hooks.hooks._config_save = False
 
     def _call_hook(self, hookname):
@@ -123,6 +133,26 @@ class NeutronOVSHooksTests(CharmTestCase):
         self.assertTrue(self.CONFIGS.write_all.called)
         self.configure_ovs.assert_called_with()
 
+    def test_config_changed_restart_barrier(self):
+        manager = MagicMock()
+        manager.attach_mock(self.barrier, 'barrier')
+        manager.attach_mock(self.configure_ovs, 'configure_ovs')
+        self._call_hook('config-changed')
+        self.assertEqual(manager.mock_calls,
+                         [call.barrier(), call.configure_ovs()])
+
+    @patch.object(hooks, 'restart_map')
+    def test_restart_map_ovs_default(self, _restart_map):
+        _restart_map.return_value = {
+            utils.OVS_DEFAULT: ['openvswitch-switch'],
+            utils.NEUTRON_CONF: ['neutron-openvswitch-agent'],
+        }
+        self.assertEqual(hooks._restart_map_ovs_default(),
+                         {utils.OVS_DEFAULT: ['openvswitch-switch']})
+        # openvswitch-switch is not restarted while DPDK waits for hugepages
+        self.dpdk_hugepages_ready.return_value = False
+        self.assertEqual(hooks._restart_map_ovs_default(), {})
+
     def test_config_changed_sysctl_overrides(self):
         self.test_config.set(
             'sysctl',
@@ -150,36 +180,31 @@ class NeutronOVSHooksTests(CharmTestCase):
         self.install_packages.assert_called_with()
         self.assertTrue(self.CONFIGS.write_all.called)
         self.configure_ovs.assert_called_with()
-        self.purge_packages.assert_called_with(['python-neutron'])
         _plugin_joined.assert_called_with(
             relation_id='neutron-plugin:42',
             request_restart=True)
 
-    @patch.object(hooks, 'os_release')
     @patch.object(hooks, 'neutron_plugin_joined')
-    def test_neutron_plugin_api(self, _plugin_joined, _os_release):
-        _os_release.return_value = 'newton'
+    def test_neutron_plugin_api(self, _plugin_joined):
         self.use_dvr.return_value = True
-        self.use_l3ha.return_value = False
         self.relation_ids.return_value = ['rid']
         self._call_hook('neutron-plugin-api-relation-changed')
         self.configure_ovs.assert_called_with()
         self.assertTrue(self.CONFIGS.write_all.called)
         _plugin_joined.assert_called_with(relation_id='rid')
         self.install_packages.assert_called_with()
+        self.apply_package_plan.assert_not_called()
 
     @patch.object(hooks, 'neutron_plugin_joined')
     def test_neutron_plugin_api_nodvr(self, _plugin_joined):
         self.use_dvr.return_value = False
-        self.use_l3ha.return_value = False
         self.relation_ids.return_value = ['rid']
         self._call_hook('neutron-plugin-api-relation-changed')
         self.configure_ovs.assert_called_with()
         self.assertTrue(self.CONFIGS.write_all.called)
         _plugin_joined.assert_called_with(relation_id='rid')
-        self.purge_packages.assert_called_with(['neutron-l3-agent',
-                                                'libnetfilter-log1',
-                                                'keepalived'])
+        self.apply_package_plan.assert_called_once_with()
+        self.assertFalse(self.install_packages.called)
 
     @patch.object(hooks, 'use_fqdn_hint')
     @patch.object(hooks.os_context, 'HostInfoContext')
@@ -219,7 +244,7 @@ class NeutronOVSHooksTests(CharmTestCase):
             relation_id=None,
             **rel_data
         )
-        self.purge_packages.assert_called_with(['neutron-dhcp-agent'])
+        self.apply_package_plan.assert_called_once_with()
         self.assertFalse(self.install_packages.called)
 
     @patch.object(hooks, 'use_fqdn_hint')
@@ -240,37 +265,9 @@ class NeutronOVSHooksTests(CharmTestCase):
             relation_id=None,
             **rel_data
         )
-        self.purge_packages.assert_called_with(['neutron-dhcp-agent',
-                                                'neutron-metadata-agent'])
+        self.apply_package_plan.assert_called_once_with()
         self.assertFalse(self.install_packages.called)
 
-    @patch.object(hooks, 'os_release')
-    @patch.object(hooks, 'neutron_plugin_joined')
-    def test_neutron_plugin_api_dvr_no_l3ha(self, _plugin_joined, _os_release):
-        _os_release.return_value = 'newton'
-        self.use_dvr.return_value = True
-        self.use_l3ha.return_value = False
-        self.relation_ids.return_value = ['rid']
-        self._call_hook('neutron-plugin-api-relation-changed')
-        self.configure_ovs.assert_called_with()
-        self.assertTrue(self.CONFIGS.write_all.called)
-        _plugin_joined.assert_called_with(relation_id='rid')
-        self.purge_packages.assert_not_called()
-
-    @patch.object(hooks, 'os_release')
-    @patch.object(hooks, 'neutron_plugin_joined')
-    def test_neutron_plugin_api_dvr_l3ha(self, _plugin_joined, _os_release):
-        _os_release.return_value = 'newton'
-        self.use_dvr.return_value = True
-        self.use_l3ha.return_value = True
-        self.relation_ids.return_value = ['rid']
-        self._call_hook('neutron-plugin-api-relation-changed')
-        self.configure_ovs.assert_called_with()
-        self.assertTrue(self.CONFIGS.write_all.called)
-        _plugin_joined.assert_called_with(relation_id='rid')
-        self.install_packages.assert_called_with()
-        self.install_l3ha_packages.assert_called_with()
-
     def test_amqp_joined(self):
         self._call_hook('amqp-relation-joined')
         self.relation_set.assert_called_with(
@@ -287,3 +284,33 @@ class NeutronOVSHooksTests(CharmTestCase):
     def test_amqp_departed(self):
         self._call_hook('amqp-relation-departed')
         self.assertTrue(self.CONFIGS.write.called_with(NEUTRON_CONF))
+
+
+class FastUnitdataTests(CharmTestCase):
+
+    def setUp(self):
+        super(FastUnitdataTests, self).setUp(hooks, [])
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_enabled_before_configs(self):
+        storages = []
+
+        def register_configs():
+            storages.append(unitdata.kv())
+            return MagicMock()
+
+        with patch.object(unitdata, '_KV', None), \
+                patch.dict(os.environ, {'UNIT_STATE_DB': os.path.join(
+                    self.tmpdir, 'state.db')}), \
+                patch.dict(sys.modules), \
+                patch.object(utils, 'register_configs', register_configs), \
+                patch.object(utils, 'restart_map', return_value={}):
+            del sys.modules['neutron_ovs_hooks']
+            import neutron_ovs_hooks
+            storage = unitdata.kv()
+            self.addCleanup(storage.close)
+            self.assertIsInstance(storage, fast_unitdata.FastStorage)
+            self.assertEqual(storages, [storage])
+            self.assertEqual(storage.history_less_prefixes,
+                             (neutron_ovs_hooks.DIGESTS_KEY,))
@@ -15,14 +15,18 @@
 import hashlib
 import subprocess
 
-from mock import MagicMock, patch, call
+from mock import ANY, MagicMock, patch, call
 from collections import OrderedDict
+from copy import deepcopy
 import charmhelpers.contrib.openstack.templating as templating
 
+import change_tracking  # noqa: F401 subclasses the real OSConfigRenderer
+
 templating.OSConfigRenderer = MagicMock()
 
 import neutron_ovs_utils as nutils
 import neutron_ovs_context
+import nic_inventory
 
 from test_utils import (
     CharmTestCase,
@@ -32,27 +36,21 @@ import charmhelpers.core.hookenv as hookenv
 
 
 TO_PATCH = [
-    'add_bridge',
-    'add_bridge_port',
     'add_ovsbridge_linuxbridge',
     'is_linuxbridge_interface',
-    'dpdk_add_bridge_port',
-    'dpdk_add_bridge_bond',
-    'dpdk_set_bond_config',
-    'dpdk_set_mtu_request',
-    'dpdk_set_interfaces_mtu',
+    'ovs_state',
     'add_source',
     'apt_install',
-    'apt_update',
+    'apt_index',
     'config',
     'lsb_release',
     'os_release',
     'filter_installed_packages',
-    'filter_missing_packages',
+    'PackagePlan',
     'lsb_release',
     'neutron_plugin_attribute',
     'full_restart',
-    'service_restart',
+    'request_restart',
     'service_running',
     'ExternalPortContext',
     'determine_dkms_package',
@@ -60,8 +58,6 @@ TO_PATCH = [
     'status_set',
     'use_dpdk',
     'os_application_version_set',
-    'enable_ipfix',
-    'disable_ipfix',
     'ovs_has_late_dpdk_init',
     'ovs_vhostuser_client',
     'parse_data_port_mappings',
@@ -110,6 +106,10 @@ class TestNeutronOVSUtils(CharmTestCase):
         self.use_dpdk.return_value = False
         self.ovs_has_late_dpdk_init.return_value = False
         self.ovs_vhostuser_client.return_value = False
+        self.desired = self.ovs_state.DesiredOVSState.return_value
+        self.plan = self.PackagePlan.return_value
+        self.plan.diff.return_value = (['randompkg'], [])
+        self.determine_dkms_package.return_value = []
 
     def tearDown(self):
         # Reset cached cache
@@ -121,11 +121,36 @@ class TestNeutronOVSUtils(CharmTestCase):
         self.lsb_release.return_value = {'DISTRIB_CODENAME': 'xenial'}
         _determine_packages.return_value = 'randompkg'
         nutils.install_packages()
-        self.apt_update.assert_called_with()
-        self.apt_install.assert_called_with(self.filter_installed_packages(),
-                                            fatal=True)
+        self.apt_index.update.assert_called_once_with(3600)
+        self.plan.apply.assert_called_once_with()
         self.modprobe.assert_not_called()
 
+    @patch.object(nutils, 'determine_packages')
+    def test_install_packages_installed(self, _determine_packages):
+        self.os_release.return_value = 'mitaka'
+        self.lsb_release.return_value = {'DISTRIB_CODENAME': 'xenial'}
+        self.is_container.return_value = True
+        self.determine_dkms_package.return_value = []
+        self.plan.diff.return_value = ([], ['neutron-dhcp-agent'])
+        nutils.install_packages()
+        self.apt_index.update.assert_not_called()
+        self.plan.apply.assert_called_once_with()
+
+    @patch.object(nutils, 'determine_packages')
+    def test_install_packages_nothing_to_do(self, _determine_packages):
+        self.os_release.return_value = 'mitaka'
+        self.lsb_release.return_value = {'DISTRIB_CODENAME': 'xenial'}
+        self.is_container.return_value = True
+        self.determine_dkms_package.return_value = []
+        self.filter_installed_packages.return_value = []
+        self.plan.diff.return_value = ([], [])
+        nutils.install_packages()
+        self.filter_installed_packages.assert_called_once_with(
+            ['neutron-common'])
+        self.apt_install.assert_not_called()
+        self.apt_index.update.assert_not_called()
+        self.plan.apply.assert_called_once_with()
+
     @patch.object(nutils, 'determine_packages')
     def test_install_packages_container(self, _determine_packages):
         self.os_release.return_value = 'mitaka'
@@ -133,27 +158,31 @@ class TestNeutronOVSUtils(CharmTestCase):
         self.is_container.return_value = True
         _determine_packages.return_value = 'randompkg'
         nutils.install_packages()
-        self.apt_update.assert_called_with()
-        self.apt_install.assert_called_with(self.filter_installed_packages(),
-                                            fatal=True)
+        self.apt_index.update.assert_called_once_with(3600)
+        self.plan.apply.assert_called_once_with()
         self.modprobe.assert_not_called()
 
+    @patch.object(nutils, 'use_dvr')
     @patch.object(nutils, 'determine_packages')
-    def test_install_packages_ovs_firewall(self, _determine_packages):
+    def test_install_packages_ovs_firewall(self, _determine_packages,
+                                           _use_dvr):
+        _use_dvr.return_value = False
         self.os_release.return_value = 'mitaka'
         self.lsb_release.return_value = {'DISTRIB_CODENAME': 'xenial'}
         _determine_packages.return_value = 'randompkg'
         self.is_container.return_value = False
         self.test_config.set('firewall-driver', 'openvswitch')
         nutils.install_packages()
-        self.apt_update.assert_called_with()
-        self.apt_install.assert_called_with(self.filter_installed_packages(),
-                                            fatal=True)
+        self.apt_index.update.assert_called_once_with(3600)
+        self.plan.apply.assert_called_once_with()
         self.modprobe.assert_has_calls([call('nf_conntrack_ipv4', True),
                                         call('nf_conntrack_ipv6', True)])
 
+    @patch.object(nutils, 'use_dvr')
     @patch.object(nutils, 'determine_packages')
-    def test_install_packages_ovs_fw_newer_kernel(self, _determine_packages):
+    def test_install_packages_ovs_fw_newer_kernel(self, _determine_packages,
+                                                  _use_dvr):
+        _use_dvr.return_value = False
         self.os_release.return_value = 'mitaka'
         self.lsb_release.return_value = {'DISTRIB_CODENAME': 'xenial'}
         _determine_packages.return_value = 'randompkg'
@@ -162,9 +191,8 @@ class TestNeutronOVSUtils(CharmTestCase):
         self.modprobe.side_effect = [subprocess.CalledProcessError(0, ""),
                                      None]
         nutils.install_packages()
-        self.apt_update.assert_called_with()
-        self.apt_install.assert_called_with(self.filter_installed_packages(),
-                                            fatal=True)
+        self.apt_index.update.assert_called_once_with(3600)
+        self.plan.apply.assert_called_once_with()
         self.modprobe.assert_has_calls([call('nf_conntrack_ipv4', True),
                                         call('nf_conntrack', True)])
 
@@ -177,12 +205,13 @@ class TestNeutronOVSUtils(CharmTestCase):
             ['openvswitch-datapath-dkms']
         self.headers_package.return_value = 'linux-headers-foobar'
         nutils.install_packages()
-        self.apt_update.assert_called_with()
-        self.apt_install.assert_has_calls([
-            call(['linux-headers-foobar',
-                  'openvswitch-datapath-dkms'], fatal=True),
-            call(self.filter_installed_packages(), fatal=True),
-        ])
+        # before the dkms packages and the plan, fresh for the latter
+        self.apt_index.update.assert_has_calls([call(3600), call(3600)])
+        self.filter_installed_packages.assert_called_with(
+            ['linux-headers-foobar', 'openvswitch-datapath-dkms'])
+        self.apt_install.assert_called_with(self.filter_installed_packages(),
+                                            fatal=True)
+        self.plan.apply.assert_called_once_with()
 
     @patch.object(nutils, 'use_hw_offload')
     @patch.object(nutils, 'enable_hw_offload')
@@ -198,14 +227,95 @@ class TestNeutronOVSUtils(CharmTestCase):
             ['openvswitch-datapath-dkms']
         self.headers_package.return_value = 'linux-headers-foobar'
         nutils.install_packages()
-        self.apt_update.assert_called_with()
-        self.apt_install.assert_has_calls([
-            call(['linux-headers-foobar',
-                  'openvswitch-datapath-dkms'], fatal=True),
-            call(self.filter_installed_packages(), fatal=True),
-        ])
+        # before the dkms packages and the plan, fresh for the latter
+        self.apt_index.update.assert_has_calls([call(3600), call(3600)])
+        self.filter_installed_packages.assert_called_with(
+            ['linux-headers-foobar', 'openvswitch-datapath-dkms'])
+        self.apt_install.assert_called_with(self.filter_installed_packages(),
+                                            fatal=True)
+        self.plan.apply.assert_called_once_with()
         _enable_hw_offload.assert_called_once_with()
 
+    @patch.object(nutils, 'enable_local_dhcp')
+    @patch.object(nutils, 'use_dvr')
+    @patch.object(nutils, 'determine_purge_packages')
+    @patch.object(nutils, 'determine_packages')
+    def test_package_plan_nodvr_nodhcp(self, _determine_packages,
+                                       _determine_purge_packages,
+                                       _use_dvr, _enable_local_dhcp):
+        _determine_packages.return_value = ['neutron-openvswitch-agent']
+        _determine_purge_packages.return_value = ['python-neutron']
+        _use_dvr.return_value = False
+        _enable_local_dhcp.return_value = False
+        self.is_container.return_value = False
+        self.assertEqual(nutils.package_plan(), self.plan)
+        self.PackagePlan.assert_called_once_with(
+            ['neutron-openvswitch-agent'],
+            ['python-neutron', 'neutron-l3-agent', 'libnetfilter-log1',
+             'keepalived', 'neutron-dhcp-agent', 'neutron-metadata-agent'])
+        # the plan is determined once per hook
+        nutils.package_plan()
+        self.PackagePlan.assert_called_once()
+
+    @patch.object(nutils, 'enable_local_dhcp')
+    @patch.object(nutils, 'use_dvr')
+    @patch.object(nutils, 'determine_purge_packages')
+    @patch.object(nutils, 'determine_packages')
+    def test_package_plan_dvr_nodhcp(self, _determine_packages,
+                                     _determine_purge_packages,
+                                     _use_dvr, _enable_local_dhcp):
+        _determine_packages.return_value = ['neutron-openvswitch-agent']
+        _determine_purge_packages.return_value = []
+        _use_dvr.return_value = True
+        _enable_local_dhcp.return_value = False
+        self.is_container.return_value = False
+        nutils.package_plan()
+        self.PackagePlan.assert_called_once_with(
+            ['neutron-openvswitch-agent'], ['neutron-dhcp-agent'])
+
+    @patch.object(nutils, 'enable_local_dhcp')
+    @patch.object(nutils, 'use_dvr')
+    @patch.object(nutils, 'determine_purge_packages')
+    @patch.object(nutils, 'determine_packages')
+    def test_package_plan_dvr_dhcp(self, _determine_packages,
+                                   _determine_purge_packages,
+                                   _use_dvr, _enable_local_dhcp):
+        _determine_packages.return_value = ['neutron-openvswitch-agent']
+        _determine_purge_packages.return_value = []
+        _use_dvr.return_value = True
+        _enable_local_dhcp.return_value = True
+        nutils.package_plan()
+        self.PackagePlan.assert_called_once_with(
+            ['neutron-openvswitch-agent'], [])
+
+    @patch.object(nutils, 'package_plan')
+    def test_apply_package_plan(self, _package_plan):
+        plan = _package_plan.return_value
+        plan.diff.return_value = (['neutron-openvswitch-agent'], [])
+        self.assertEqual(nutils.apply_package_plan(), plan.apply.return_value)
+        self.status_set.assert_called_once_with('maintenance',
+                                                'Installing packages')
+        self.apt_index.update.assert_called_once_with(3600)
+        plan.apply.assert_called_once_with()
+
+    @patch.object(nutils, 'package_plan')
+    def test_apply_package_plan_purge(self, _package_plan):
+        plan = _package_plan.return_value
+        plan.diff.return_value = ([], ['neutron-dhcp-agent'])
+        nutils.apply_package_plan()
+        self.status_set.assert_called_once_with('maintenance',
+                                                'Purging unused packages')
+        self.apt_index.update.assert_not_called()
+        plan.apply.assert_called_once_with()
+
+    @patch.object(nutils, 'package_plan')
+    def test_apply_package_plan_noop(self, _package_plan):
+        plan = _package_plan.return_value
+        plan.diff.return_value = ([], [])
+        nutils.apply_package_plan()
+        self.status_set.assert_not_called()
+        plan.apply.assert_called_once_with()
+
     @patch.object(nutils, 'use_l3ha')
     @patch.object(nutils, 'use_dvr')
     @patch.object(charmhelpers.contrib.openstack.neutron, 'os_release')
@@ -413,8 +523,9 @@ class TestNeutronOVSUtils(CharmTestCase):
         ]
         self.assertEqual(pkg_list, expect)
 
+    @patch.object(nutils.change_tracking, 'ChangeTrackingConfigRenderer')
     @patch.object(nutils, 'use_dvr')
-    def test_register_configs(self, _use_dvr):
+    def test_register_configs(self, _use_dvr, _renderer):
         class _mock_OSConfigRenderer():
             def __init__(self, templates_dir=None, openstack_release=None):
                 self.configs = []
@@ -427,7 +538,7 @@ class TestNeutronOVSUtils(CharmTestCase):
         _use_dvr.return_value = False
         self.os_release.return_value = 'icehouse'
         self.lsb_release.return_value = {'DISTRIB_CODENAME': 'precise'}
-        templating.OSConfigRenderer.side_effect = _mock_OSConfigRenderer
+        _renderer.side_effect = _mock_OSConfigRenderer
         _regconfs = nutils.register_configs()
         confs = ['/etc/neutron/neutron.conf',
                  '/etc/neutron/plugins/ml2/ml2_conf.ini',
@@ -435,8 +546,9 @@ class TestNeutronOVSUtils(CharmTestCase):
                  '/etc/init/os-charm-phy-nic-mtu.conf']
         self.assertEqual(_regconfs.configs, confs)
 
+    @patch.object(nutils.change_tracking, 'ChangeTrackingConfigRenderer')
     @patch.object(nutils, 'use_dvr')
-    def test_register_configs_mitaka(self, _use_dvr):
+    def test_register_configs_mitaka(self, _use_dvr, _renderer):
         class _mock_OSConfigRenderer():
             def __init__(self, templates_dir=None, openstack_release=None):
                 self.configs = []
@@ -449,7 +561,7 @@ class TestNeutronOVSUtils(CharmTestCase):
         _use_dvr.return_value = False
         self.os_release.return_value = 'mitaka'
         self.lsb_release.return_value = {'DISTRIB_CODENAME': 'trusty'}
-        templating.OSConfigRenderer.side_effect = _mock_OSConfigRenderer
+        _renderer.side_effect = _mock_OSConfigRenderer
         _regconfs = nutils.register_configs()
         confs = ['/etc/neutron/neutron.conf',
                  '/etc/neutron/plugins/ml2/openvswitch_agent.ini',
@@ -568,6 +680,53 @@ class TestNeutronOVSUtils(CharmTestCase):
         _map = nutils.resource_map()
         self.assertFalse(nutils.EXT_PORT_CONF in _map.keys())
 
+    @patch.object(nutils, 'deepcopy')
+    @patch.object(nutils, 'use_dvr')
+    def test_resource_map_cached(self, _use_dvr, _deepcopy):
+        _deepcopy.side_effect = deepcopy
+        _use_dvr.return_value = False
+        self.os_release.return_value = 'mitaka'
+        self.lsb_release.return_value = {'DISTRIB_CODENAME': 'xenial'}
+        _map = nutils.resource_map()
+        self.assertIs(nutils.resource_map(), _map)
+        self.assertEqual(nutils.restart_map(),
+                         {k: v['services'] for k, v in _map.items()})
+        self.assertEqual(_deepcopy.call_count, 1)
+        # a changed input builds a new map
+        _use_dvr.return_value = True
+        self.assertIn(nutils.NEUTRON_L3_AGENT_CONF, nutils.resource_map())
+        self.assertNotIn(nutils.NEUTRON_L3_AGENT_CONF, _map)
+        self.assertEqual(_deepcopy.call_count, 2)
+
+    @patch.object(nutils, 'sriov_netplan_shim_installed')
+    @patch.object(nutils, 'SRIOVContext_adapter')
+    @patch.object(nutils, 'enable_sriov')
+    @patch.object(nutils, 'use_dvr')
+    def test_resource_map_sriov_shim_late_init(self, _use_dvr, _enable_sriov,
+                                               _sriovcontext_adapter,
+                                               _shim_installed):
+        _use_dvr.return_value = False
+        _enable_sriov.return_value = True
+        _shim_installed.return_value = False
+        self.os_release.return_value = 'mitaka'
+        self.lsb_release.return_value = {'DISTRIB_CODENAME': 'xenial'}
+        _map = nutils.resource_map()
+        self.assertNotIn(nutils.SRIOV_NETPLAN_SHIM_CONF, _map)
+        _sriovcontext_adapter.assert_not_called()
+        # added once the package providing the context is installed, to a
+        # new map rather than the cached one
+        _shim_installed.return_value = True
+        self.assertIn(nutils.SRIOV_NETPLAN_SHIM_CONF, nutils.resource_map())
+        self.assertNotIn(nutils.SRIOV_NETPLAN_SHIM_CONF, _map)
+        self.assertIs(nutils.resource_map(), nutils.resource_map())
+        _sriovcontext_adapter.assert_called_once_with()
+        # not loaded by charmhelpers yet
+        _sriovcontext_adapter.side_effect = NameError
+        _enable_sriov.return_value = False
+        with patch.object(nutils, 'use_hw_offload', return_value=True):
+            self.assertNotIn(nutils.SRIOV_NETPLAN_SHIM_CONF,
+                             nutils.resource_map())
+
     @patch.object(nutils, 'use_l3ha')
     @patch.object(nutils, 'use_dpdk')
     @patch.object(nutils, 'use_dvr')
@@ -589,46 +748,49 @@ class TestNeutronOVSUtils(CharmTestCase):
             self.assertTrue(expect[item] == _restart_map[item])
         self.assertEqual(len(_restart_map.keys()), 3)
 
-    @patch('charmhelpers.contrib.openstack.context.list_nics',
-           return_value=['eth0'])
+    @patch.object(nic_inventory, 'inventory')
     @patch.object(nutils, 'use_dvr')
-    @patch('charmhelpers.contrib.openstack.context.config')
+    @patch.object(neutron_ovs_context, 'config')
     def test_configure_ovs_ovs_data_port(self, mock_config, _use_dvr, _nics):
         _use_dvr.return_value = False
         self.is_linuxbridge_interface.return_value = False
         mock_config.side_effect = self.test_config.get
         self.config.side_effect = self.test_config.get
-        _nics.return_value = ['eth0']
+        _nics.return_value = nic_inventory.NICInventory(
+            [nic_inventory.NIC('eth0', physical=True)])
         self.ExternalPortContext.return_value = \
             DummyContext(return_value=None)
         # Test back-compatibility i.e. port but no bridge (so br-data is
         # assumed)
         self.test_config.set('data-port', 'eth0')
         nutils.configure_ovs()
-        self.add_bridge.assert_has_calls([
-            call('br-int', 'system'),
-            call('br-ex', 'system'),
-            call('br-data', 'system')
+        self.desired.add_bridge.assert_has_calls([
+            call('br-int', 'system', None),
+            call('br-ex', 'system', None),
+            call('br-data', 'system', None)
         ])
-        self.assertTrue(self.add_bridge_port.called)
+        self.desired.add_port.assert_called_once_with(
+            'br-data', 'eth0', promisc=True)
+        self.ovs_state.reconcile.assert_called_once_with(
+            self.desired, self.ovs_state.OVSDBSnapshot.load())
+        self.ovs_state.reconcile().commit.assert_called_once_with()
 
         # Now test with bridge:port format
         self.test_config.set('data-port', 'br-foo:eth0')
-        self.add_bridge.reset_mock()
-        self.add_bridge_port.reset_mock()
+        self.desired.add_bridge.reset_mock()
+        self.desired.add_port.reset_mock()
         nutils.configure_ovs()
-        self.add_bridge.assert_has_calls([
-            call('br-int', 'system'),
-            call('br-ex', 'system'),
-            call('br-data', 'system')
+        self.desired.add_bridge.assert_has_calls([
+            call('br-int', 'system', None),
+            call('br-ex', 'system', None),
+            call('br-data', 'system', None)
         ])
         # Not called since we have a bogus bridge in data-ports
-        self.assertFalse(self.add_bridge_port.called)
+        self.assertFalse(self.desired.add_port.called)
 
-    @patch('charmhelpers.contrib.openstack.context.list_nics',
-           return_value=['eth0', 'br-juju'])
+    @patch.object(nic_inventory, 'inventory')
     @patch.object(nutils, 'use_dvr')
-    @patch('charmhelpers.contrib.openstack.context.config')
+    @patch.object(neutron_ovs_context, 'config')
     def test_configure_ovs_data_port_with_bridge(
             self, mock_config, _use_dvr, _nics):
         _use_dvr.return_value = False
@@ -641,14 +803,15 @@ class TestNeutronOVSUtils(CharmTestCase):
         # Now test with bridge:bridge format
         self.test_config.set('bridge-mappings', 'physnet1:br-foo')
         self.test_config.set('data-port', 'br-foo:br-juju')
-        _nics.return_value = ['br-juju']
-        self.add_bridge.reset_mock()
-        self.add_bridge_port.reset_mock()
+        _nics.return_value = nic_inventory.NICInventory(
+            [nic_inventory.NIC('br-juju')])
         nutils.configure_ovs()
-        self.assertTrue(self.add_ovsbridge_linuxbridge.called)
+        self.add_ovsbridge_linuxbridge.assert_called_once_with(
+            'br-foo', 'br-juju')
+        self.assertFalse(self.desired.add_port.called)
 
     @patch.object(nutils, 'use_dvr')
-    @patch('charmhelpers.contrib.openstack.context.config')
+    @patch.object(neutron_ovs_context, 'config')
     def test_configure_ovs_starts_service_if_required(self, mock_config,
                                                       _use_dvr):
         _use_dvr.return_value = False
@@ -659,7 +822,7 @@ class TestNeutronOVSUtils(CharmTestCase):
         self.assertTrue(self.full_restart.called)
 
     @patch.object(nutils, 'use_dvr')
-    @patch('charmhelpers.contrib.openstack.context.config')
+    @patch.object(neutron_ovs_context, 'config')
     def test_configure_ovs_doesnt_restart_service(self, mock_config, _use_dvr):
         _use_dvr.return_value = False
         mock_config.side_effect = self.test_config.get
@@ -669,7 +832,7 @@ class TestNeutronOVSUtils(CharmTestCase):
         self.assertFalse(self.full_restart.called)
 
     @patch.object(nutils, 'use_dvr')
-    @patch('charmhelpers.contrib.openstack.context.config')
+    @patch.object(neutron_ovs_context, 'config')
     def test_configure_ovs_ovs_ext_port(self, mock_config, _use_dvr):
         _use_dvr.return_value = True
         mock_config.side_effect = self.test_config.get
@@ -678,12 +841,42 @@ class TestNeutronOVSUtils(CharmTestCase):
         self.ExternalPortContext.return_value = \
             DummyContext(return_value={'ext_port': 'eth0'})
         nutils.configure_ovs()
-        self.add_bridge.assert_has_calls([
-            call('br-int', 'system'),
-            call('br-ex', 'system'),
-            call('br-data', 'system')
+        self.desired.add_bridge.assert_has_calls([
+            call('br-int', 'system', None),
+            call('br-ex', 'system', None),
+            call('br-data', 'system', None)
         ])
-        self.add_bridge_port.assert_called_with('br-ex', 'eth0')
+        self.desired.add_port.assert_called_with('br-ex', 'eth0',
+                                                 promisc=False)
+
+    @patch.object(neutron_ovs_context, 'resolve_dpdk_bonds')
+    @patch.object(neutron_ovs_context, 'resolve_dpdk_bridges')
+    @patch.object(nutils, 'use_dvr')
+    @patch.object(neutron_ovs_context, 'config')
+    def test_configure_ovs_dpdk_insufficient_hugepages(
+            self, mock_config, _use_dvr, _resolve_dpdk_bridges,
+            _resolve_dpdk_bonds):
+        _use_dvr.return_value = False
+        self.os_release.return_value = 'ussuri'
+        self.use_dpdk.return_value = True
+        self.ovs_has_late_dpdk_init.return_value = True
+        mock_config.side_effect = self.test_config.get
+        self.config.side_effect = self.test_config.get
+        self.test_config.set('enable-dpdk', True)
+        with patch.object(neutron_ovs_context,
+                          'OVSDPDKDeviceContext') as _dpdk_context:
+            _dpdk_context().hugepage_shortfall.return_value = {
+                0: (0, 1024)}
+            nutils.configure_ovs()
+        self.desired.add_bridge.assert_has_calls([
+            call('br-int', 'netdev', None),
+            call('br-ex', 'netdev', None)])
+        self.desired.set_open_vswitch.assert_not_called()
+        self.desired.add_port.assert_not_called()
+        self.desired.add_bond.assert_not_called()
+        _resolve_dpdk_bridges.assert_not_called()
+        _resolve_dpdk_bonds.assert_not_called()
+        self.ovs_state.reconcile().commit.assert_called_once_with()
 
     def _run_configure_ovs_dpdk(self, mock_config, _use_dvr,
                                 _resolve_dpdk_bridges, _resolve_dpdk_bonds,
@@ -722,79 +915,117 @@ class TestNeutronOVSUtils(CharmTestCase):
         mock_config.side_effect = self.test_config.get
         self.config.side_effect = self.test_config.get
         self.test_config.set('enable-dpdk', True)
-        nutils.configure_ovs()
-        self.add_bridge.assert_has_calls([
-            call('br-int', 'netdev'),
-            call('br-ex', 'netdev'),
-            call('br-phynet1', 'netdev'),
-            call('br-phynet2', 'netdev'),
-            call('br-phynet3', 'netdev')],
+        self.test_config.set('dpdk-rx-queues', 2)
+        db = MagicMock()
+        db.get.return_value = {}
+        with patch.object(nutils, 'kv', return_value=db), \
+                patch.object(neutron_ovs_context,
+                             'OVSDPDKDeviceContext') as _dpdk_context:
+            _dpdk_context().hugepage_shortfall.return_value = {}
+            _dpdk_context().pmd_cpu_mask.return_value = '0x0c'
+            _dpdk_context().rxq_affinity.side_effect = (
+                lambda pci_address: '0:2,1:3')
+            nutils.configure_ovs()
+        self.desired.set_open_vswitch.assert_called_once_with(
+            'other_config', {'pmd-cpu-mask': '0x0c'})
+        self.desired.add_bridge.assert_has_calls([
+            call('br-int', 'netdev', None),
+            call('br-ex', 'netdev', None),
+            call('br-phynet1', 'netdev', None),
+            call('br-phynet2', 'netdev', None),
+            call('br-phynet3', 'netdev', None)],
             any_order=True
         )
+
+        def _ifdata(pci_address):
+            ifdata = OrderedDict([('type', 'dpdk')])
+            ifdata['options'] = OrderedDict()
+            if _late_init:
+                ifdata['options']['dpdk-devargs'] = pci_address
+            ifdata['options']['n_rxq'] = 2
+            ifdata['mtu_request'] = 1500
+            ifdata['other_config'] = {'pmd-rxq-affinity': '0:2,1:3'}
+            return ifdata
+
         if _test_bonds:
-            self.dpdk_add_bridge_bond.assert_has_calls([
+            portdata = OrderedDict([
+                ('bond_mode', 'balance-tcp'),
+                ('lacp', 'active'),
+                ('other_config', {'lacp-time': 'fast'}),
+            ])
+            self.desired.add_bond.assert_has_calls([
                 call('br-phynet1', 'bond0',
                      {_resolve_port_name('0000:001c.01',
-                                         0, _late_init): '0000:001c.01'}),
+                                         0, _late_init):
+                      _ifdata('0000:001c.01')},
+                     portdata=portdata),
                 call('br-phynet2', 'bond1',
                      {_resolve_port_name('0000:001c.02',
-                                         1, _late_init): '0000:001c.02'}),
+                                         1, _late_init):
+                      _ifdata('0000:001c.02')},
+                     portdata=portdata),
                 call('br-phynet3', 'bond2',
                      {_resolve_port_name('0000:001c.03',
-                                         2, _late_init): '0000:001c.03'})],
+                                         2, _late_init):
+                      _ifdata('0000:001c.03')},
+                     portdata=portdata)],
                 any_order=True
             )
-            self.dpdk_set_bond_config.assert_has_calls([
-                call('bond0',
-                     {'mode': 'balance-tcp',
-                      'lacp': 'active',
-                      'lacp-time': 'fast'}),
-                call('bond1',
-                     {'mode': 'balance-tcp',
-                      'lacp': 'active',
-                      'lacp-time': 'fast'}),
-                call('bond2',
-                     {'mode': 'balance-tcp',
-                      'lacp': 'active',
-                      'lacp-time': 'fast'})],
-                any_order=True
-            )
-            self.dpdk_set_interfaces_mtu.assert_has_calls([
-                call(1500, {'dpdk-ac48d24': None}.keys()),
-                call(1500, {'dpdk-82c1c9e': None}.keys()),
-                call(1500, {'dpdk-aebdb4d': None}.keys())],
-                any_order=True)
+            self.assertEqual(
+                list(self.desired.add_bond.call_args_list[0][0][2].keys()),
+                ['dpdk-ac48d24'])
         else:
-            self.dpdk_add_bridge_port.assert_has_calls([
+            self.desired.add_port.assert_has_calls([
                 call('br-phynet1',
                      _resolve_port_name('0000:001c.01',
                                         0, _late_init),
-                     '0000:001c.01'),
+                     ifdata=_ifdata('0000:001c.01'),
+                     linkup=False),
                 call('br-phynet2',
                      _resolve_port_name('0000:001c.02',
                                         1, _late_init),
-                     '0000:001c.02'),
+                     ifdata=_ifdata('0000:001c.02'),
+                     linkup=False),
                 call('br-phynet3',
                      _resolve_port_name('0000:001c.03',
                                         2, _late_init),
-                     '0000:001c.03')],
+                     ifdata=_ifdata('0000:001c.03'),
+                     linkup=False)],
                 any_order=True
             )
-            self.dpdk_set_mtu_request.assert_has_calls([
-                call(_resolve_port_name('0000:001c.01',
-                                        0, _late_init), 1500),
-                call(_resolve_port_name('0000:001c.02',
-                                        1, _late_init), 1500),
-                call(_resolve_port_name('0000:001c.03',
-                                        2, _late_init), 1500)],
-                any_order=True)
+        self.ovs_state.reconcile().commit.assert_called_once_with()
+        pci_addresses = ['0000:001c.01', '0000:001c.02', '0000:001c.03']
+        # the keys set by the charm are recorded once committed
+        managed_keys = call(nutils.OVS_MANAGED_KEYS, sorted(
+            ['Open_vSwitch:pmd-cpu-mask'] +
+            ['options:{}:n_rxq'.format(pci_address)
+             for pci_address in pci_addresses] +
+            ['other_config:{}:pmd-rxq-affinity'.format(pci_address)
+             for pci_address in pci_addresses]))
+        if _late_init:
+            # port names are recorded in one transaction
+            self.assertEqual(db.set.call_args_list, [
+                call(nutils.DPDK_PORTS_KEY, {
+                    pci_address: {
+                        'name': _resolve_port_name(pci_address, 0,
+                                                   _late_init),
+                        'bridge': 'br-phynet{}'.format(n),
+                        'bond': ('bond{}'.format(n - 1) if _test_bonds
+                                 else None),
+                    }
+                    for n, pci_address in enumerate(pci_addresses, start=1)
+                }),
+                managed_keys,
+            ])
+        else:
+            self.assertEqual(db.set.call_args_list, [managed_keys])
 
     @patch.object(nutils, 'use_hw_offload', return_value=False)
     @patch.object(neutron_ovs_context, 'NeutronAPIContext')
     @patch.object(neutron_ovs_context, 'resolve_dpdk_bonds')
     @patch.object(neutron_ovs_context, 'resolve_dpdk_bridges')
     @patch.object(nutils, 'use_dvr')
-    @patch('charmhelpers.contrib.openstack.context.config')
+    @patch.object(neutron_ovs_context, 'config')
     def test_configure_ovs_dpdk(self, mock_config, _use_dvr,
                                 _resolve_dpdk_bridges,
                                 _resolve_dpdk_bonds,
@@ -813,7 +1044,7 @@ class TestNeutronOVSUtils(CharmTestCase):
     @patch.object(neutron_ovs_context, 'resolve_dpdk_bonds')
     @patch.object(neutron_ovs_context, 'resolve_dpdk_bridges')
     @patch.object(nutils, 'use_dvr')
-    @patch('charmhelpers.contrib.openstack.context.config')
+    @patch.object(neutron_ovs_context, 'config')
     def test_configure_ovs_dpdk_late_init(self, mock_config, _use_dvr,
                                           _resolve_dpdk_bridges,
                                           _resolve_dpdk_bonds,
@@ -832,7 +1063,7 @@ class TestNeutronOVSUtils(CharmTestCase):
     @patch.object(neutron_ovs_context, 'resolve_dpdk_bonds')
     @patch.object(neutron_ovs_context, 'resolve_dpdk_bridges')
     @patch.object(nutils, 'use_dvr')
-    @patch('charmhelpers.contrib.openstack.context.config')
+    @patch.object(neutron_ovs_context, 'config')
     def test_configure_ovs_dpdk_late_init_bonds(self, mock_config, _use_dvr,
                                                 _resolve_dpdk_bridges,
                                                 _resolve_dpdk_bonds,
@@ -847,16 +1078,16 @@ class TestNeutronOVSUtils(CharmTestCase):
                                             _test_bonds=True)
 
     @patch.object(nutils, 'use_dvr')
-    @patch('charmhelpers.contrib.openstack.context.config')
+    @patch.object(neutron_ovs_context, 'config')
     def test_configure_ovs_enable_ipfix(self, mock_config, mock_use_dvr):
         mock_use_dvr.return_value = False
         mock_config.side_effect = self.test_config.get
         self.config.side_effect = self.test_config.get
         self.test_config.set('ipfix-target', '127.0.0.1:80')
         nutils.configure_ovs()
-        self.enable_ipfix.assert_has_calls([
-            call('br-int', '127.0.0.1:80'),
-            call('br-ex', '127.0.0.1:80'),
+        self.desired.add_bridge.assert_has_calls([
+            call('br-int', 'system', '127.0.0.1:80'),
+            call('br-ex', 'system', '127.0.0.1:80'),
         ])
 
     @patch.object(neutron_ovs_context, 'SharedSecretContext')
@@ -865,7 +1096,9 @@ class TestNeutronOVSUtils(CharmTestCase):
             DummyContext(return_value={'shared_secret': 'supersecret'})
         self.assertEqual(nutils.get_shared_secret(), 'supersecret')
 
-    def test_assess_status(self):
+    @patch.object(nutils, 'services')
+    @patch.object(nutils.status_fingerprint, 'record')
+    def test_assess_status(self, record, services):
         with patch.object(nutils, 'assess_status_func') as asf:
             callee = MagicMock()
             asf.return_value = callee
@@ -875,6 +1108,8 @@ class TestNeutronOVSUtils(CharmTestCase):
             self.os_application_version_set.assert_called_with(
                 nutils.VERSION_PACKAGE
             )
+            services.assert_called_once_with(['openvswitch-switch'])
+            record.assert_called_once_with(services.return_value)
 
     @patch.object(nutils, 'REQUIRED_INTERFACES')
     @patch.object(nutils, 'services')
@@ -896,7 +1131,7 @@ class TestNeutronOVSUtils(CharmTestCase):
         make_assess_status_func.assert_called_once_with(
             'test-config',
             {'Test': True},
-            charm_func=nutils.validate_ovs_use_veth,
+            charm_func=nutils.check_charm_status,
             services='s1',
             ports=None)
 
@@ -910,9 +1145,11 @@ class TestNeutronOVSUtils(CharmTestCase):
             prh.assert_called_once_with(nutils.resume_unit,
                                         'random-config', [])
 
+    @patch.object(nutils.service_state, 'manage_services')
     @patch.object(nutils, 'services')
     @patch.object(nutils, 'determine_ports')
-    def test_pause_resume_helper(self, determine_ports, services):
+    def test_pause_resume_helper(self, determine_ports, services,
+                                 manage_services):
         f = MagicMock()
         services.return_value = 's1'
         determine_ports.return_value = 'p1'
@@ -921,7 +1158,30 @@ class TestNeutronOVSUtils(CharmTestCase):
             nutils._pause_resume_helper(f, 'some-config')
             asf.assert_called_once_with('some-config', [])
             # ports=None whilst port checks are disabled.
-            f.assert_called_once_with('assessor', services='s1', ports=None)
+            f.assert_called_once_with('assessor', services=None, ports=None,
+                                      charm_func=ANY)
+        # services are resumed by the charm_func, concurrently
+        charm_func = f.call_args[1]['charm_func']
+        manage_services.return_value = []
+        self.assertIsNone(charm_func())
+        manage_services.assert_called_once_with(
+            'resume', 's1', max_workers=nutils.SERVICE_WORKERS)
+        manage_services.return_value = ["a didn't resume cleanly.",
+                                        "b didn't resume cleanly."]
+        self.assertEqual(charm_func(), "a didn't resume cleanly.; "
+                                       "b didn't resume cleanly.")
+
+    @patch.object(nutils.service_state, 'manage_services')
+    @patch.object(nutils, 'services')
+    def test_pause_helper_action(self, services, manage_services):
+        services.return_value = ['s1']
+        manage_services.return_value = []
+        with patch.object(nutils, 'assess_status_func'), \
+                patch.object(nutils, 'pause_unit') as pause_unit:
+            nutils.pause_unit_helper('some-config')
+            pause_unit.call_args[1]['charm_func']()
+        manage_services.assert_called_once_with(
+            'pause', ['s1'], max_workers=nutils.SERVICE_WORKERS)
 
     @patch.object(nutils, 'subprocess')
     @patch.object(nutils, 'shutil')
@@ -957,6 +1217,8 @@ class TestNeutronOVSUtils(CharmTestCase):
         mock_context = MagicMock()
         mock_context.cpu_mask.return_value = '0x03'
         mock_context.socket_memory.return_value = '4096,4096'
+        mock_context.socket_limit.return_value = '4096,4096'
+        mock_context.hugepage_shortfall.return_value = {}
         mock_context.pci_whitelist.return_value = \
             '--pci-whitelist 00:0300:01'
         _OVSDPDKDeviceContext.return_value = mock_context
@@ -964,10 +1226,11 @@ class TestNeutronOVSUtils(CharmTestCase):
         self.ovs_has_late_dpdk_init.return_value = True
         self.ovs_vhostuser_client.return_value = False
         _is_unit_paused_set.return_value = False
-        nutils.enable_ovs_dpdk()
+        self.assertTrue(nutils.enable_ovs_dpdk())
         _set_Open_vSwitch_column_value.assert_has_calls([
             call('other_config:dpdk-lcore-mask', '0x03'),
             call('other_config:dpdk-socket-mem', '4096,4096'),
+            call('other_config:dpdk-socket-limit', '4096,4096'),
             call('other_config:dpdk-init', 'true'),
             call('other_config:dpdk-extra',
                  '--vhost-owner libvirt-qemu:kvm --vhost-perm 0660 '
@@ -976,7 +1239,7 @@ class TestNeutronOVSUtils(CharmTestCase):
         _check_call.assert_called_once_with(
             nutils.UPDATE_ALTERNATIVES + [nutils.OVS_DPDK_BIN]
         )
-        self.service_restart.assert_called_with('openvswitch-switch')
+        self.request_restart.assert_called_with('openvswitch-switch')
 
     @patch.object(nutils, 'is_unit_paused_set')
     @patch.object(nutils.subprocess, 'check_call')
@@ -991,6 +1254,8 @@ class TestNeutronOVSUtils(CharmTestCase):
         mock_context = MagicMock()
         mock_context.cpu_mask.return_value = '0x03'
         mock_context.socket_memory.return_value = '4096,4096'
+        mock_context.socket_limit.return_value = '4096,4096'
+        mock_context.hugepage_shortfall.return_value = {}
         mock_context.pci_whitelist.return_value = \
             '--pci-whitelist 00:0300:01'
         _OVSDPDKDeviceContext.return_value = mock_context
@@ -1002,6 +1267,7 @@ class TestNeutronOVSUtils(CharmTestCase):
         _set_Open_vSwitch_column_value.assert_has_calls([
             call('other_config:dpdk-lcore-mask', '0x03'),
             call('other_config:dpdk-socket-mem', '4096,4096'),
+            call('other_config:dpdk-socket-limit', '4096,4096'),
             call('other_config:dpdk-init', 'true'),
             call('other_config:dpdk-extra',
                  '--pci-whitelist 00:0300:01')
@@ -1009,9 +1275,49 @@ class TestNeutronOVSUtils(CharmTestCase):
         _check_call.assert_called_once_with(
             nutils.UPDATE_ALTERNATIVES + [nutils.OVS_DPDK_BIN]
         )
-        self.service_restart.assert_called_with('openvswitch-switch')
+        self.request_restart.assert_called_with('openvswitch-switch')
 
-    @patch.object(nutils.context, 'NeutronAPIContext')
+    @patch.object(nutils.subprocess, 'check_call')
+    @patch.object(neutron_ovs_context, 'OVSDPDKDeviceContext')
+    @patch.object(nutils, 'set_Open_vSwitch_column_value')
+    def test_enable_ovs_dpdk_insufficient_hugepages(
+            self,
+            _set_Open_vSwitch_column_value,
+            _OVSDPDKDeviceContext,
+            _check_call):
+        self.use_dpdk.return_value = True
+        _OVSDPDKDeviceContext().hugepage_shortfall.return_value = (
+            OrderedDict([(0, (512, 1024)), (1, (0, 1024))]))
+        self.assertFalse(nutils.enable_ovs_dpdk())
+        self.status_set.assert_called_once_with(
+            'blocked',
+            'Insufficient hugepages for dpdk-socket-memory: '
+            'node0 has 512MB of 1024MB, node1 has 0MB of 1024MB')
+        _check_call.assert_not_called()
+        _set_Open_vSwitch_column_value.assert_not_called()
+        self.request_restart.assert_not_called()
+
+    @patch.object(nutils, 'validate_ovs_use_veth')
+    @patch.object(neutron_ovs_context, 'OVSDPDKDeviceContext')
+    def test_check_charm_status(self, _OVSDPDKDeviceContext,
+                                _validate_ovs_use_veth):
+        _validate_ovs_use_veth.return_value = (None, None)
+        _OVSDPDKDeviceContext().hugepage_shortfall.return_value = {
+            0: (0, 1024)}
+        self.use_dpdk.return_value = False
+        self.assertEqual(nutils.check_charm_status('configs'), (None, None))
+        self.use_dpdk.return_value = True
+        self.assertEqual(
+            nutils.check_charm_status('configs'),
+            ('blocked', 'Insufficient hugepages for dpdk-socket-memory: '
+                        'node0 has 0MB of 1024MB'))
+        _OVSDPDKDeviceContext().hugepage_shortfall.return_value = {}
+        self.assertEqual(nutils.check_charm_status('configs'), (None, None))
+        _validate_ovs_use_veth.return_value = ('blocked', 'ovs_use_veth')
+        self.assertEqual(nutils.check_charm_status('configs'),
+                         ('blocked', 'ovs_use_veth'))
+
+    @patch.object(nutils.neutron_ovs_context, 'NeutronAPIContext')
     @patch.object(nutils, 'is_container')
     def test_use_dvr(self, _is_container, _NeutronAPIContext):
         _is_container.return_value = False
@@ -1020,7 +1326,7 @@ class TestNeutronOVSUtils(CharmTestCase):
         _is_container.return_value = True
         self.assertEquals(nutils.use_dvr(), False)
 
-    @patch.object(nutils.context, 'NeutronAPIContext')
+    @patch.object(nutils.neutron_ovs_context, 'NeutronAPIContext')
     @patch.object(nutils, 'is_container')
     def test_use_l3ha(self, _is_container, _NeutronAPIContext):
         _is_container.return_value = False
@@ -1029,7 +1335,7 @@ class TestNeutronOVSUtils(CharmTestCase):
         _is_container.return_value = True
         self.assertEquals(nutils.use_l3ha(), False)
 
-    @patch.object(nutils.context, 'NeutronAPIContext')
+    @patch.object(nutils.neutron_ovs_context, 'NeutronAPIContext')
     @patch.object(nutils, 'is_container')
     def test_enable_nova_metadata(self, _is_container, _NeutronAPIContext):
         _is_container.return_value = False
@@ -1078,7 +1384,7 @@ class TestNeutronOVSUtils(CharmTestCase):
             call('other_config:hw-offload', 'true'),
             call('other_config:max-idle', '30000'),
         ])
-        self.service_restart.assert_called_once_with('openvswitch-switch')
+        self.request_restart.assert_called_once_with('openvswitch-switch')
 
     @patch.object(nutils, 'set_Open_vSwitch_column_value')
     def test_enable_hw_offload_unit_paused(self, _ovs_set):
@@ -1089,7 +1395,7 @@ class TestNeutronOVSUtils(CharmTestCase):
             call('other_config:hw-offload', 'true'),
             call('other_config:max-idle', '30000'),
         ])
-        self.service_restart.assert_not_called()
+        self.request_restart.assert_not_called()
 
     @patch.object(nutils, 'set_Open_vSwitch_column_value')
     def test_enable_hw_offload_no_changes(self, _ovs_set):
@@ -1100,7 +1406,7 @@ class TestNeutronOVSUtils(CharmTestCase):
             call('other_config:hw-offload', 'true'),
             call('other_config:max-idle', '30000'),
         ])
-        self.service_restart.assert_not_called()
+        self.request_restart.assert_not_called()
 
 
 class TestDPDKBridgeBondMap(CharmTestCase):
@@ -1133,6 +1439,78 @@ class TestDPDKBridgeBondMap(CharmTestCase):
         self.assertEqual(ctx.items(), expected)
 
 
+class TestDPDKPortNames(CharmTestCase):
+
+    def setUp(self):
+        super(TestDPDKPortNames, self).setUp(nutils, ['kv', 'log'])
+        self.db = MagicMock()
+        self.db.get.return_value = {}
+        self.kv.return_value = self.db
+
+    def test_get_port_name(self):
+        port_names = nutils.DPDKPortNames()
+        self.assertEqual(
+            port_names.get_port_name('0000:001c.01', 'br-data'),
+            'dpdk-ac48d24')
+        self.assertEqual(
+            port_names.get_port_name('0000:001c.01', 'br-data'),
+            'dpdk-ac48d24')
+        port_names.save()
+        self.db.set.assert_called_once_with(nutils.DPDK_PORTS_KEY, {
+            '0000:001c.01': {'name': 'dpdk-ac48d24', 'bridge': 'br-data',
+                             'bond': None}})
+        self.db.flush.assert_called_once_with()
+        self.db.set.reset_mock()
+        port_names.save()
+        self.db.set.assert_not_called()
+
+    def test_get_port_name_recorded(self):
+        self.db.get.return_value = {
+            '0000:001c.01': {'name': 'dpdk-0', 'bridge': 'br-data',
+                             'bond': 'bond0'}}
+        port_names = nutils.DPDKPortNames()
+        self.assertEqual(
+            port_names.get_port_name('0000:001c.01', 'br-data', 'bond0'),
+            'dpdk-0')
+        port_names.save()
+        self.db.set.assert_not_called()
+        # moving the device to another bridge keeps its name
+        self.assertEqual(
+            port_names.get_port_name('0000:001c.01', 'br-ex'), 'dpdk-0')
+        self.assertEqual(port_names.ports['0000:001c.01']['bridge'], 'br-ex')
+        self.assertTrue(port_names.changed)
+
+    def test_get_port_name_collision(self):
+        self.db.get.return_value = {
+            '0000:001c.02': {'name': 'dpdk-ac48d24', 'bridge': 'br-data',
+                             'bond': None}}
+        port_names = nutils.DPDKPortNames()
+        self.assertEqual(
+            port_names.get_port_name('0000:001c.01', 'br-data'),
+            'dpdk-ac48d24{}'.format(
+                hashlib.sha1(b'0000:001c.01').hexdigest()[7]))
+        self.assertTrue(self.log.called)
+
+    def test_prune(self):
+        self.db.get.return_value = {
+            '0000:001c.01': {'name': 'dpdk-0', 'bridge': 'br-data',
+                             'bond': None},
+            '0000:001c.02': {'name': 'dpdk-1', 'bridge': 'br-data',
+                             'bond': None}}
+        port_names = nutils.DPDKPortNames()
+        port_names.prune(['0000:001c.01', '0000:001c.02'])
+        self.assertFalse(port_names.changed)
+        port_names.prune(['0000:001c.01'])
+        port_names.save()
+        self.db.set.assert_called_once_with(nutils.DPDK_PORTS_KEY, {
+            '0000:001c.01': {'name': 'dpdk-0', 'bridge': 'br-data',
+                             'bond': None}})
+
+    def test_dpdk_port_names_cached(self):
+        self.assertIs(nutils.dpdk_port_names(), nutils.dpdk_port_names())
+        self.db.get.assert_called_once_with(nutils.DPDK_PORTS_KEY, {})
+
+
 class TestDPDKBondsConfig(CharmTestCase):
 
     def setUp(self):
@@ -1156,21 +1534,77 @@ class TestDPDKBondsConfig(CharmTestCase):
                           })
 
 
-class TestMTURequest(CharmTestCase):
+class TestManagedOVSKeys(CharmTestCase):
 
     def setUp(self):
-        super(TestMTURequest, self).setUp(nutils, [])
+        super(TestManagedOVSKeys, self).setUp(nutils, [])
+
+    def test_declare(self):
+        managed_keys = nutils.ManagedOVSKeys()
+        # not configured and not set by the charm, left as is
+        self.assertEqual(
+            managed_keys.declare('Open_vSwitch', {'pmd-cpu-mask': None}), {})
+        self.assertFalse(managed_keys.changed)
+        self.assertEqual(
+            managed_keys.declare('Open_vSwitch', {'pmd-cpu-mask': '0x0c'}),
+            {'pmd-cpu-mask': '0x0c'})
+        managed_keys.save()
+        self.assertEqual(nutils.kv().get(nutils.OVS_MANAGED_KEYS),
+                         ['Open_vSwitch:pmd-cpu-mask'])
+        # the next hook removes the key set by the charm once unset
+        managed_keys = nutils.ManagedOVSKeys()
+        self.assertEqual(
+            managed_keys.declare('Open_vSwitch', {'pmd-cpu-mask': None}),
+            {'pmd-cpu-mask': None})
+        managed_keys.save()
+        self.assertEqual(nutils.kv().get(nutils.OVS_MANAGED_KEYS), [])
+        self.assertEqual(
+            nutils.ManagedOVSKeys().declare('Open_vSwitch',
+                                            {'pmd-cpu-mask': None}),
+            {})
+
+
+class TestDPDKColumnData(CharmTestCase):
 
-    @patch.object(nutils, 'subprocess')
-    def test_dpdk_set_mtu_request(self, mock_subprocess):
-        nutils.dpdk_set_mtu_request("dpdk1", 9000)
-        mock_subprocess.check_call.assert_called_once_with(
-            ['ovs-vsctl', 'set', 'Interface', 'dpdk1', 'mtu_request=9000'])
-
-    @patch.object(nutils, 'dpdk_set_mtu_request')
-    def test_dpdk_set_interfaces_mtu(self, mock_dpdk_set_mtu_request):
-        nutils.dpdk_set_interfaces_mtu('1234', ['nic1', 'nic2'])
-        expected_calls = [
-            call('nic1', '1234'),
-            call('nic2', '1234')]
-        mock_dpdk_set_mtu_request.assert_has_calls(expected_calls)
+    def setUp(self):
+        super(TestDPDKColumnData, self).setUp(nutils,
+                                              ['ovs_has_late_dpdk_init'])
+
+    def test_dpdk_interface_data(self):
+        self.ovs_has_late_dpdk_init.return_value = True
+        self.assertEqual(
+            nutils.dpdk_interface_data('0000:01:00.0', 9000),
+            {'type': 'dpdk',
+             'options': {'dpdk-devargs': '0000:01:00.0'},
+             'mtu_request': 9000,
+             'other_config': {}})
+        self.assertEqual(
+            nutils.dpdk_interface_data('0000:01:00.0', 9000, n_rxq=2,
+                                       rxq_affinity='0:2,1:3'),
+            {'type': 'dpdk',
+             'options': {'dpdk-devargs': '0000:01:00.0', 'n_rxq': 2},
+             'mtu_request': 9000,
+             'other_config': {'pmd-rxq-affinity': '0:2,1:3'}})
+        # set by the charm before, so removed once unset
+        self.assertEqual(
+            nutils.dpdk_interface_data('0000:01:00.0', 9000),
+            {'type': 'dpdk',
+             'options': {'dpdk-devargs': '0000:01:00.0', 'n_rxq': None},
+             'mtu_request': 9000,
+             'other_config': {'pmd-rxq-affinity': None}})
+
+    def test_dpdk_interface_data_early_init(self):
+        self.ovs_has_late_dpdk_init.return_value = False
+        self.assertEqual(
+            nutils.dpdk_interface_data('0000:01:00.0', 9000),
+            {'type': 'dpdk', 'options': {}, 'mtu_request': 9000,
+             'other_config': {}})
+
+    def test_dpdk_bond_data(self):
+        self.assertEqual(
+            nutils.dpdk_bond_data({'mode': 'active-backup',
+                                   'lacp': 'off',
+                                   'lacp-time': 'slow'}),
+            {'bond_mode': 'active-backup',
+             'lacp': 'off',
+             'other_config': {'lacp-time': 'slow'}})
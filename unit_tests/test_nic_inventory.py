@@ -0,0 +1,121 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+import nic_inventory
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'get_ipv4_addr',
+    'get_ipv6_addr',
+    'log',
+]
+
+# name -> (device directory under /sys/devices, ifindex, type, address)
+DEVICES = {
+    'lo': ('virtual/net/lo', 1, '772', '00:00:00:00:00:00'),
+    'eth0': ('pci0000:00/0000:00:03.0/net/eth0', 2, '1',
+             'aa:aa:aa:aa:aa:aa'),
+    'eth1': ('pci0000:00/0000:00:04.0/net/eth1', 3, '1',
+             'bb:bb:bb:bb:bb:bb'),
+    'eth2': ('pci0000:00/0000:00:05.0/net/eth2', 4, '1',
+             'cc:cc:cc:cc:cc:cc'),
+    'eth3': ('pci0000:00/0000:00:06.0/net/eth3', 5, '1',
+             'dd:dd:dd:dd:dd:dd'),
+    'bond0': ('virtual/net/bond0', 6, '1', 'bb:bb:bb:bb:bb:bb'),
+    'br-juju': ('virtual/net/br-juju', 7, '1', 'cc:cc:cc:cc:cc:cc'),
+}
+
+MASTERS = {
+    'eth1': 'bond0',
+    'eth2': 'br-juju',
+}
+
+
+class TestNICInventory(CharmTestCase):
+
+    def setUp(self):
+        super(TestNICInventory, self).setUp(nic_inventory, TO_PATCH)
+        self.sysfs = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.sysfs)
+        self.sys_net = os.path.join(self.sysfs, 'class', 'net')
+        os.makedirs(self.sys_net)
+        for name, (device, ifindex, _type, address) in DEVICES.items():
+            path = os.path.join(self.sysfs, 'devices', device)
+            os.makedirs(path)
+            for attr, value in (('ifindex', ifindex), ('type', _type),
+                                ('address', address)):
+                with open(os.path.join(path, attr), 'w') as f:
+                    f.write('{}\n'.format(value))
+            os.symlink(path, os.path.join(self.sys_net, name))
+        os.mkdir(os.path.join(self.sys_net, 'bond0', 'bonding'))
+        os.mkdir(os.path.join(self.sys_net, 'br-juju', 'bridge'))
+        for name, master in MASTERS.items():
+            os.symlink(os.path.join(self.sys_net, master),
+                       os.path.join(self.sys_net, name, 'master'))
+        with open(os.path.join(self.sys_net, 'bonding_masters'), 'w') as f:
+            f.write('bond0\n')
+        self.addresses = {'eth3': ['10.0.0.10']}
+        self.get_ipv4_addr.side_effect = (
+            lambda nic, fatal: list(self.addresses.get(nic, [])))
+        self.get_ipv6_addr.return_value = []
+        self.inventory = nic_inventory.NICInventory.load(self.sys_net)
+
+    def test_load(self):
+        self.assertEqual(list(self.inventory.nics),
+                         ['lo', 'eth0', 'eth1', 'eth2', 'eth3', 'bond0',
+                          'br-juju'])
+        lo = self.inventory.nics['lo']
+        self.assertFalse(lo.physical)
+        self.assertEqual(lo.hwaddr, '')
+        eth1 = self.inventory.nics['eth1']
+        self.assertTrue(eth1.physical)
+        self.assertEqual(eth1.hwaddr, 'bb:bb:bb:bb:bb:bb')
+        self.assertEqual(eth1.bond_master, 'bond0')
+        self.assertIsNone(eth1.bridge)
+        eth2 = self.inventory.nics['eth2']
+        self.assertIsNone(eth2.bond_master)
+        self.assertEqual(eth2.bridge, 'br-juju')
+
+    def test_load_missing(self):
+        inventory = nic_inventory.NICInventory.load(
+            os.path.join(self.sysfs, 'missing'))
+        self.assertEqual(inventory.nics, {})
+
+    def test_get_nic_hwaddr(self):
+        self.assertEqual(self.inventory.get_nic_hwaddr('eth0'),
+                         'aa:aa:aa:aa:aa:aa')
+        self.assertEqual(self.inventory.get_nic_hwaddr('eth9'), '')
+
+    def test_resolve_ports(self):
+        self.assertIsNone(self.inventory.resolve_ports([]))
+        self.assertEqual(
+            self.inventory.resolve_ports(['aa:aa:aa:aa:aa:aa']), ['eth0'])
+        # bond slaves resolve to their bond
+        self.assertEqual(
+            self.inventory.resolve_ports(['bb:bb:bb:bb:bb:bb']), ['bond0'])
+        # bridge members and interfaces with addresses are in use
+        self.assertEqual(
+            self.inventory.resolve_ports(['cc:cc:cc:cc:cc:cc',
+                                          'dd:dd:dd:dd:dd:dd',
+                                          'ee:ee:ee:ee:ee:ee']), [])
+        # names of existing interfaces are trusted
+        self.assertEqual(
+            sorted(self.inventory.resolve_ports(['eth3', 'br-juju',
+                                                 'eth9'])),
+            ['br-juju', 'eth3'])
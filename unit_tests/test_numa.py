@@ -0,0 +1,144 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+import numa
+
+from test_utils import CharmTestCase
+
+TEST_CPULIST_1 = "0-3"
+TEST_CPULIST_2 = "0-7,16-23"
+TEST_CPULIST_3 = "0,4,8,12,16,20,24"
+
+
+class TestCPULists(CharmTestCase):
+
+    def setUp(self):
+        super(TestCPULists, self).setUp(numa, [])
+
+    def test_cpu_list_to_mask(self):
+        for cpulist, cores in (
+                (TEST_CPULIST_1, [0, 1, 2, 3]),
+                (TEST_CPULIST_2, [0, 1, 2, 3, 4, 5, 6, 7,
+                                  16, 17, 18, 19, 20, 21, 22, 23]),
+                (TEST_CPULIST_3, [0, 4, 8, 12, 16, 20, 24])):
+            mask = numa.cpu_list_to_mask(cpulist)
+            self.assertEqual(mask, sum(1 << core for core in cores))
+            self.assertEqual(numa.mask_to_cpu_list(mask), cores)
+        self.assertEqual(numa.cpu_list_to_mask(''), 0)
+
+    def test_large_masks(self):
+        mask = numa.cpu_list_to_mask('0-255,512-767')
+        self.assertEqual(bin(mask).count('1'), 512)
+        self.assertEqual(numa.lowest_cpus(mask, 2, skip=255),
+                         1 << 255 | 1 << 512)
+        self.assertEqual(numa.format_mask(numa.lowest_cpus(mask >> 512, 1)),
+                         '0x01')
+        self.assertEqual(numa.lowest_cpus(0b1010, 4), 0b1010)
+
+
+class TestNUMATopology(CharmTestCase):
+
+    def setUp(self):
+        super(TestNUMATopology, self).setUp(numa, [])
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.node_dir = os.path.join(self.tmpdir, 'node')
+        self.pci_dir = os.path.join(self.tmpdir, 'pci')
+        self._node(0, '0-3,8-11', 32768000, {2048: (1024, 512)})
+        self._node(1, '4-7,12-15', 16384000, {2048: (512, 512),
+                                              1048576: (2, 1)})
+        os.makedirs(os.path.join(self.node_dir, 'possible'))
+        self._device('0000:00:1c.0', '1')
+        self._device('0000:00:1d.0', '-1')
+
+    def _write(self, path, data):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def _node(self, index, cpulist, mem_total_kb, hugepages):
+        path = os.path.join(self.node_dir, 'node{}'.format(index))
+        self._write(os.path.join(path, 'cpulist'), cpulist + '\n')
+        self._write(os.path.join(path, 'meminfo'),
+                    'Node {0} MemTotal:       {1} kB\n'
+                    'Node {0} MemFree:        1024 kB\n'
+                    .format(index, mem_total_kb))
+        for size_kb, (total, free) in hugepages.items():
+            size_dir = os.path.join(path, 'hugepages',
+                                    'hugepages-{}kB'.format(size_kb))
+            self._write(os.path.join(size_dir, 'nr_hugepages'),
+                        '{}\n'.format(total))
+            self._write(os.path.join(size_dir, 'free_hugepages'),
+                        '{}\n'.format(free))
+
+    def _device(self, pci_address, numa_node):
+        self._write(os.path.join(self.pci_dir, pci_address, 'numa_node'),
+                    numa_node + '\n')
+
+    def _load(self):
+        return numa.NUMATopology.load(
+            ['0000:00:1c.0', '0000:00:1d.0', '0000:00:1e.0'],
+            node_dir=self.node_dir, pci_dir=self.pci_dir)
+
+    def test_load(self):
+        topology = self._load()
+        self.assertEqual(list(topology.nodes), [0, 1])
+        node0, node1 = topology.nodes.values()
+        self.assertEqual(node0.cpus, [0, 1, 2, 3, 8, 9, 10, 11])
+        self.assertEqual(node1.cpu_mask, 0xf0f0)
+        self.assertEqual(node0.mem_total_kb, 32768000)
+        self.assertEqual(node0.hugepages_mb(), 2048)
+        self.assertEqual(node1.hugepages_mb(), 3072)
+        self.assertEqual(node1.hugepages_mb(free=True), 2048)
+        self.assertEqual(topology.device_nodes, {
+            '0000:00:1c.0': 1,
+            '0000:00:1d.0': None,
+            '0000:00:1e.0': None,
+        })
+
+    def test_masks(self):
+        topology = self._load()
+        self.assertEqual(numa.format_mask(topology.lcore_mask(1)), '0x11')
+        self.assertEqual(numa.format_mask(topology.lcore_mask(2)), '0x33')
+        self.assertEqual(topology.pmd_mask(2, skip=1), 0x66)
+        self.assertEqual(topology.pmd_mask(2, nodes=[1], skip=3), 0x1080)
+        self.assertEqual(topology.socket_memory(1024), [1024, 1024])
+
+    def test_local_nodes(self):
+        topology = self._load()
+        self.assertEqual(topology.local_nodes(['0000:00:1c.0']), [1])
+        self.assertEqual(
+            topology.local_nodes(['0000:00:1c.0', '0000:00:1d.0']), [1])
+        # locality unknown
+        self.assertEqual(topology.local_nodes(['0000:00:1d.0']), [0, 1])
+        self.assertEqual(topology.local_nodes([]), [0, 1])
+
+    def test_load_no_numa(self):
+        topology = numa.NUMATopology.load(
+            node_dir=os.path.join(self.tmpdir, 'missing'))
+        self.assertEqual(topology.nodes, {})
+        self.assertEqual(topology.lcore_mask(1), 0)
+
+    @patch.object(numa.NUMATopology, 'load')
+    def test_numa_topology(self, _load):
+        self.assertIs(numa.numa_topology(['0000:00:1c.0']),
+                      numa.numa_topology(['0000:00:1c.0']))
+        _load.assert_called_once_with(['0000:00:1c.0'])
@@ -0,0 +1,330 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import uuid
+
+from mock import MagicMock, call, patch
+
+import ovs_state
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'log',
+]
+
+BR_INT = uuid.UUID('6a6c4d39-5e1d-4a47-a9e1-d1bd0e1dd4e0')
+BR_DATA = uuid.UUID('b4d0f5b4-0bd3-4b0f-8d63-0b5a4c4d2a4c')
+PORT_INT = uuid.UUID('2b5a4b3e-2a2c-4b4f-9a3c-4b5b0a3f6a6d')
+PORT_ETH0 = uuid.UUID('e9d13e5a-5a5f-4a6e-9bd9-5e4c2c7c4a1d')
+PORT_BOND = uuid.UUID('c1f1a2b9-3a6d-4d3b-8b1c-9f3d1b6c1e2f')
+IF_INT = uuid.UUID('8f4d1a6e-9b3c-4e5d-9a1f-2c3b4d5e6f7a')
+IF_ETH0 = uuid.UUID('1a2b3c4d-5e6f-4a1b-8c2d-3e4f5a6b7c8d')
+IF_DPDK0 = uuid.UUID('9a8b7c6d-5e4f-4a3b-9c2d-1e0f9a8b7c6d')
+IF_DPDK1 = uuid.UUID('0f1e2d3c-4b5a-4968-8776-655443322110')
+IPFIX = uuid.UUID('5c4b3a29-1807-4f6e-8d5c-4b3a29180706')
+PATCH_INT = uuid.UUID('3d2c1b0a-9f8e-4d7c-8b6a-594837261504')
+PATCH_DATA = uuid.UUID('7e6d5c4b-3a29-4180-9f6e-5d4c3b2a1908')
+IF_PATCH_INT = uuid.UUID('4b3a2918-0706-4f5e-8d4c-3b2a19080706')
+IF_PATCH_DATA = uuid.UUID('a9b8c7d6-e5f4-4a3b-8c1d-0e9f8a7b6c5d')
+
+
+def _tables(ipfix=None, datapath_type='system'):
+    return {
+        'bridge': [
+            {'_uuid': BR_INT, 'name': 'br-int', 'ports': PORT_INT,
+             'datapath_type': datapath_type,
+             'ipfix': IPFIX if ipfix else []},
+            {'_uuid': BR_DATA, 'name': 'br-data',
+             'ports': [PORT_ETH0, PORT_BOND],
+             'datapath_type': datapath_type, 'ipfix': []},
+        ],
+        'port': [
+            {'_uuid': PORT_INT, 'name': 'br-int', 'interfaces': IF_INT,
+             'bond_mode': [], 'lacp': [], 'other_config': {}},
+            {'_uuid': PORT_ETH0, 'name': 'eth0', 'interfaces': IF_ETH0,
+             'bond_mode': [], 'lacp': [], 'other_config': {}},
+            {'_uuid': PORT_BOND, 'name': 'bond0',
+             'interfaces': [IF_DPDK0, IF_DPDK1],
+             'bond_mode': 'balance-tcp', 'lacp': 'active',
+             'other_config': {'lacp-time': 'fast'}},
+        ],
+        'interface': [
+            {'_uuid': IF_INT, 'name': 'br-int', 'type': 'internal',
+             'options': {}, 'mtu_request': []},
+            {'_uuid': IF_ETH0, 'name': 'eth0', 'type': '',
+             'options': {}, 'mtu_request': []},
+            {'_uuid': IF_DPDK0, 'name': 'dpdk-0', 'type': 'dpdk',
+             'options': {'dpdk-devargs': '0000:01:00.0'},
+             'mtu_request': 1500},
+            {'_uuid': IF_DPDK1, 'name': 'dpdk-1', 'type': 'dpdk',
+             'options': {'dpdk-devargs': '0000:01:00.1'},
+             'mtu_request': 1500},
+        ],
+        'ipfix': [
+            {'_uuid': IPFIX, 'targets': ipfix or [], 'sampling': 64,
+             'cache_active_timeout': 60, 'cache_max_flows': 128},
+        ],
+    }
+
+
+def _desired(ipfix_target=None, datapath_type='system'):
+    desired = ovs_state.DesiredOVSState()
+    desired.add_bridge('br-int', datapath_type, ipfix_target)
+    desired.add_bridge('br-data', datapath_type)
+    desired.add_port('br-data', 'eth0', promisc=True)
+    desired.add_bond(
+        'br-data', 'bond0',
+        {'dpdk-0': {'type': 'dpdk',
+                    'options': {'dpdk-devargs': '0000:01:00.0'},
+                    'mtu_request': 1500},
+         'dpdk-1': {'type': 'dpdk',
+                    'options': {'dpdk-devargs': '0000:01:00.1'},
+                    'mtu_request': 1500}},
+        portdata={'bond_mode': 'balance-tcp',
+                  'lacp': 'active',
+                  'other_config': {'lacp-time': 'fast'}})
+    return desired
+
+
+class TestOVSDBSnapshot(CharmTestCase):
+
+    def setUp(self):
+        super(TestOVSDBSnapshot, self).setUp(ovs_state, TO_PATCH)
+
+    def test_load(self):
+        ovsdb = MagicMock()
+        ovsdb.bridge = iter(_tables()['bridge'])
+        ovsdb.port = iter(_tables()['port'])
+        ovsdb.interface = iter(_tables()['interface'])
+        ovsdb.ipfix = iter([])
+        snapshot = ovs_state.OVSDBSnapshot.load(ovsdb)
+        self.assertEqual(sorted(snapshot.bridges.keys()),
+                         ['br-data', 'br-int'])
+        self.assertEqual(snapshot.port_to_br('bond0'), 'br-data')
+        self.assertEqual(snapshot.port_to_br('br-int'), 'br-int')
+        self.assertEqual(snapshot.port_to_br('eth1'), None)
+        self.assertEqual(snapshot.port_interfaces('bond0'),
+                         ['dpdk-0', 'dpdk-1'])
+        self.assertEqual(snapshot.port_interfaces('eth0'), ['eth0'])
+        self.assertEqual(snapshot.port_interfaces('eth1'), [])
+
+    def test_patch_ports_on_bridge(self):
+        tables = _tables()
+        tables['bridge'][0]['ports'] = [PORT_INT, PATCH_INT]
+        tables['bridge'][1]['ports'].append(PATCH_DATA)
+        tables['port'].extend([
+            {'_uuid': PATCH_INT, 'name': 'int-br-data',
+             'interfaces': IF_PATCH_INT},
+            {'_uuid': PATCH_DATA, 'name': 'phy-br-data',
+             'interfaces': IF_PATCH_DATA},
+        ])
+        tables['interface'].extend([
+            {'_uuid': IF_PATCH_INT, 'name': 'int-br-data', 'type': 'patch',
+             'options': {'peer': 'phy-br-data'}},
+            {'_uuid': IF_PATCH_DATA, 'name': 'phy-br-data', 'type': 'patch',
+             'options': {'peer': 'int-br-data'}},
+        ])
+        snapshot = ovs_state.OVSDBSnapshot(tables)
+        self.assertEqual(snapshot.uuid_for_port('int-br-data'), PATCH_INT)
+        self.assertEqual(snapshot.uuid_for_port('eth1'), None)
+        self.assertEqual(snapshot.bridge_for_port(PATCH_DATA), 'br-data')
+        self.assertEqual(snapshot.patch_ports_on_bridge('br-int'), [
+            ovs_state.ch_ovs.Patch(
+                ovs_state.ch_ovs.PatchPort('br-int', 'int-br-data'),
+                ovs_state.ch_ovs.PatchPort('br-data', 'phy-br-data')),
+        ])
+        self.assertEqual(snapshot.patch_ports_on_bridge('br-ex'), [])
+        del tables['port'][-1]
+        with self.assertRaises(ValueError):
+            ovs_state.OVSDBSnapshot(tables).patch_ports_on_bridge('br-int')
+
+    @patch.object(ovs_state.ovsdb_jsonrpc, 'SimpleOVSDB')
+    def test_load_default(self, _SimpleOVSDB):
+        ovs_state.OVSDBSnapshot.load()
+        _SimpleOVSDB.assert_called_once_with('ovs-vsctl')
+
+
+class TestReconcile(CharmTestCase):
+
+    def setUp(self):
+        super(TestReconcile, self).setUp(ovs_state, TO_PATCH)
+
+    def test_reconcile_empty_database(self):
+        txn = ovs_state.reconcile(
+            _desired(), ovs_state.OVSDBSnapshot({}))
+        self.assertEqual(txn.commands, [
+            ('--may-exist', 'add-br', 'br-int'),
+            ('set', 'Bridge', 'br-int', 'datapath_type=system'),
+            ('--may-exist', 'add-br', 'br-data'),
+            ('set', 'Bridge', 'br-data', 'datapath_type=system'),
+            ('--may-exist', 'add-port', 'br-data', 'eth0'),
+            ('--may-exist', 'add-bond', 'br-data', 'bond0',
+             'dpdk-0', 'dpdk-1'),
+            ('set', 'Interface', 'dpdk-0', 'type=dpdk',
+             'options:dpdk-devargs=0000:01:00.0', 'mtu_request=1500'),
+            ('set', 'Interface', 'dpdk-1', 'type=dpdk',
+             'options:dpdk-devargs=0000:01:00.1', 'mtu_request=1500'),
+            ('set', 'Port', 'bond0', 'bond_mode=balance-tcp',
+             'lacp=active', 'other_config:lacp-time=fast'),
+        ])
+        self.assertEqual(txn.post_commit, [
+            ['ip', 'link', 'set', 'eth0', 'up'],
+            ['ip', 'link', 'set', 'eth0', 'promisc', 'on'],
+        ])
+
+    def test_reconcile_up_to_date(self):
+        txn = ovs_state.reconcile(
+            _desired(), ovs_state.OVSDBSnapshot(_tables()))
+        self.assertEqual(txn.commands, [])
+        self.assertEqual(len(txn), 0)
+        # link state does not persist across reboots, set it each run
+        self.assertEqual(txn.post_commit, [
+            ['ip', 'link', 'set', 'eth0', 'up'],
+            ['ip', 'link', 'set', 'eth0', 'promisc', 'on'],
+        ])
+
+    def test_reconcile_changed_columns(self):
+        desired = _desired(datapath_type='netdev')
+        desired.ports['bond0'].interfaces['dpdk-1']['mtu_request'] = 9000
+        desired.ports['bond0'].portdata['other_config']['lacp-time'] = 'slow'
+        txn = ovs_state.reconcile(desired,
+                                  ovs_state.OVSDBSnapshot(_tables()))
+        self.assertEqual(txn.commands, [
+            ('set', 'Bridge', 'br-int', 'datapath_type=netdev'),
+            ('set', 'Bridge', 'br-data', 'datapath_type=netdev'),
+            ('set', 'Interface', 'dpdk-1', 'mtu_request=9000'),
+            ('set', 'Port', 'bond0', 'other_config:lacp-time=slow'),
+        ])
+
+    def test_reconcile_bond_members_changed(self):
+        desired = _desired()
+        del desired.ports['bond0'].interfaces['dpdk-1']
+        txn = ovs_state.reconcile(desired,
+                                  ovs_state.OVSDBSnapshot(_tables()))
+        self.assertEqual(txn.commands, [
+            ('--if-exists', 'del-port', 'bond0'),
+            ('--may-exist', 'add-bond', 'br-data', 'bond0', 'dpdk-0'),
+            ('set', 'Interface', 'dpdk-0', 'type=dpdk',
+             'options:dpdk-devargs=0000:01:00.0', 'mtu_request=1500'),
+            ('set', 'Port', 'bond0', 'bond_mode=balance-tcp',
+             'lacp=active', 'other_config:lacp-time=fast'),
+        ])
+
+    def test_reconcile_port_moved(self):
+        desired = _desired()
+        desired.add_port('br-int', 'eth0', linkup=False)
+        txn = ovs_state.reconcile(desired,
+                                  ovs_state.OVSDBSnapshot(_tables()))
+        self.assertEqual(txn.commands, [
+            ('--if-exists', 'del-port', 'eth0'),
+            ('--may-exist', 'add-port', 'br-int', 'eth0'),
+        ])
+        self.assertEqual(txn.post_commit, [])
+
+    def test_reconcile_ipfix_enable(self):
+        txn = ovs_state.reconcile(_desired(ipfix_target='10.0.0.1:4739'),
+                                  ovs_state.OVSDBSnapshot(_tables()))
+        self.assertEqual(txn.commands, [
+            ('set', 'Bridge', 'br-int', 'ipfix=@ipfix0'),
+            ('--id=@ipfix0', 'create', 'IPFIX', 'targets="10.0.0.1:4739"',
+             'sampling=64', 'cache_active_timeout=60',
+             'cache_max_flows=128'),
+        ])
+
+    def test_reconcile_ipfix_unchanged(self):
+        txn = ovs_state.reconcile(
+            _desired(ipfix_target='10.0.0.1:4739'),
+            ovs_state.OVSDBSnapshot(_tables(ipfix='10.0.0.1:4739')))
+        self.assertEqual(txn.commands, [])
+
+    def test_reconcile_ipfix_retarget(self):
+        txn = ovs_state.reconcile(
+            _desired(ipfix_target='10.0.0.2:4739'),
+            ovs_state.OVSDBSnapshot(_tables(ipfix='10.0.0.1:4739')))
+        self.assertEqual(txn.commands[0],
+                         ('set', 'Bridge', 'br-int', 'ipfix=@ipfix0'))
+
+    def test_reconcile_ipfix_disable(self):
+        txn = ovs_state.reconcile(
+            _desired(),
+            ovs_state.OVSDBSnapshot(_tables(ipfix='10.0.0.1:4739')))
+        self.assertEqual(txn.commands, [
+            ('clear', 'Bridge', 'br-int', 'ipfix'),
+        ])
+
+    def test_reconcile_open_vswitch(self):
+        tables = _tables()
+        tables['open_vswitch'] = [
+            {'_uuid': uuid.uuid4(),
+             'other_config': {'dpdk-init': 'true', 'pmd-cpu-mask': '0x0c'}},
+        ]
+        tables['interface'][2]['options']['n_rxq'] = '2'
+        tables['interface'][2]['other_config'] = {
+            'pmd-rxq-affinity': '0:2,1:3'}
+        desired = _desired()
+        desired.set_open_vswitch('other_config', {'pmd-cpu-mask': '0x0c'})
+        dpdk0 = desired.ports['bond0'].interfaces['dpdk-0']
+        dpdk0['options']['n_rxq'] = 2
+        dpdk0['other_config'] = {'pmd-rxq-affinity': '0:2,1:3'}
+        snapshot = ovs_state.OVSDBSnapshot(tables)
+        self.assertEqual(ovs_state.reconcile(desired, snapshot).commands, [])
+
+        desired.set_open_vswitch('other_config', {'pmd-cpu-mask': '0x30'})
+        dpdk0['options']['n_rxq'] = None
+        dpdk0['other_config']['pmd-rxq-affinity'] = None
+        desired.ports['bond0'].interfaces['dpdk-1']['other_config'] = {
+            'pmd-rxq-affinity': None}
+        self.assertEqual(ovs_state.reconcile(desired, snapshot).commands, [
+            ('set', 'Open_vSwitch', '.', 'other_config:pmd-cpu-mask=0x30'),
+            ('remove', 'Interface', 'dpdk-0', 'options', 'n_rxq'),
+            ('remove', 'Interface', 'dpdk-0', 'other_config',
+             'pmd-rxq-affinity'),
+        ])
+
+        desired.set_open_vswitch('other_config', {'pmd-cpu-mask': None})
+        self.assertEqual(
+            ovs_state.reconcile(desired, snapshot).commands[0],
+            ('remove', 'Open_vSwitch', '.', 'other_config', 'pmd-cpu-mask'))
+        self.assertEqual(desired.open_vswitch,
+                         {'other_config': {'pmd-cpu-mask': None}})
+
+
+class TestOVSTransaction(CharmTestCase):
+
+    def setUp(self):
+        super(TestOVSTransaction, self).setUp(ovs_state, TO_PATCH)
+
+    @patch.object(ovs_state.subprocess, 'check_call')
+    def test_commit(self, _check_call):
+        txn = ovs_state.OVSTransaction()
+        txn.add('--may-exist', 'add-br', 'br-int')
+        txn.add('set', 'Bridge', 'br-int', 'datapath_type=system')
+        txn.post_commit.append(['ip', 'link', 'set', 'eth0', 'up'])
+        self.assertTrue(txn.commit())
+        _check_call.assert_has_calls([
+            call(['ovs-vsctl', '--', '--may-exist', 'add-br', 'br-int',
+                  '--', 'set', 'Bridge', 'br-int', 'datapath_type=system']),
+            call(['ip', 'link', 'set', 'eth0', 'up']),
+        ])
+
+    @patch.object(ovs_state.subprocess, 'check_call')
+    def test_commit_noop(self, _check_call):
+        txn = ovs_state.OVSTransaction()
+        self.assertFalse(txn.commit())
+        _check_call.assert_not_called()
+        txn.post_commit.append(['ip', 'link', 'set', 'eth0', 'up'])
+        self.assertFalse(txn.commit())
+        _check_call.assert_called_once_with(['ip', 'link', 'set', 'eth0',
+                                             'up'])
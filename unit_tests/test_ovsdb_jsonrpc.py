@@ -0,0 +1,295 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import uuid
+
+from mock import patch
+
+import charmhelpers.core.hookenv as hookenv
+
+import ovsdb_jsonrpc
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'log',
+]
+
+BRIDGE_UUID = '6a6c4d39-5e1d-4a47-a9e1-d1bd0e1dd4e0'
+PORT_UUIDS = ['2b5a4b3e-2a2c-4b4f-9a3c-4b5b0a3f6a6d',
+              'e9d13e5a-5a5f-4a6e-9bd9-5e4c2c7c4a1d']
+
+SCHEMA = {
+    'name': 'Open_vSwitch',
+    'tables': {
+        'Bridge': {'columns': {
+            'name': {'type': 'string'},
+            'ports': {'type': {'key': {'type': 'uuid',
+                                       'refTable': 'Port'},
+                               'min': 0, 'max': 'unlimited'}},
+            'external_ids': {'type': {'key': 'string', 'value': 'string',
+                                      'min': 0, 'max': 'unlimited'}},
+        }},
+        'Interface': {'columns': {
+            'name': {'type': 'string'},
+            'type': {'type': 'string'},
+            'mtu_request': {'type': {'key': {'type': 'integer',
+                                             'minInteger': 1},
+                                     'min': 0, 'max': 1}},
+        }},
+    },
+}
+
+BRIDGE_ROW = {
+    '_uuid': ['uuid', BRIDGE_UUID],
+    '_version': ['uuid', '0f1e2d3c-4b5a-4968-8776-655443322110'],
+    'name': 'br-int',
+    'ports': ['set', [['uuid', PORT_UUIDS[0]], ['uuid', PORT_UUIDS[1]]]],
+    'external_ids': ['map', [['charm', 'managed']]],
+}
+
+
+class FakeOVSDBServer(object):
+    """Unix socket server answering JSON-RPC requests from a handler."""
+
+    def __init__(self, path, handler):
+        self.requests = []
+        self._handler = handler
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(path)
+        self._sock.listen(1)
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _serve(self):
+        try:
+            conn, _ = self._sock.accept()
+        except OSError:
+            # closed by a test that never connected
+            return
+        decoder = json.JSONDecoder()
+        buf = ''
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                break
+            buf += data.decode('UTF-8')
+            while buf:
+                try:
+                    request, end = decoder.raw_decode(buf)
+                except ValueError:
+                    break
+                buf = buf[end:]
+                self.requests.append(request)
+                for reply in self._handler(request):
+                    conn.sendall(json.dumps(reply).encode('UTF-8'))
+        conn.close()
+
+    def close(self):
+        self._sock.close()
+
+
+def _last_transact(requests):
+    return [r for r in requests if r.get('method') == 'transact'][-1]
+
+
+def _handler(request):
+    method = request.get('method')
+    if method == 'get_schema':
+        yield {'id': request['id'], 'result': SCHEMA, 'error': None}
+    elif method == 'transact':
+        operation = request['params'][1]
+        if operation['table'] == 'Missing':
+            yield {'id': request['id'], 'error': None,
+                   'result': [{'error': 'unknown table',
+                               'details': 'No table named Missing.'}]}
+            return
+        # exercise echo handling on the client side, the result is only
+        # sent once the echo has been answered
+        yield {'method': 'echo', 'params': [], 'id': ['echo', request['id']]}
+    elif method == 'monitor':
+        yield {'id': request['id'], 'error': None,
+               'result': {'Bridge': {BRIDGE_UUID: {'new': {
+                   'name': 'br-int'}}}}}
+        yield {'method': 'update', 'id': None,
+               'params': [request['params'][1], {'Bridge': {BRIDGE_UUID: {
+                   'old': {'name': 'br-int'},
+                   'new': {'name': 'br-int2'}}}}]}
+    elif method is None:
+        # reply to our own echo request
+        yield {'id': request['id'][1], 'error': None,
+               'result': [{'rows': [dict(BRIDGE_ROW)]}]}
+    elif method == 'echo':
+        pass
+    else:
+        yield {'id': request['id'], 'result': None,
+               'error': 'unknown method'}
+
+
+class TestOVSDBClient(CharmTestCase):
+
+    def setUp(self):
+        super(TestOVSDBClient, self).setUp(ovsdb_jsonrpc, TO_PATCH)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'db.sock')
+        self.server = FakeOVSDBServer(self.path, _handler)
+        self.addCleanup(self.server.close)
+        self.client = ovsdb_jsonrpc.OVSDBClient(self.path, timeout=5)
+        self.addCleanup(self.client.close)
+
+    def test_select(self):
+        rows = self.client.select('Bridge', where=[['name', '==', 'br-int']],
+                                  columns=['name'])
+        self.assertEqual(rows[0]['name'], 'br-int')
+        self.assertEqual(self.server.requests[0], {
+            'method': 'transact',
+            'params': ['Open_vSwitch', {'op': 'select', 'table': 'Bridge',
+                                        'where': [['name', '==', 'br-int']],
+                                        'columns': ['name']}],
+            'id': 0})
+        # echo request from the server has been answered
+        self.assertEqual(self.server.requests[1],
+                         {'result': [], 'error': None, 'id': ['echo', 0]})
+
+    def test_transact_error(self):
+        with self.assertRaises(ovsdb_jsonrpc.OVSDBError):
+            self.client.select('Missing')
+
+    def test_call_error(self):
+        with self.assertRaises(ovsdb_jsonrpc.OVSDBError):
+            self.client.call('bogus')
+
+    def test_table_name(self):
+        self.assertEqual(self.client.table_name('bridge'), 'Bridge')
+        self.assertEqual(self.client.table_name('INTERFACE'), 'Interface')
+        with self.assertRaises(KeyError):
+            self.client.table_name('port')
+        # schema is only retrieved once
+        self.assertEqual(
+            [r['method'] for r in self.server.requests], ['get_schema'])
+
+    def test_monitor(self):
+        initial = self.client.monitor({'Bridge': ['name']}, 'mon')
+        self.assertEqual(initial['Bridge'][BRIDGE_UUID]['new']['name'],
+                         'br-int')
+        self.assertEqual(self.server.requests[0]['params'],
+                         ['Open_vSwitch', 'mon',
+                          {'Bridge': {'columns': ['name']}}])
+        # make sure the notification following the reply has been read
+        self.client.call('get_schema', 'Open_vSwitch')
+        self.assertEqual(self.client.updates('other'), [])
+        updates = self.client.updates('mon')
+        self.assertEqual(
+            updates[0]['Bridge'][BRIDGE_UUID]['new']['name'], 'br-int2')
+        self.assertEqual(self.client.updates('mon'), [])
+
+
+class TestSimpleOVSDB(CharmTestCase):
+
+    def setUp(self):
+        super(TestSimpleOVSDB, self).setUp(ovsdb_jsonrpc, TO_PATCH)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'db.sock')
+        self.server = FakeOVSDBServer(self.path, _handler)
+        self.addCleanup(self.server.close)
+        self.client = ovsdb_jsonrpc.OVSDBClient(self.path, timeout=5)
+        self.addCleanup(self.client.close)
+        self.ovsdb = ovsdb_jsonrpc.SimpleOVSDB('ovs-vsctl',
+                                               client=self.client)
+
+    def tearDown(self):
+        hookenv.cache = {}
+
+    def test_iterate(self):
+        rows = list(self.ovsdb.bridge)
+        self.assertEqual(rows, [{
+            '_uuid': uuid.UUID(BRIDGE_UUID),
+            'name': 'br-int',
+            'ports': [uuid.UUID(PORT_UUIDS[0]), uuid.UUID(PORT_UUIDS[1])],
+            'external_ids': {'charm': 'managed'},
+        }])
+        self.assertEqual(
+            _last_transact(self.server.requests)['params'][1]['where'], [])
+
+    def test_find(self):
+        list(self.ovsdb.bridge.find('name=br-int'))
+        self.assertEqual(
+            _last_transact(self.server.requests)['params'][1]['where'],
+            [['name', '==', 'br-int']])
+
+    def test_condition_to_where(self):
+        table = self.ovsdb.interface
+        self.assertEqual(table._condition_to_where('Interface', 'type=patch'),
+                         [['type', '==', 'patch']])
+        self.assertEqual(
+            table._condition_to_where('Interface', 'mtu_request=9000'),
+            [['mtu_request', '==', 9000]])
+        self.assertEqual(
+            table._condition_to_where('Interface', 'options:peer=x'), None)
+        self.assertEqual(
+            table._condition_to_where('Bridge', 'external_ids=x'), None)
+        self.assertEqual(
+            table._condition_to_where('Interface', 'unknown=x'), None)
+        # non-integer values are left to ovs-vsctl
+        self.assertEqual(
+            table._condition_to_where('Interface', 'mtu_request=[]'), None)
+
+    @patch.object(ovsdb_jsonrpc.ch_ovsdb.SimpleOVSDB.Table, '_find_tbl')
+    def test_find_unsupported_condition(self, _find_tbl):
+        _find_tbl.return_value = iter([{'name': 'patch-tun'}])
+        self.assertEqual(
+            list(self.ovsdb.interface.find('options:peer=patch-int')),
+            [{'name': 'patch-tun'}])
+        _find_tbl.assert_called_once_with(condition='options:peer=patch-int')
+
+    def test_unknown_table(self):
+        with self.assertRaises(AttributeError):
+            self.ovsdb.chassis
+
+    @patch.object(ovsdb_jsonrpc, 'ovsdb_client')
+    def test_fallback_to_cli(self, _ovsdb_client):
+        _ovsdb_client.return_value = None
+        ovsdb = ovsdb_jsonrpc.SimpleOVSDB('ovs-vsctl')
+        self.assertNotIsInstance(ovsdb.bridge,
+                                 ovsdb_jsonrpc.SimpleOVSDB.Table)
+        self.assertIsInstance(ovsdb.bridge,
+                              ovsdb_jsonrpc.ch_ovsdb.SimpleOVSDB.Table)
+
+    @patch.object(ovsdb_jsonrpc, 'ovsdb_client')
+    def test_other_tools_use_cli(self, _ovsdb_client):
+        ovsdb = ovsdb_jsonrpc.SimpleOVSDB('ovn-sbctl')
+        self.assertNotIsInstance(ovsdb.chassis,
+                                 ovsdb_jsonrpc.SimpleOVSDB.Table)
+        _ovsdb_client.assert_not_called()
+
+    def test_ovsdb_client(self):
+        with patch.object(ovsdb_jsonrpc.OVSDBClient, 'connect') as _connect:
+            client = ovsdb_jsonrpc.ovsdb_client()
+            self.assertIsInstance(client, ovsdb_jsonrpc.OVSDBClient)
+            # one connection per hook
+            self.assertIs(ovsdb_jsonrpc.ovsdb_client(), client)
+            _connect.assert_called_once_with()
+        hookenv.cache = {}
+        with patch.object(ovsdb_jsonrpc.OVSDBClient, 'connect') as _connect:
+            _connect.side_effect = FileNotFoundError
+            self.assertEqual(ovsdb_jsonrpc.ovsdb_client(), None)
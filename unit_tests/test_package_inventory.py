@@ -0,0 +1,120 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import call, patch
+
+import package_inventory
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    '_database_mtimes',
+    'log',
+]
+
+APT_CACHE = {
+    'neutron-common': {'package': 'neutron-common', 'version': '2:16.0'},
+    'openvswitch-switch': {'package': 'openvswitch-switch',
+                           'version': '2.13.1'},
+    'neutron-l3-agent': {'package': 'neutron-l3-agent', 'version': '2:16.0'},
+}
+
+DPKG = {
+    'neutron-common': {'name': 'neutron-common', 'version': '2:16.0',
+                       'architecture': 'all'},
+    'openvswitch-switch': {'name': 'openvswitch-switch',
+                           'version': '2.13.0', 'architecture': 'amd64'},
+}
+
+
+class TestPackageInventory(CharmTestCase):
+
+    def setUp(self):
+        super(TestPackageInventory, self).setUp(package_inventory, TO_PATCH)
+        self._database_mtimes.return_value = [1, 2]
+        self.inventory = package_inventory.PackageInventory()
+        self.apt_cache_show = self.patch_object(
+            self.inventory, '_apt_cache_show')
+        self.apt_cache_show.side_effect = lambda packages: {
+            package: dict(APT_CACHE[package])
+            for package in packages if package in APT_CACHE}
+        self.dpkg_list = self.patch_object(self.inventory, '_dpkg_list')
+        self.dpkg_list.side_effect = lambda packages: {
+            package: DPKG[package]
+            for package in packages if package in DPKG}
+
+    def patch_object(self, obj, attr):
+        _p = patch.object(obj, attr)
+        self.addCleanup(_p.stop)
+        return _p.start()
+
+    def test_load(self):
+        packages = ['neutron-common', 'openvswitch-switch',
+                    'neutron-l3-agent']
+        self.inventory.load(packages)
+        self.apt_cache_show.assert_called_once_with(packages)
+        self.dpkg_list.assert_called_once_with(packages)
+        pkg = self.inventory['openvswitch-switch']
+        self.assertEqual(pkg.name, 'openvswitch-switch')
+        self.assertEqual(pkg.current_ver.ver_str, '2.13.0')
+        self.assertEqual(pkg.architecture, 'amd64')
+        self.assertIsNone(self.inventory['neutron-l3-agent'].current_ver)
+        self.assertIn('neutron-common', self.inventory)
+        # served from the inventory
+        self.inventory.load(packages)
+        self.assertEqual(self.apt_cache_show.call_count, 1)
+        self.assertEqual(self.dpkg_list.call_count, 1)
+
+    def test_unknown_package(self):
+        self.inventory.load(['neutron-common', 'unknown'])
+        self.apt_cache_show.assert_has_calls([
+            call(['neutron-common', 'unknown']),
+            call(['unknown']),
+        ])
+        with self.assertRaises(KeyError):
+            self.inventory['unknown']
+        self.assertNotIn('unknown', self.inventory)
+        self.assertEqual(self.apt_cache_show.call_count, 2)
+
+    def test_database_changed(self):
+        self.inventory['neutron-common']
+        self._database_mtimes.return_value = [3, 2]
+        self.inventory['neutron-common']
+        self.assertEqual(self.apt_cache_show.call_count, 2)
+
+    @patch.object(package_inventory, 'inventory')
+    def test_filter_packages(self, inventory):
+        inventory.return_value = self.inventory
+        packages = ['neutron-common', 'neutron-l3-agent', 'unknown']
+        self.assertEqual(
+            package_inventory.filter_installed_packages(packages),
+            ['neutron-l3-agent', 'unknown'])
+        self.dpkg_list.assert_called_once_with(packages)
+        self.assertTrue(self.log.called)
+        self.assertEqual(
+            package_inventory.filter_missing_packages(packages),
+            ['neutron-common'])
+        self.dpkg_list.assert_called_once_with(packages)
+
+    @patch.object(package_inventory, 'inventory')
+    def test_get_upstream_version(self, inventory):
+        inventory.return_value = self.inventory
+        self.assertEqual(
+            package_inventory.get_upstream_version('openvswitch-switch'),
+            '2.13.0')
+        self.assertEqual(
+            package_inventory.get_upstream_version('neutron-common'), '16.0')
+        self.assertIsNone(
+            package_inventory.get_upstream_version('neutron-l3-agent'))
+        self.assertIsNone(package_inventory.get_upstream_version('unknown'))
@@ -0,0 +1,76 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import package_plan
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'apt_install',
+    'filter_installed_packages',
+    'filter_missing_packages',
+    'log',
+]
+
+INSTALLED = ['neutron-openvswitch-agent', 'neutron-dhcp-agent']
+
+
+class TestPackagePlan(CharmTestCase):
+
+    def setUp(self):
+        super(TestPackagePlan, self).setUp(package_plan, TO_PATCH)
+        self.filter_installed_packages.side_effect = lambda packages: [
+            package for package in packages if package not in INSTALLED]
+        self.filter_missing_packages.side_effect = lambda packages: [
+            package for package in packages if package in INSTALLED]
+
+    def test_init(self):
+        plan = package_plan.PackagePlan(
+            ['openvswitch-switch', 'keepalived', 'openvswitch-switch'],
+            ['neutron-dhcp-agent', 'keepalived', 'neutron-dhcp-agent'])
+        self.assertEqual(plan.install, ['openvswitch-switch', 'keepalived'])
+        self.assertEqual(plan.purge, ['neutron-dhcp-agent'])
+
+    def test_diff(self):
+        plan = package_plan.PackagePlan(
+            ['neutron-openvswitch-agent', 'keepalived'],
+            ['neutron-dhcp-agent', 'neutron-l3-agent'])
+        self.assertEqual(plan.diff(),
+                         (['keepalived'], ['neutron-dhcp-agent']))
+
+    def test_apply(self):
+        plan = package_plan.PackagePlan(
+            ['neutron-openvswitch-agent', 'keepalived'],
+            ['neutron-dhcp-agent', 'neutron-l3-agent'])
+        self.assertEqual(plan.apply(),
+                         (['keepalived'], ['neutron-dhcp-agent']))
+        self.apt_install.assert_called_once_with(
+            ['keepalived', 'neutron-dhcp-agent-'],
+            options=['--option=Dpkg::Options::=--force-confold',
+                     '--purge', '--autoremove'],
+            fatal=True)
+
+    def test_apply_install(self):
+        plan = package_plan.PackagePlan(['keepalived'], ['neutron-l3-agent'])
+        plan.apply(fatal=False)
+        self.apt_install.assert_called_once_with(
+            ['keepalived'],
+            options=['--option=Dpkg::Options::=--force-confold'],
+            fatal=False)
+
+    def test_apply_noop(self):
+        plan = package_plan.PackagePlan(['neutron-openvswitch-agent'],
+                                        ['neutron-l3-agent'])
+        self.assertEqual(plan.apply(), ([], []))
+        self.apt_install.assert_not_called()
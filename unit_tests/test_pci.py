@@ -22,6 +22,10 @@ from test_pci_helper import (
     mocked_realpath,
 )
 from mock import patch, MagicMock
+import os
+import shutil
+import tempfile
+
 import pci
 
 TO_PATCH = [
@@ -42,6 +46,49 @@ class PCITest(CharmTestCase):
             '0000:00:02.1'), '0000:00:02.1')
 
 
+class SysBusPCITest(CharmTestCase):
+
+    def setUp(self):
+        super(SysBusPCITest, self).setUp(pci, [])
+        self.sysdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.sysdir)
+        for pci_address, pci_class in (('0000:10:00.1', '0x020000'),
+                                       ('0000:00:1f.2', '0x010601'),
+                                       ('0000:10:00.0', '0x020000'),
+                                       ('0000:3b:00.0', '0x028000')):
+            os.mkdir(os.path.join(self.sysdir, pci_address))
+            with open(os.path.join(self.sysdir, pci_address, 'class'),
+                      'w') as f:
+                f.write(pci_class + '\n')
+
+    def test_get_sysbus_pci_ethernet_addresses(self):
+        self.assertEqual(
+            pci.get_sysbus_pci_ethernet_addresses(self.sysdir),
+            ['0000:10:00.0', '0000:10:00.1'])
+
+    def test_get_sysbus_pci_ethernet_addresses_missing(self):
+        with self.assertRaises(OSError):
+            pci.get_sysbus_pci_ethernet_addresses(
+                os.path.join(self.sysdir, 'missing'))
+
+    @patch.object(pci, 'get_lspci_ethernet_addresses')
+    def test_get_pci_ethernet_addresses_sysfs(self, _lspci):
+        with patch.object(pci, 'PCI_DEVICES_DIR', self.sysdir):
+            devices = pci.PCINetDevices.__new__(pci.PCINetDevices)
+            self.assertEqual(devices.get_pci_ethernet_addresses(),
+                             ['0000:10:00.0', '0000:10:00.1'])
+        _lspci.assert_not_called()
+
+    @patch.object(pci, 'get_lspci_ethernet_addresses')
+    @patch.object(pci, 'get_sysbus_pci_ethernet_addresses')
+    def test_get_pci_ethernet_addresses_fallback(self, _sysbus, _lspci):
+        _sysbus.side_effect = OSError
+        _lspci.return_value = ['0000:10:00.0']
+        devices = pci.PCINetDevices.__new__(pci.PCINetDevices)
+        self.assertEqual(devices.get_pci_ethernet_addresses(),
+                         ['0000:10:00.0'])
+
+
 class PCINetDeviceTest(CharmTestCase):
 
     def setUp(self):
@@ -182,7 +229,10 @@ class PCINetDeviceTest(CharmTestCase):
 class PCINetDevicesTest(CharmTestCase):
 
     def setUp(self):
-        super(PCINetDevicesTest, self).setUp(pci, TO_PATCH)
+        super(PCINetDevicesTest, self).setUp(
+            pci, TO_PATCH + ['get_sysbus_pci_ethernet_addresses'])
+        # discovery through sysfs is covered by SysBusPCITest, use lspci
+        self.get_sysbus_pci_ethernet_addresses.return_value = []
 
     @patch('os.path.islink')
     def pci_devs(self, _osislink, subproc_map=None):
@@ -271,3 +321,37 @@ class PCINetDevicesTest(CharmTestCase):
         self.assertTrue(check_device(
             devices.get_device_from_pci_address('0000:10:00.1'),
             expect['0000:10:00.1']))
+
+    def test_get_device_from_interface_name(self):
+        devices = self.pci_devs()
+        self.assertEqual(
+            devices.get_device_from_interface_name('eth2').pci_address,
+            '0000:10:00.0')
+        self.assertEqual(devices.get_device_from_interface_name('eth9'),
+                         None)
+        self.assertEqual(devices.get_device_from_mac('00:00:00:00:00:00'),
+                         None)
+
+    @patch('pci.get_sysnet_interfaces_and_macs')
+    def test_single_sysfs_pass(self, _sysnet_ints):
+        self.subprocess.check_output.side_effect = mocked_subprocess()
+        _sysnet_ints.return_value = [
+            {
+                'interface': 'eth2',
+                'mac_address': 'a8:9d:21:cf:93:fc',
+                'pci_address': '0000:10:00.0',
+                'state': 'up',
+                'sriov': False,
+            },
+        ]
+        devices = pci.PCINetDevices()
+        _sysnet_ints.assert_called_once_with()
+        self.assertEqual(
+            devices.get_device_from_mac('a8:9d:21:cf:93:fc').interface_name,
+            'eth2')
+        _sysnet_ints.return_value[0]['mac_address'] = 'a8:9d:21:cf:93:fe'
+        devices.update_devices()
+        self.assertEqual(_sysnet_ints.call_count, 2)
+        self.assertEqual(
+            devices.get_device_from_mac('a8:9d:21:cf:93:fe').interface_name,
+            'eth2')
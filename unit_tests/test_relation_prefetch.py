@@ -0,0 +1,112 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import types
+
+from mock import call, patch
+
+import relation_prefetch
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'log',
+    'related_units',
+    'relation_ids',
+]
+
+RELATION_DATA = {
+    'amqp:1': {
+        'rabbitmq-server/0': {'private-address': '10.0.0.1',
+                              'password': 'secret'},
+        'rabbitmq-server/1': {},
+    },
+    'amqp:2': {
+        'rabbitmq-server/2': None,
+    },
+}
+
+
+class TestRelationPrefetch(CharmTestCase):
+
+    def setUp(self):
+        super(TestRelationPrefetch, self).setUp(relation_prefetch, TO_PATCH)
+        self.relation_ids.side_effect = lambda endpoint: sorted(
+            rid for rid in RELATION_DATA if rid.startswith(endpoint))
+        self.related_units.side_effect = lambda rid: sorted(
+            RELATION_DATA[rid])
+        patcher = patch.object(relation_prefetch.hookenv, 'relation_get')
+        self.hookenv_relation_get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        def _relation_get(attribute=None, unit=None, rid=None):
+            return RELATION_DATA.get(rid, {}).get(unit)
+
+        self.hookenv_relation_get.side_effect = _relation_get
+
+    def test_prefetch(self):
+        self.assertEqual(relation_prefetch.prefetch('amqp'), {
+            'amqp:1': {
+                'rabbitmq-server/0': {'private-address': '10.0.0.1',
+                                      'password': 'secret'},
+                'rabbitmq-server/1': {},
+            },
+            'amqp:2': {'rabbitmq-server/2': {}},
+        })
+        self.hookenv_relation_get.assert_has_calls([
+            call(rid='amqp:1', unit='rabbitmq-server/0'),
+            call(rid='amqp:1', unit='rabbitmq-server/1'),
+            call(rid='amqp:2', unit='rabbitmq-server/2'),
+        ])
+        # once per hook
+        relation_prefetch.prefetch('amqp')
+        self.assertEqual(self.hookenv_relation_get.call_count, 3)
+
+    def test_relation_get(self):
+        unit = 'rabbitmq-server/0'
+        self.assertEqual(
+            relation_prefetch.relation_get('password', unit, 'amqp:1'),
+            'secret')
+        self.assertEqual(
+            relation_prefetch.relation_get('ssl_port', rid='amqp:1',
+                                           unit=unit),
+            None)
+        settings = relation_prefetch.relation_get(rid='amqp:1', unit=unit)
+        settings['password'] = 'modified'
+        self.assertEqual(
+            relation_prefetch.relation_get('password', unit, 'amqp:1'),
+            'secret')
+        # all served from one relation-get per unit
+        self.assertEqual(self.hookenv_relation_get.call_count, 3)
+
+    def test_relation_get_not_prefetched(self):
+        self.hookenv_relation_get.side_effect = None
+        self.hookenv_relation_get.return_value = 'value'
+        self.assertEqual(relation_prefetch.relation_get('password'), 'value')
+        self.hookenv_relation_get.assert_called_once_with(
+            attribute='password', unit=None, rid=None)
+        self.hookenv_relation_get.reset_mock()
+        self.assertEqual(
+            relation_prefetch.relation_get('password', 'rabbitmq-server/3',
+                                           'amqp:1'),
+            'value')
+        self.hookenv_relation_get.assert_called_with(
+            attribute='password', unit='rabbitmq-server/3', rid='amqp:1')
+
+    def test_serving(self):
+        module = types.ModuleType('module')
+        module.relation_get = self.hookenv_relation_get
+        with relation_prefetch.serving(module):
+            self.assertIs(module.relation_get, relation_prefetch.relation_get)
+        self.assertIs(module.relation_get, self.hookenv_relation_get)
@@ -0,0 +1,84 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import patch
+
+import release_resolver
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    '_dpkg_status_mtime',
+    'config',
+    'log',
+]
+
+
+class TestReleaseResolver(CharmTestCase):
+
+    def setUp(self):
+        super(TestReleaseResolver, self).setUp(release_resolver, TO_PATCH)
+        self.config.side_effect = self.test_config.get
+        self._dpkg_status_mtime.return_value = 1
+        self.os_utils = self.patch('os_utils')
+        self.os_utils.get_os_codename_package.return_value = 'ussuri'
+
+    def test_os_release(self):
+        self.assertEqual(
+            release_resolver.os_release('neutron-common', base='icehouse'),
+            'ussuri')
+        self.assertEqual(
+            release_resolver.os_release('neutron-common', reset_cache=True),
+            'ussuri')
+        self.os_utils.get_os_codename_package.assert_called_once_with(
+            'neutron-common', fatal=False)
+        self.assertEqual(release_resolver.probes(), 1)
+
+    def test_packages_changed(self):
+        release_resolver.os_release('neutron-common')
+        self._dpkg_status_mtime.return_value = 2
+        self.os_utils.get_os_codename_package.return_value = 'victoria'
+        self.assertEqual(release_resolver.os_release('neutron-common'),
+                         'victoria')
+        self.assertEqual(release_resolver.probes(), 2)
+
+    def test_not_installed(self):
+        self.os_utils.get_os_codename_package.return_value = None
+        self.os_utils.get_os_codename_install_source.return_value = None
+        self.assertEqual(
+            release_resolver.os_release('neutron-common', base='icehouse'),
+            'icehouse')
+        self.os_utils.get_os_codename_install_source.assert_called_once_with(
+            None)
+        self.os_utils.lsb_release.return_value = {
+            'DISTRIB_CODENAME': 'focal'}
+        self.os_utils.UBUNTU_OPENSTACK_RELEASE = {'focal': 'ussuri'}
+        # the base is not recorded
+        self.assertEqual(release_resolver.os_release('neutron-common'),
+                         'ussuri')
+        self.assertEqual(release_resolver.probes(), 1)
+
+
+class TestDpkgStatusMtime(CharmTestCase):
+
+    def setUp(self):
+        super(TestDpkgStatusMtime, self).setUp(release_resolver, [])
+
+    @patch.object(release_resolver.os, 'stat')
+    def test_dpkg_status_mtime(self, stat):
+        stat.return_value.st_mtime_ns = 42
+        self.assertEqual(release_resolver._dpkg_status_mtime(), 42)
+        stat.assert_called_once_with('/var/lib/dpkg/status')
+        stat.side_effect = FileNotFoundError
+        self.assertIsNone(release_resolver._dpkg_status_mtime())
@@ -0,0 +1,119 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+
+from mock import call
+
+import service_state
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'init_is_systemd',
+    'log',
+    'service_pause',
+    'service_resume',
+    'service_running',
+    'subprocess',
+]
+
+SYSTEMCTL_SHOW = """Id=openvswitch-switch.service
+LoadState=loaded
+ActiveState=active
+SubState=exited
+
+Id=neutron-openvswitch-agent.service
+LoadState=loaded
+ActiveState=failed
+SubState=failed
+
+Id=neutron-l3-agent.service
+LoadState=not-found
+ActiveState=inactive
+SubState=dead
+"""
+
+SERVICES = [
+    'openvswitch-switch',
+    'neutron-openvswitch-agent',
+    'neutron-l3-agent',
+]
+
+
+class TestServiceState(CharmTestCase):
+
+    def setUp(self):
+        super(TestServiceState, self).setUp(service_state, TO_PATCH)
+        self.subprocess.CalledProcessError = subprocess.CalledProcessError
+        self.subprocess.check_output.return_value = SYSTEMCTL_SHOW
+        self.init_is_systemd.return_value = True
+
+    def test_systemctl_show(self):
+        states = service_state.systemctl_show(SERVICES)
+        self.subprocess.check_output.assert_called_once_with(
+            ['systemctl', 'show',
+             '--property=Id,LoadState,ActiveState,SubState',
+             'openvswitch-switch.service',
+             'neutron-openvswitch-agent.service',
+             'neutron-l3-agent.service'],
+            universal_newlines=True)
+        self.assertEqual(states['neutron-l3-agent'], {
+            'Id': 'neutron-l3-agent.service',
+            'LoadState': 'not-found',
+            'ActiveState': 'inactive',
+            'SubState': 'dead',
+        })
+        self.assertEqual(service_state.systemctl_show([]), {})
+        with self.assertRaises(ValueError):
+            service_state.systemctl_show(SERVICES + ['dpdk'])
+
+    def test_services_running(self):
+        self.assertEqual(dict(service_state.services_running(SERVICES)), {
+            'openvswitch-switch': True,
+            'neutron-openvswitch-agent': False,
+            'neutron-l3-agent': False,
+        })
+        self.service_running.assert_not_called()
+
+    def test_services_running_fallback(self):
+        self.service_running.return_value = True
+        self.subprocess.check_output.side_effect = \
+            subprocess.CalledProcessError(1, 'systemctl')
+        self.assertEqual(list(service_state.services_running(SERVICES)),
+                         SERVICES)
+        self.assertTrue(self.log.called)
+        self.assertEqual(self.service_running.call_count, 3)
+        self.init_is_systemd.return_value = False
+        self.service_running.reset_mock()
+        service_state.services_running(SERVICES)
+        self.assertEqual(self.service_running.call_count, 3)
+
+    def test_manage_services(self):
+        self.service_pause.side_effect = \
+            lambda service_name: service_name != 'neutron-l3-agent'
+        self.assertEqual(
+            service_state.manage_services('pause', SERVICES, max_workers=4),
+            ["neutron-l3-agent didn't pause cleanly."])
+        # dependent services first
+        self.assertEqual(self.service_pause.call_args_list[-1],
+                         call('openvswitch-switch'))
+        self.service_resume.return_value = True
+        self.assertEqual(service_state.manage_services('resume', SERVICES),
+                         [])
+        self.assertEqual(self.service_resume.call_args_list, [
+            call('openvswitch-switch'),
+            call('neutron-openvswitch-agent'),
+            call('neutron-l3-agent'),
+        ])
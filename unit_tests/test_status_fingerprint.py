@@ -0,0 +1,115 @@
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+
+from collections import OrderedDict
+
+from mock import MagicMock, patch
+
+import numa
+import status_fingerprint
+import update_status
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'kv',
+    'numa',
+    'service_state',
+    'time',
+]
+
+
+class FakeKV(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+    def unset(self, key):
+        self.pop(key, None)
+
+    def flush(self):
+        pass
+
+
+class TestStatusFingerprint(CharmTestCase):
+
+    def setUp(self):
+        super(TestStatusFingerprint, self).setUp(status_fingerprint, TO_PATCH)
+        self.db = FakeKV()
+        self.kv.return_value = self.db
+        self.time.time.return_value = 1000.0
+        self.running = OrderedDict([('openvswitch-switch', True),
+                                    ('neutron-openvswitch-agent', True)])
+        self.service_state.services_running.side_effect = \
+            lambda service_names: self.running
+        self.topology = numa.NUMATopology(
+            [numa.NUMANode(0, 0xf, hugepages={2048: {'total': 512,
+                                                     'free': 12}})])
+        self.numa.NUMATopology.load.return_value = self.topology
+
+    def test_unchanged(self):
+        self.assertFalse(status_fingerprint.unchanged())
+        status_fingerprint.record(list(self.running))
+        self.assertTrue(status_fingerprint.unchanged())
+        self.service_state.services_running.assert_called_with(
+            list(self.running))
+        # free hugepages do not affect the status
+        self.topology.nodes[0].hugepages[2048]['free'] = 0
+        self.assertTrue(status_fingerprint.unchanged())
+
+    def test_changed(self):
+        status_fingerprint.record(list(self.running))
+        self.running['neutron-openvswitch-agent'] = False
+        self.assertFalse(status_fingerprint.unchanged())
+        self.running['neutron-openvswitch-agent'] = True
+        self.topology.nodes[0].hugepages[2048]['total'] = 256
+        self.assertFalse(status_fingerprint.unchanged())
+        self.topology.nodes[0].hugepages[2048]['total'] = 512
+        self.db['unit-paused'] = True
+        self.assertFalse(status_fingerprint.unchanged())
+
+    def test_expired(self):
+        status_fingerprint.record(list(self.running))
+        self.time.time.return_value += status_fingerprint.MAX_AGE + 1
+        self.assertFalse(status_fingerprint.unchanged())
+
+    def test_invalidate(self):
+        status_fingerprint.record(list(self.running))
+        status_fingerprint.invalidate()
+        self.assertFalse(status_fingerprint.unchanged())
+        status_fingerprint.invalidate()
+
+
+class TestUpdateStatus(CharmTestCase):
+
+    def setUp(self):
+        super(TestUpdateStatus, self).setUp(update_status, ['log'])
+
+    @patch.object(update_status.status_fingerprint, 'unchanged')
+    def test_unchanged(self, unchanged):
+        unchanged.return_value = True
+        hooks = MagicMock()
+        with patch.dict(sys.modules, {'neutron_ovs_hooks': hooks}):
+            update_status.main()
+        hooks.main.assert_not_called()
+
+    @patch.object(update_status.status_fingerprint, 'unchanged')
+    def test_changed(self, unchanged):
+        unchanged.return_value = False
+        hooks = MagicMock()
+        with patch.dict(sys.modules, {'neutron_ovs_hooks': hooks}):
+            update_status.main()
+        hooks.main.assert_called_once_with()
@@ -21,6 +21,9 @@ import yaml
 from contextlib import contextmanager
 from mock import patch, MagicMock
 
+import charmhelpers.core.hookenv as hookenv
+import charmhelpers.core.unitdata as unitdata
+
 
 def load_config():
     '''
@@ -63,6 +66,16 @@ class CharmTestCase(unittest.TestCase):
 
     def setUp(self, obj, patches):
         super(CharmTestCase, self).setUp()
+        # every test runs as a new hook invocation
+        hookenv.cache.clear()
+        _env = patch.dict(os.environ,
+                          {'JUJU_UNIT_NAME': 'neutron-openvswitch/0'})
+        _env.start()
+        self.addCleanup(_env.stop)
+        # and starts with empty unit data
+        _kv = patch.object(unitdata, '_KV', unitdata.Storage(':memory:'))
+        _kv.start()
+        self.addCleanup(_kv.stop)
         self.patches = patches
         self.obj = obj
         self.test_config = TestConfig()